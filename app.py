@@ -1,27 +1,71 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
-import pandas as pd
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 from datetime import datetime
+import json
 import os
-import io
 from database import (
-    init_db, get_db, get_stats,
-    insertar_banco, insertar_venta, insertar_match, insertar_match_con_codigo,
-    determinar_estado_match,
+    init_db, get_stats,
     get_matches_pendientes, get_matches_confirmados,
     get_ventas_sin_match, get_banco_sin_match,
-    aprobar_match, rechazar_match,
-    buscar_posibles_matches_para_venta, crear_match_manual,
+    aprobar_match, rechazar_match, aprobar_todos, procesar_matches_bulk,
+    crear_match_manual, crear_match_grupo,
+    get_importacion, get_importacion_activa,
+    codificar_cursor, CLAVES_PENDIENTES, CLAVES_CONFIRMADOS, CLAVES_SIN_MATCH,
     reset_database
 )
+from importador import encolar_importacion, LECTORES
+from indice_candidatos import buscar_para_venta, buscar_para_banco
+from conciliacion_automatica import conciliar_automaticamente
+from conciliacion_grupos import buscar_grupos_para_venta, buscar_grupos_para_banco
+from exportador import exportar_fusionado, FORMATOS
+import auditoria
+import metricas
+import sugerencias
+from cache_paginas import cachear_pagina
 
 app = Flask(__name__)
 app.secret_key = 'match_bancario_secret_key_2026'
+if metricas.ACTIVAS:
+    metricas.instalar(app)
 
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+init_db()
+
+
+# Direcciones de los proxies que autentican y pasan el usuario en
+# X-Remote-User, separadas por coma. De cualquier otro cliente el
+# encabezado se ignora: lo podría mandar cualquiera
+PROXIES_CONFIABLES = {ip.strip() for ip in os.environ.get('PROXIES_CONFIABLES', '').split(',') if ip.strip()}
+
+
+@app.before_request
+def identificar_usuario():
+    """Quién firma los eventos de auditoría: el usuario que autenticó el proxy o la IP"""
+    usuario = None
+    if request.remote_addr in PROXIES_CONFIABLES:
+        usuario = request.headers.get('X-Remote-User')
+    auditoria.set_usuario(usuario or request.remote_addr)
+
+
+# Rutas que cambian operaciones o matches; los POST de solo lectura
+# (buscar-matches-lote) no recalculan sugerencias
+ENDPOINTS_ESCRITURA = {
+    'upload', 'api_aprobar', 'api_rechazar', 'api_matches_bulk', 'api_aprobar_todos',
+    'api_crear_match_manual', 'api_crear_match_grupo', 'api_auto_match', 'reset',
+}
+
+
+@app.after_request
+def programar_sugerencias(response):
+    """Tras una escritura, las sugerencias se actualizan en segundo plano"""
+    if (request.method == 'POST' and request.endpoint in ENDPOINTS_ESCRITURA
+            and response.status_code < 400):
+        sugerencias.programar()
+    return response
 
 
 @app.route('/')
+@cachear_pagina
 def index():
     """Dashboard principal"""
     venta_fecha_desde = request.args.get('venta_fecha_desde')
@@ -34,178 +78,149 @@ def index():
         banco_fecha_desde=banco_fecha_desde,
         banco_fecha_hasta=banco_fecha_hasta
     )
-    return render_template('index.html', stats=stats)
+    importacion = get_importacion_activa()
+    return render_template('index.html', stats=stats, importacion=importacion)
 
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload():
     """Subir archivo fusionado"""
-    # Verificar si ya hay datos en la DB
+    # Con datos en la DB la importación es incremental: solo agrega lo nuevo
     stats = get_stats()
-    if stats['total_banco'] > 0 or stats['total_ventas'] > 0:
-        flash('Ya hay datos en la base de datos. Resetea la DB primero si quieres subir un nuevo archivo.', 'error')
+    incremental = stats['total_banco'] > 0 or stats['total_ventas'] > 0
+
+    if get_importacion_activa():
+        flash('Ya hay una importación en curso. Espera a que termine.', 'error')
         return redirect(url_for('index'))
 
     if request.method == 'POST':
-        if 'file' not in request.files:
-            flash('No se seleccionó archivo', 'error')
-            return redirect(url_for('upload'))
-
-        file = request.files['file']
-        if file.filename == '':
+        files = [f for f in request.files.getlist('file') if f.filename]
+        if not files:
             flash('No se seleccionó archivo', 'error')
             return redirect(url_for('upload'))
 
-        if not file.filename.endswith('.xlsx'):
-            flash('El archivo debe ser .xlsx', 'error')
+        extensiones = [os.path.splitext(f.filename)[1].lower() for f in files]
+        if not all(extension in LECTORES for extension in extensiones):
+            flash(f"Los archivos deben ser {', '.join(LECTORES)}", 'error')
             return redirect(url_for('upload'))
 
         try:
-            # Guardar archivo
-            filepath = os.path.join(UPLOAD_FOLDER, f'upload_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
-            file.save(filepath)
-
-            # Procesar archivo
-            result = procesar_archivo(filepath)
-
-            flash(f'Archivo procesado: {result["nuevos_banco"]} banco, {result["nuevos_ventas"]} ventas, '
-                  f'{result["confirmados"]} confirmados, {result["pendientes"]} pendientes', 'success')
+            # Guardar archivos
+            marca = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filepaths = []
+            for i, (file, extension) in enumerate(zip(files, extensiones)):
+                sufijo = f'_{i + 1}' if len(files) > 1 else ''
+                filepath = os.path.join(UPLOAD_FOLDER, f'upload_{marca}{sufijo}{extension}')
+                file.save(filepath)
+                filepaths.append(filepath)
+
+            # Encolar importación (se procesa en segundo plano; varios
+            # archivos se leen en paralelo)
+            importacion_id, creada = encolar_importacion(filepaths, incremental=incremental)
+            if not creada:
+                # Otra petición encoló una importación desde la comprobación de arriba
+                for filepath in filepaths:
+                    os.remove(filepath)
+                flash(f'Ya hay una importación en curso (#{importacion_id}). Espera a que termine.', 'error')
+                return redirect(url_for('index'))
+
+            modo = 'incremental ' if incremental else ''
+            cantidad = f'{len(files)} archivos' if len(files) > 1 else 'Archivo'
+            flash(f'{cantidad} en cola de importación {modo}(#{importacion_id})', 'success')
             return redirect(url_for('index'))
 
         except Exception as e:
             flash(f'Error procesando archivo: {str(e)}', 'error')
             return redirect(url_for('upload'))
 
-    return render_template('upload.html')
+    return render_template('upload.html', incremental=incremental)
 
 
-def procesar_archivo(filepath):
-    """Procesa el archivo fusionado e importa a SQLite"""
-    df = pd.read_excel(filepath)
+@app.route('/api/import/<int:importacion_id>')
+def api_import(importacion_id):
+    """API con el progreso de una importación: filas, filas/s y ETA"""
+    importacion = get_importacion(importacion_id)
+    if importacion is None:
+        return jsonify({'success': False, 'error': 'Importación no encontrada'}), 404
+    return jsonify(importacion)
 
-    conn = get_db()
-    result = {
-        'nuevos_banco': 0,
-        'nuevos_ventas': 0,
-        'confirmados': 0,
-        'pendientes': 0,
-        'sin_match': 0
-    }
 
-    for _, row in df.iterrows():
-        banco_id = None
-        venta_id = None
-
-        # Insertar banco si tiene datos
-        if pd.notna(row.get('row_banco')) and pd.notna(row.get('Monto_Banco')):
-            banco_id = insertar_banco(
-                conn,
-                row_original=int(row['row_banco']) if pd.notna(row['row_banco']) else None,
-                fecha=row.get('Fecha_Banco'),
-                codigo_banco=row.get('codigo_banco'),
-                nombre=row.get('Nombre_Banco'),
-                monto=row.get('Monto_Banco')
-            )
-            if banco_id:
-                result['nuevos_banco'] += 1
-
-        # Insertar venta si tiene datos
-        if pd.notna(row.get('row_venta')) and pd.notna(row.get('Monto_Venta')):
-            venta_id = insertar_venta(
-                conn,
-                row_original=int(row['row_venta']) if pd.notna(row['row_venta']) else None,
-                factura=row.get('Factura'),
-                codigo_venta=row.get('Codigo_venta'),
-                fecha=row.get('Fecha_Venta'),
-                nombre=row.get('Nombre_Venta'),
-                monto=row.get('Monto_Venta')
-            )
-            if venta_id:
-                result['nuevos_ventas'] += 1
-
-        # Crear match si hay ambos
-        if banco_id and venta_id:
-            match_tipo = row.get('Match_Tipo')
-            confianza = row.get('Confianza')
-            match_code_existente = row.get('Match_Code')
-
-            # Si ya tiene Match_Code, es CONFIRMADO automáticamente
-            if pd.notna(match_code_existente) and str(match_code_existente).strip():
-                estado = 'CONFIRMADO'
-                match_id = insertar_match_con_codigo(
-                    conn, banco_id, venta_id, match_tipo, confianza,
-                    estado, str(match_code_existente).strip()
-                )
-                if match_id:
-                    result['confirmados'] += 1
-            else:
-                # Sin Match_Code, evaluar según reglas
-                estado = determinar_estado_match(match_tipo, confianza)
-                if estado:
-                    match_id = insertar_match(conn, banco_id, venta_id, match_tipo, confianza, estado)
-                    if match_id:
-                        if estado == 'CONFIRMADO':
-                            result['confirmados'] += 1
-                        else:
-                            result['pendientes'] += 1
-                else:
-                    result['sin_match'] += 1
-
-    conn.commit()
-    conn.close()
-    return result
+def _paginacion(filas, claves, total, limit, page):
+    """Cursores de las páginas anterior y siguiente y total de páginas del listado"""
+    return {
+        # A la primera página se vuelve sin cursor
+        'anterior': codificar_cursor(filas[0], claves) if filas and page > 2 else None,
+        'siguiente': codificar_cursor(filas[-1], claves) if len(filas) == limit else None,
+        'total_paginas': max(1, -(-total // limit))
+    }
 
 
 @app.route('/pendientes')
+@cachear_pagina
 def pendientes():
     """Lista de matches pendientes de aprobación"""
     page = request.args.get('page', 1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     limit = 20
     offset = (page - 1) * limit
 
-    matches = get_matches_pendientes(limit=limit, offset=offset)
+    matches = get_matches_pendientes(limit=limit, offset=offset, after=after, before=before)
     stats = get_stats()
+    paginacion = _paginacion(matches, CLAVES_PENDIENTES, stats['pendientes'], limit, page)
 
-    return render_template('pendientes.html', matches=matches, stats=stats, page=page)
+    return render_template('pendientes.html', matches=matches, stats=stats, page=page, paginacion=paginacion)
 
 
 @app.route('/confirmados')
+@cachear_pagina
 def confirmados():
     """Lista de matches confirmados"""
     page = request.args.get('page', 1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     limit = 20
     offset = (page - 1) * limit
 
-    matches = get_matches_confirmados(limit=limit, offset=offset)
+    matches = get_matches_confirmados(limit=limit, offset=offset, after=after, before=before)
     stats = get_stats()
+    paginacion = _paginacion(matches, CLAVES_CONFIRMADOS, stats['confirmados'], limit, page)
 
-    return render_template('confirmados.html', matches=matches, stats=stats, page=page)
+    return render_template('confirmados.html', matches=matches, stats=stats, page=page, paginacion=paginacion)
 
 
 @app.route('/sin-match/ventas')
+@cachear_pagina
 def sin_match_ventas():
     """Lista de ventas sin match"""
     page = request.args.get('page', 1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     limit = 20
     offset = (page - 1) * limit
 
-    ventas = get_ventas_sin_match(limit=limit, offset=offset)
+    ventas = get_ventas_sin_match(limit=limit, offset=offset, after=after, before=before)
     stats = get_stats()
+    paginacion = _paginacion(ventas, CLAVES_SIN_MATCH, stats['ventas_sin_match'], limit, page)
 
-    return render_template('sin_match_ventas.html', ventas=ventas, stats=stats, page=page)
+    return render_template('sin_match_ventas.html', ventas=ventas, stats=stats, page=page, paginacion=paginacion)
 
 
 @app.route('/sin-match/banco')
+@cachear_pagina
 def sin_match_banco():
     """Lista de operaciones de banco sin match"""
     page = request.args.get('page', 1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     limit = 20
     offset = (page - 1) * limit
 
-    banco = get_banco_sin_match(limit=limit, offset=offset)
+    banco = get_banco_sin_match(limit=limit, offset=offset, after=after, before=before)
     stats = get_stats()
+    paginacion = _paginacion(banco, CLAVES_SIN_MATCH, stats['banco_sin_match'], limit, page)
 
-    return render_template('sin_match_banco.html', banco=banco, stats=stats, page=page)
+    return render_template('sin_match_banco.html', banco=banco, stats=stats, page=page, paginacion=paginacion)
 
 
 @app.route('/api/aprobar/<int:match_id>', methods=['POST'])
@@ -234,24 +249,78 @@ def api_buscar_matches(venta_id):
         'nombre': request.args.get('nombre', 'false').lower() == 'true',
         'codigo': request.args.get('codigo', 'false').lower() == 'true'
     }
-    posibles = buscar_posibles_matches_para_venta(venta_id, criterios)
+    posibles = buscar_para_venta(venta_id, criterios)
     return jsonify(posibles)
 
 
 @app.route('/api/buscar-matches-banco/<int:banco_id>')
 def api_buscar_matches_banco(banco_id):
     """API para buscar posibles matches para una operación de banco"""
-    from database import buscar_posibles_matches_para_banco
     criterios = {
         'monto': request.args.get('monto', 'exacto'),
         'fecha': int(request.args.get('fecha', 7)) if request.args.get('fecha') else None,
         'nombre': request.args.get('nombre', 'false').lower() == 'true',
         'codigo': request.args.get('codigo', 'false').lower() == 'true'
     }
-    posibles = buscar_posibles_matches_para_banco(banco_id, criterios)
+    posibles = buscar_para_banco(banco_id, criterios)
     return jsonify(posibles)
 
 
+# Límites de una búsqueda en lote (ids x juegos de criterios)
+MAX_IDS_LOTE = 200
+MAX_CRITERIOS_LOTE = 8
+MAX_LIMIT_LOTE = 100
+
+BUSQUEDAS_LOTE = {'ventas': buscar_para_venta, 'banco': buscar_para_banco}
+
+
+def _criterios_lote(datos):
+    """Un juego de criterios de la búsqueda en lote (fecha vacía = cualquiera)"""
+    fecha = datos.get('fecha')
+    return {
+        'monto': datos.get('monto', 'exacto'),
+        'fecha': int(fecha) if fecha not in (None, '') else None,
+        'nombre': bool(datos.get('nombre')),
+        'codigo': bool(datos.get('codigo'))
+    }
+
+
+@app.route('/api/buscar-matches-lote', methods=['POST'])
+def api_buscar_matches_lote():
+    """
+    API para buscar posibles matches de varias operaciones y juegos de
+    criterios en una petición. Responde NDJSON, una línea por combinación
+    {id, criterios, resultados} a medida que se calcula.
+    """
+    data = request.get_json(silent=True) or {}
+    buscar = BUSQUEDAS_LOTE.get(data.get('lado'))
+    ids = data.get('ids') or []
+    juegos = data.get('criterios') or [{}]
+    if buscar is None:
+        return jsonify({'success': False, 'error': "lado debe ser 'ventas' o 'banco'"}), 400
+    if not isinstance(ids, list) or not isinstance(juegos, list):
+        return jsonify({'success': False, 'error': 'ids y criterios deben ser listas'}), 400
+    if len(ids) > MAX_IDS_LOTE or len(juegos) > MAX_CRITERIOS_LOTE:
+        return jsonify({'success': False, 'error': f'Máximo {MAX_IDS_LOTE} ids y {MAX_CRITERIOS_LOTE} criterios'}), 400
+    try:
+        ids = [int(i) for i in ids]
+        juegos = [_criterios_lote(c) for c in juegos]
+        limit = int(data.get('limit', 10))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Parámetros inválidos'}), 400
+    # Se valida antes de responder: un error a mitad del stream lo cortaría sin aviso
+    if not 1 <= limit <= MAX_LIMIT_LOTE:
+        return jsonify({'success': False, 'error': f'limit debe estar entre 1 y {MAX_LIMIT_LOTE}'}), 400
+
+    def generar():
+        for i, criterios in enumerate(juegos):
+            for row_id in ids:
+                resultados = buscar(row_id, criterios, limit)
+                yield json.dumps({'id': row_id, 'criterios': i, 'resultados': resultados}) + '\n'
+
+    return Response(generar(), mimetype='application/x-ndjson')
+
+
 @app.route('/api/crear-match-manual', methods=['POST'])
 def api_crear_match_manual():
     """API para crear match manual"""
@@ -269,25 +338,90 @@ def api_crear_match_manual():
     return jsonify({'success': True, 'match_id': match_id})
 
 
+def _criterios_grupo():
+    """Criterios de búsqueda de grupos desde los query params"""
+    return {
+        'monto': request.args.get('monto', 'exacto'),
+        'fecha': int(request.args.get('fecha', 7)),
+        'nombre': request.args.get('nombre', 'false').lower() == 'true',
+        'elementos': int(request.args.get('elementos', 4))
+    }
+
+
+@app.route('/api/buscar-grupos/<int:venta_id>')
+def api_buscar_grupos(venta_id):
+    """API para buscar combinaciones de operaciones de banco que suman una venta"""
+    try:
+        return jsonify(buscar_grupos_para_venta(venta_id, _criterios_grupo()))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/buscar-grupos-banco/<int:banco_id>')
+def api_buscar_grupos_banco(banco_id):
+    """API para buscar combinaciones de ventas que suman una operación de banco"""
+    try:
+        return jsonify(buscar_grupos_para_banco(banco_id, _criterios_grupo()))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
+@app.route('/api/crear-match-grupo', methods=['POST'])
+def api_crear_match_grupo():
+    """API para crear un match de grupo (un banco con varias ventas o al revés)"""
+    data = request.get_json(silent=True) or {}
+    grupo_id, error = crear_match_grupo(data.get('banco_ids') or [], data.get('venta_ids') or [])
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+
+    return jsonify({'success': True, 'grupo_id': grupo_id})
+
+
 @app.route('/api/aprobar-todos', methods=['POST'])
 def api_aprobar_todos():
     """API para aprobar todos los matches pendientes"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE matches
-        SET estado = 'CONFIRMADO', confirmed_at = ?
-        WHERE estado = 'PENDIENTE'
-    ''', (datetime.now().isoformat(),))
-    conn.commit()
-    affected = cursor.rowcount
-    conn.close()
-    return jsonify({'success': True, 'aprobados': affected})
+    return jsonify({'success': True, 'aprobados': aprobar_todos()})
+
+
+@app.route('/api/matches/bulk', methods=['POST'])
+def api_matches_bulk():
+    """API para aprobar o rechazar en lote matches pendientes (por ids y/o filtros)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        resultado = procesar_matches_bulk(data.get('accion'), ids=data.get('ids'), filtros=data.get('filtros'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, **resultado})
+
+
+@app.route('/api/auto-match', methods=['POST'])
+def api_auto_match():
+    """API para crear matches pendientes automáticamente entre operaciones sin match"""
+    if get_importacion_activa():
+        return jsonify({'success': False, 'error': 'Hay una importación en curso'}), 409
+
+    data = request.get_json(silent=True) or {}
+    criterios = {
+        'monto': data.get('monto', 'exacto'),
+        'fecha': data.get('fecha', 7),
+        'nombre': bool(data.get('nombre', False)),
+        'codigo': bool(data.get('codigo', False))
+    }
+    try:
+        resultado = conciliar_automaticamente(criterios)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, **resultado})
 
 
 @app.route('/reset', methods=['POST'])
 def reset():
     """Resetea la base de datos"""
+    if get_importacion_activa():
+        flash('No se puede resetear durante una importación', 'error')
+        return redirect(url_for('index'))
     reset_database()
     flash('Base de datos reseteada', 'success')
     return redirect(url_for('index'))
@@ -295,147 +429,27 @@ def reset():
 
 @app.route('/descargar-fusionado')
 def descargar_fusionado():
-    """Descarga archivo fusionado con los matches actuales"""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    fusionado = []
-
-    # 1. Obtener matches confirmados
-    cursor.execute('''
-        SELECT
-            v.row_original as row_venta, v.factura, v.codigo_venta, v.fecha as fecha_venta,
-            v.nombre as nombre_venta, v.monto as monto_venta,
-            b.row_original as row_banco, b.fecha as fecha_banco, b.codigo_banco,
-            b.nombre as nombre_banco, b.monto as monto_banco,
-            m.match_tipo, m.confianza, m.match_code
-        FROM matches m
-        JOIN operaciones_ventas v ON m.venta_id = v.id
-        JOIN operaciones_banco b ON m.banco_id = b.id
-        WHERE m.estado = 'CONFIRMADO'
-    ''')
-    for row in cursor.fetchall():
-        fusionado.append({
-            'row_venta': row['row_venta'],
-            'Factura': row['factura'],
-            'Codigo_venta': row['codigo_venta'],
-            'Fecha_Venta': row['fecha_venta'],
-            'Nombre_Venta': row['nombre_venta'],
-            'Monto_Venta': row['monto_venta'],
-            'row_banco': row['row_banco'],
-            'Fecha_Banco': row['fecha_banco'],
-            'codigo_banco': row['codigo_banco'],
-            'Nombre_Banco': row['nombre_banco'],
-            'Monto_Banco': row['monto_banco'],
-            'Match_Tipo': row['match_tipo'],
-            'Confianza': row['confianza'],
-            'Match_Code': row['match_code']
-        })
-
-    # 2. Obtener matches pendientes
-    cursor.execute('''
-        SELECT
-            v.row_original as row_venta, v.factura, v.codigo_venta, v.fecha as fecha_venta,
-            v.nombre as nombre_venta, v.monto as monto_venta,
-            b.row_original as row_banco, b.fecha as fecha_banco, b.codigo_banco,
-            b.nombre as nombre_banco, b.monto as monto_banco,
-            m.match_tipo, m.confianza
-        FROM matches m
-        JOIN operaciones_ventas v ON m.venta_id = v.id
-        JOIN operaciones_banco b ON m.banco_id = b.id
-        WHERE m.estado = 'PENDIENTE'
-    ''')
-    for row in cursor.fetchall():
-        fusionado.append({
-            'row_venta': row['row_venta'],
-            'Factura': row['factura'],
-            'Codigo_venta': row['codigo_venta'],
-            'Fecha_Venta': row['fecha_venta'],
-            'Nombre_Venta': row['nombre_venta'],
-            'Monto_Venta': row['monto_venta'],
-            'row_banco': row['row_banco'],
-            'Fecha_Banco': row['fecha_banco'],
-            'codigo_banco': row['codigo_banco'],
-            'Nombre_Banco': row['nombre_banco'],
-            'Monto_Banco': row['monto_banco'],
-            'Match_Tipo': row['match_tipo'],
-            'Confianza': row['confianza'],
-            'Match_Code': None  # Pendientes no tienen código aún
-        })
-
-    # 3. Obtener ventas sin match
-    cursor.execute('''
-        SELECT v.*
-        FROM operaciones_ventas v
-        LEFT JOIN matches m ON v.id = m.venta_id
-        WHERE m.id IS NULL
-    ''')
-    for row in cursor.fetchall():
-        fusionado.append({
-            'row_venta': row['row_original'],
-            'Factura': row['factura'],
-            'Codigo_venta': row['codigo_venta'],
-            'Fecha_Venta': row['fecha'],
-            'Nombre_Venta': row['nombre'],
-            'Monto_Venta': row['monto'],
-            'row_banco': None,
-            'Fecha_Banco': None,
-            'codigo_banco': None,
-            'Nombre_Banco': None,
-            'Monto_Banco': None,
-            'Match_Tipo': 'SIN_MATCH',
-            'Confianza': None,
-            'Match_Code': None
-        })
-
-    # 4. Obtener banco sin match
-    cursor.execute('''
-        SELECT b.*
-        FROM operaciones_banco b
-        LEFT JOIN matches m ON b.id = m.banco_id
-        WHERE m.id IS NULL
-    ''')
-    for row in cursor.fetchall():
-        fusionado.append({
-            'row_venta': None,
-            'Factura': None,
-            'Codigo_venta': None,
-            'Fecha_Venta': None,
-            'Nombre_Venta': None,
-            'Monto_Venta': None,
-            'row_banco': row['row_original'],
-            'Fecha_Banco': row['fecha'],
-            'codigo_banco': row['codigo_banco'],
-            'Nombre_Banco': row['nombre'],
-            'Monto_Banco': row['monto'],
-            'Match_Tipo': 'SIN_MATCH',
-            'Confianza': None,
-            'Match_Code': None
-        })
-
-    conn.close()
-
-    # Crear DataFrame y exportar
-    df = pd.DataFrame(fusionado)
-
-    # Ordenar: confirmados primero, luego pendientes, luego sin match
-    df['_orden'] = df['Match_Code'].apply(lambda x: 0 if pd.notna(x) else (1 if x is None else 2))
-    df = df.sort_values('_orden').drop('_orden', axis=1)
-
-    # Crear archivo Excel en memoria
-    output = io.BytesIO()
-    df.to_excel(output, index=False)
-    output.seek(0)
+    """Descarga archivo fusionado con los matches actuales (xlsx, csv, parquet o arrow)"""
+    formato = request.args.get('formato', 'xlsx')
+    if formato not in FORMATOS:
+        return jsonify({'success': False, 'error': f'Formato no soportado: {formato}'}), 400
 
+    mimetype, extension = FORMATOS[formato]
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'fusionado_matches_{timestamp}.xlsx'
+    return Response(
+        exportar_fusionado(formato),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=fusionado_matches_{timestamp}.{extension}'}
     )
 
 
+@app.route('/metrics')
+def metrics():
+    """Métricas de consultas y peticiones en formato Prometheus (METRICAS_ACTIVAS=1)"""
+    if not metricas.ACTIVAS:
+        return jsonify({'success': False, 'error': 'Métricas desactivadas'}), 404
+    return Response(metricas.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
-    init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,133 @@
+"""
+Registro de auditoría de las decisiones sobre matches.
+
+Las funciones de escritura de database leen, dentro de su transacción, los
+pares (banco, venta) que cambian y al confirmar los pasan a registrar().
+Los eventos quedan en una cola local del proceso y un hilo de fondo los
+escribe en la tabla eventos en lotes (cada SEGUNDOS_ENTRE_ESCRITURAS o al
+juntar EVENTOS_POR_ESCRITURA), con un executemany en una sola transacción:
+la petición no espera la escritura. Al salir del proceso se vacía lo que
+quede pendiente.
+
+La tabla es de solo agregado (triggers que impiden UPDATE y DELETE) y
+reset_database no la toca. Cada evento identifica las operaciones por su
+hash_unico, que no cambia al reimportar los mismos archivos: con
+database.reaplicar_decisiones se vuelve a aplicar la última decisión de
+cada par sobre una base recién importada.
+
+Acciones: CREAR_MANUAL, CREAR_GRUPO, APROBAR y RECHAZAR (una fila por par)
+y RESET y REAPLICAR (sin par). La conciliación automática no se registra
+porque se puede volver a correr; la aprobación de sus matches sí.
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+EVENTOS_POR_ESCRITURA = 500
+SEGUNDOS_ENTRE_ESCRITURAS = 1.0
+
+COLUMNAS_EVENTO = (
+    'creado_en', 'usuario', 'accion', 'origen', 'estado',
+    'match_code', 'grupo_code', 'grupo_tipo', 'banco_hash', 'venta_hash', 'match_tipo', 'confianza',
+)
+
+# Quién hace la petición o corre el comando: lo fija la web en cada
+# petición y la CLI al arrancar
+_contexto = threading.local()
+
+
+def set_usuario(usuario):
+    _contexto.usuario = usuario
+
+
+def usuario_actual():
+    return getattr(_contexto, 'usuario', None)
+
+
+_pendientes = deque()
+_lock = threading.Lock()
+# Solo una escritura a la vez, para que los lotes queden en orden
+_lock_escritura = threading.Lock()
+_hay_eventos = threading.Event()
+_lote_lleno = threading.Event()
+_hilo = None
+
+
+def registrar(accion, origen, pares=((None,) * 7,), estado=None):
+    """
+    Encola un evento por par. Cada par es (match_code, grupo_code,
+    grupo_tipo, banco_hash, venta_hash, match_tipo, confianza); estado es
+    el del par después de la decisión (None si se eliminó).
+    """
+    global _hilo
+    creado_en = datetime.now().isoformat()
+    usuario = usuario_actual()
+    eventos = [(creado_en, usuario, accion, origen, estado, *par) for par in pares]
+    if not eventos:
+        return
+    with _lock:
+        _pendientes.extend(eventos)
+        lleno = len(_pendientes) >= EVENTOS_POR_ESCRITURA
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_trabajar, name='auditoria', daemon=True)
+            _hilo.start()
+    _hay_eventos.set()
+    if lleno:
+        _lote_lleno.set()
+
+
+def vaciar():
+    """Escribe ya los eventos pendientes en una transacción; devuelve cuántos"""
+    # database importa este módulo: la conexión se pide recién al escribir
+    from database import get_db
+
+    with _lock_escritura:
+        with _lock:
+            eventos = list(_pendientes)
+            _pendientes.clear()
+        if not eventos:
+            return 0
+        conn = get_db()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(f'''
+                INSERT INTO eventos ({", ".join(COLUMNAS_EVENTO)})
+                VALUES ({", ".join("?" * len(COLUMNAS_EVENTO))})
+            ''', eventos)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Vuelven al frente de la cola para el próximo intento
+            with _lock:
+                _pendientes.extendleft(reversed(eventos))
+            raise
+        finally:
+            conn.close()
+    return len(eventos)
+
+
+def _trabajar():
+    while True:
+        _hay_eventos.wait()
+        # Junta lo que llegue en el intervalo, salvo que el lote ya esté lleno
+        _lote_lleno.wait(SEGUNDOS_ENTRE_ESCRITURAS)
+        _hay_eventos.clear()
+        _lote_lleno.clear()
+        try:
+            vaciar()
+        except Exception as e:
+            print(f"Error al escribir eventos de auditoría: {e}")
+            _hay_eventos.set()
+            time.sleep(SEGUNDOS_ENTRE_ESCRITURAS)
+
+
+@atexit.register
+def _vaciar_al_salir():
+    try:
+        vaciar()
+    except Exception as e:
+        print(f"Error al escribir eventos de auditoría: {e}")
@@ -0,0 +1,122 @@
+"""
+Benchmark: aprobaciones concurrentes de matches.
+
+Varios hilos aprueban matches pendientes (como clicks simultáneos en
+gunicorn con --threads) mientras otros leen el listado de pendientes.
+Compara la conexión antigua (una conexión nueva por llamada, journal
+rollback) con el pool de conexiones en WAL.
+
+Uso:
+    python -m benchmarks.aprobar_concurrente [--matches 3000] [--hilos 8] [--lectores 2]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import auditoria
+import database
+
+
+def conexion_antigua():
+    """get_db anterior al pool: conexión nueva, sin pragmas"""
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def preparar_base(ruta, cantidad, journal_mode):
+    """Crea una base con `cantidad` matches pendientes"""
+    database.DATABASE_PATH = ruta
+    database.init_db()
+    database.cerrar_conexiones()
+    conn = sqlite3.connect(ruta)
+    conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+    conn.executemany(
+        'INSERT INTO operaciones_banco (hash_unico, fecha, monto) VALUES (?, ?, ?)',
+        [(f'b{i}', '2024-01-01', i) for i in range(cantidad)]
+    )
+    conn.executemany(
+        'INSERT INTO operaciones_ventas (hash_unico, fecha, monto) VALUES (?, ?, ?)',
+        [(f'v{i}', '2024-01-01', i) for i in range(cantidad)]
+    )
+    conn.execute('''
+        INSERT INTO matches (match_code, banco_id, venta_id, match_tipo, confianza, estado)
+        SELECT 'M' || b.id, b.id, b.id, 'MEDIO', 'MEDIO', 'PENDIENTE' FROM operaciones_banco b
+    ''')
+    conn.commit()
+    ids = [row[0] for row in conn.execute('SELECT id FROM matches')]
+    conn.close()
+    return ids
+
+
+def ejecutar(ids, hilos, lectores):
+    """Aprueba todos los ids repartidos entre hilos; devuelve (segundos, errores)"""
+    errores = []
+    terminado = threading.Event()
+
+    def aprobar(lote):
+        for match_id in lote:
+            try:
+                database.aprobar_match(match_id)
+            except sqlite3.OperationalError as e:
+                errores.append(str(e))
+
+    def leer():
+        while not terminado.is_set():
+            try:
+                database.get_matches_pendientes(limit=20)
+            except sqlite3.OperationalError as e:
+                errores.append(str(e))
+
+    escritores = [threading.Thread(target=aprobar, args=(ids[i::hilos],)) for i in range(hilos)]
+    hilos_lectores = [threading.Thread(target=leer) for _ in range(lectores)]
+    inicio = time.perf_counter()
+    for hilo in hilos_lectores + escritores:
+        hilo.start()
+    for hilo in escritores:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+    terminado.set()
+    for hilo in hilos_lectores:
+        hilo.join()
+    return segundos, errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--matches', type=int, default=3000)
+    parser.add_argument('--hilos', type=int, default=8)
+    parser.add_argument('--lectores', type=int, default=2)
+    args = parser.parse_args()
+
+    get_db_pool = database.get_db
+    with tempfile.TemporaryDirectory() as carpeta:
+        for modo, journal_mode, get_db in (
+            ('antes (conexión por llamada, rollback journal)', 'DELETE', conexion_antigua),
+            ('después (pool, WAL)', 'WAL', get_db_pool),
+        ):
+            database.get_db = get_db_pool
+            ids = preparar_base(os.path.join(carpeta, f'{journal_mode}.db'), args.matches, journal_mode)
+            database.get_db = get_db
+            segundos, errores = ejecutar(ids, args.hilos, args.lectores)
+            database.get_db = get_db_pool
+            # Los eventos de auditoría van a esta base antes de pasar a la
+            # siguiente o de borrar la carpeta
+            auditoria.vaciar()
+
+            conn = sqlite3.connect(database.DATABASE_PATH)
+            aprobados = conn.execute("SELECT COUNT(*) FROM matches WHERE estado = 'CONFIRMADO'").fetchone()[0]
+            conn.close()
+            print(f"{modo}: {aprobados}/{len(ids)} aprobados en {segundos:.2f}s "
+                  f"({aprobados / segundos:.0f} aprobaciones/s), {len(errores)} errores")
+            if errores:
+                print(f"  ej.: {errores[0]}")
+        database.cerrar_conexiones()
+
+
+if __name__ == '__main__':
+    main()
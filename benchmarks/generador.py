@@ -0,0 +1,160 @@
+"""
+Generador de archivos fusionados sintéticos para los benchmarks.
+
+Produce DataFrames con las columnas del archivo fusionado y distribuciones
+parecidas a un extracto real: montos log-normales con una parte de montos
+redondos, fechas de venta en días hábiles con el banco acreditando 0-5 días
+después, nombres con variaciones de mayúsculas y tildes entre venta y
+banco, y una mezcla de Match_Tipo/Confianza que cubre todas las reglas de
+determinar_estado_match.
+
+Uso:
+    python -m benchmarks.generador 100000 fusionado_100k.xlsx
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from exportador import COLUMNAS_FUSIONADO
+
+
+NOMBRES = ['Juan', 'María', 'José', 'Ana', 'Carlos', 'Luisa', 'Pedro', 'Carmen', 'Jorge', 'Elena',
+           'Miguel', 'Rosa', 'Luis', 'Sofía', 'Andrés', 'Lucía']
+APELLIDOS = ['Pérez', 'López', 'García', 'Martínez', 'Gómez', 'Díaz', 'Ruiz', 'Hernández',
+             'Torres', 'Ramírez', 'Flores', 'Castro', 'Vargas', 'Rojas']
+EMPRESAS = ['Acme S.A.', 'Distribuidora Norte SRL', 'Comercial del Sur', 'Servicios Integrales SA']
+
+# (Match_Tipo, Confianza, peso). Las filas SIN_MATCH solo tienen venta y
+# las SIN_MATCH_BANCO solo banco.
+MEZCLA_MATCH = [
+    ('CODIGO_MONTO_EXACTO', 'ALTO', 0.30),
+    ('CODIGO_EXACTO', 'ALTO', 0.08),
+    ('CODIGO_EXACTO', 'MEDIO (33%)', 0.04),
+    ('MONTO_FECHA', 'MEDIO (100%)', 0.10),
+    ('MONTO_FECHA', 'MEDIO (50%)', 0.10),
+    ('MONTO_FECHA', 'MEDIO (33%)', 0.04),
+    ('MONTO_UNICO', 'BAJO', 0.04),
+    ('MONTO_FECHA', 'MUY_BAJO', 0.03),
+    ('SIN_MATCH', None, 0.14),
+    ('SIN_MATCH_BANCO', None, 0.13),
+]
+
+MONTOS_REDONDOS = np.array([50, 100, 150, 200, 250, 500, 1000, 1500, 2000, 5000], dtype=float)
+
+FECHA_INICIO = '2025-01-01'
+DIAS_HABILES = 260
+
+FILAS_POR_BLOQUE = 50000
+
+
+def _nombres(rng, n):
+    """Nombres de personas y algunas empresas"""
+    personas = np.char.add(
+        np.char.add(rng.choice(NOMBRES, n), ' '),
+        rng.choice(APELLIDOS, n)
+    ).astype(object)
+    empresas = rng.random(n) < 0.1
+    personas[empresas] = rng.choice(EMPRESAS, int(empresas.sum()))
+    return personas
+
+
+def _variante_banco(nombres, rng):
+    """El banco suele traer el nombre en mayúsculas y sin tildes"""
+    sin_tildes = pd.Series(nombres).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+    mayusculas = rng.random(len(nombres)) < 0.7
+    return np.where(mayusculas, sin_tildes.str.upper(), nombres)
+
+
+def generar_bloque(n, rng, fila_inicial=0):
+    """Genera un DataFrame de n filas del archivo fusionado"""
+    pesos = np.array([p for _, _, p in MEZCLA_MATCH])
+    tipo = rng.choice(len(MEZCLA_MATCH), n, p=pesos / pesos.sum())
+    match_tipo = np.array([t for t, _, _ in MEZCLA_MATCH], dtype=object)[tipo]
+    confianza = np.array([c for _, c, _ in MEZCLA_MATCH], dtype=object)[tipo]
+    tiene_venta = match_tipo != 'SIN_MATCH_BANCO'
+    tiene_banco = match_tipo != 'SIN_MATCH'
+
+    # Montos log-normales (mediana ~800) con 15% de montos redondos
+    monto = np.round(rng.lognormal(np.log(800), 1.0, n), 2)
+    redondos = rng.random(n) < 0.15
+    monto[redondos] = rng.choice(MONTOS_REDONDOS, int(redondos.sum()))
+    # Los matches de confianza media no siempre coinciden al centavo
+    medio = np.array([str(c).startswith('MEDIO') and c != 'MEDIO (100%)' for c in confianza])
+    ajuste = np.where(medio & (rng.random(n) < 0.5), rng.uniform(0.97, 1.03, n), 1.0)
+    monto_banco = np.round(monto * ajuste, 2)
+
+    # Fechas de venta en días hábiles; el banco acredita 0-5 días después
+    habiles = pd.bdate_range(FECHA_INICIO, periods=DIAS_HABILES)
+    fecha_venta = habiles[rng.integers(0, DIAS_HABILES, n)]
+    fecha_banco = fecha_venta + pd.to_timedelta(np.minimum(rng.geometric(0.55, n) - 1, 5), unit='D')
+
+    nombre_venta = _nombres(rng, n)
+    nombre_banco = _nombres(rng, n)
+    mismo_cliente = rng.random(n) < 0.8
+    nombre_banco[mismo_cliente] = _variante_banco(nombre_venta[mismo_cliente], rng)
+
+    numero = rng.integers(0, 1_000_000, n)
+    filas = np.arange(fila_inicial, fila_inicial + n) + 2
+
+    df = pd.DataFrame({
+        'row_venta': np.where(tiene_venta, filas, np.nan),
+        'Factura': np.where(tiene_venta, [f'F{i:08d}' for i in filas], None),
+        'Codigo_venta': np.where(tiene_venta, [f'TRF-{c:06d}' for c in numero], None),
+        'Fecha_Venta': pd.Series(fecha_venta).where(tiene_venta),
+        'Nombre_Venta': np.where(tiene_venta, nombre_venta, None),
+        'Monto_Venta': np.where(tiene_venta, monto, np.nan),
+        'row_banco': np.where(tiene_banco, filas, np.nan),
+        'Fecha_Banco': pd.Series(fecha_banco).where(tiene_banco),
+        'codigo_banco': np.where(tiene_banco, [f'TRF{c:06d}' for c in numero], None),
+        'Nombre_Banco': np.where(tiene_banco, nombre_banco, None),
+        'Monto_Banco': np.where(tiene_banco, monto_banco, np.nan),
+        'Match_Tipo': match_tipo,
+        'Confianza': confianza,
+        'Match_Code': None,
+    }, columns=COLUMNAS_FUSIONADO)
+
+    # Parte de los matches de código ya se confirmaron en un ciclo anterior
+    con_codigo = (confianza == 'ALTO') & (rng.random(n) < 0.2)
+    df.loc[con_codigo, 'Match_Code'] = [f'H{i:07d}' for i in filas[con_codigo]]
+    return df
+
+
+def generar_fusionado(n, semilla=42, filas_por_bloque=FILAS_POR_BLOQUE):
+    """Genera el archivo fusionado de n filas como bloques de DataFrames"""
+    rng = np.random.default_rng(semilla)
+    for inicio in range(0, n, filas_por_bloque):
+        yield generar_bloque(min(filas_por_bloque, n - inicio), rng, fila_inicial=inicio)
+
+
+def escribir_xlsx(bloques, ruta):
+    """Escribe los bloques en un xlsx con un libro write-only"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    ws.append(COLUMNAS_FUSIONADO)
+    for df in bloques:
+        df = df.astype(object).where(df.notna(), None)
+        for col in ('Fecha_Venta', 'Fecha_Banco'):
+            df[col] = [f.to_pydatetime() if f is not None else None for f in df[col]]
+        for fila in df.itertuples(index=False):
+            ws.append(fila)
+    wb.save(ruta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filas', type=int)
+    parser.add_argument('salida')
+    parser.add_argument('--semilla', type=int, default=42)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    escribir_xlsx(generar_fusionado(args.filas, args.semilla), args.salida)
+    print(f"{args.filas} filas escritas en {args.salida} ({time.perf_counter() - inicio:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
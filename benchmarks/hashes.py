@@ -0,0 +1,135 @@
+"""
+Verificación: los hashes de la importación por bloques coinciden con los de
+pd.read_excel.
+
+hash_unico identifica una operación entre importaciones, así que tiene que
+salir igual que con la importación original (pd.read_excel del archivo
+entero y una fila a la vez) y no puede depender del tamaño de los bloques.
+Sin archivos, arma libros con los casos que cambian el tipo de una columna
+según el bloque: códigos y facturas numéricos, un texto perdido en una
+columna numérica, vacíos solo al final, montos enteros sin vacíos y una
+fila vacía intermedia.
+
+Uso:
+    python -m benchmarks.hashes [archivo.xlsx ...] [--bloques 997 5000 100000]
+
+Termina con código 1 si algún hash difiere.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from openpyxl import Workbook
+
+from database import generar_hash_banco, generar_hash_venta
+from exportador import COLUMNAS_FUSIONADO
+from importador import leer_por_bloques, preparar_bloque
+
+
+def _fila(i, n, variante):
+    fecha = datetime(2025, 1, 1) + timedelta(days=i % 200)
+    con_banco = i < n * 0.92 or variante == 'sin_vacios'
+    con_venta = i < n * 0.85 or i >= n * 0.92 or variante == 'sin_vacios'
+    venta = [
+        i + 2, 100000 + i,
+        # Texto numérico al principio, enteros después y un vacío al final
+        f'{i:06d}' if i < n // 2 else (i if i < n - 5 else None),
+        fecha, f'Cliente {i % 97}', float(100 + i % 50),
+    ] if con_venta else [None] * 6
+    banco = [
+        i + 2, fecha + timedelta(days=i % 3),
+        # Un solo texto en una columna de números
+        'REF-X' if i == n * 3 // 4 else 5000 + i,
+        f'CLIENTE {i % 97}', float(100 + i % 50),
+    ] if con_banco else [None] * 5
+    match = ['MONTO_FECHA', 'MEDIO (50%)', None] if con_banco and con_venta else [None] * 3
+    return venta + banco + match
+
+
+def escribir_casos(carpeta, filas):
+    """Escribe los libros de prueba y devuelve sus rutas"""
+    rutas = []
+    for variante in ('sin_vacios', 'vacios_al_final', 'fila_vacia'):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
+        ws.append(COLUMNAS_FUSIONADO)
+        for i in range(filas):
+            if variante == 'fila_vacia' and i == filas // 3:
+                ws.append([None] * len(COLUMNAS_FUSIONADO))
+            ws.append(_fila(i, filas, variante))
+        # Filas vacías al final: pd.read_excel las descarta
+        ws.append([None] * len(COLUMNAS_FUSIONADO))
+        ruta = os.path.join(carpeta, f'{variante}.xlsx')
+        wb.save(ruta)
+        rutas.append(ruta)
+    return rutas
+
+
+def hashes_read_excel(ruta):
+    """Hashes como los calculaba la importación original, fila por fila"""
+    df = pd.read_excel(ruta)
+    banco, ventas = [], []
+    for _, row in df.iterrows():
+        if pd.notna(row.get('row_banco')) and pd.notna(row.get('Monto_Banco')):
+            fecha = row.get('Fecha_Banco')
+            banco.append(generar_hash_banco(str(fecha)[:10] if fecha is not None else None,
+                                            row.get('Monto_Banco'), row.get('codigo_banco'), row.get('Nombre_Banco')))
+        else:
+            banco.append(None)
+        if pd.notna(row.get('row_venta')) and pd.notna(row.get('Monto_Venta')):
+            fecha = row.get('Fecha_Venta')
+            ventas.append(generar_hash_venta(row.get('Factura'), str(fecha)[:10] if fecha is not None else None,
+                                             row.get('Monto_Venta'), row.get('Nombre_Venta'), row.get('Codigo_venta')))
+        else:
+            ventas.append(None)
+    return banco, ventas
+
+
+def hashes_por_bloques(ruta, tamano_bloque):
+    """Hashes de preparar_bloque leyendo el archivo por bloques"""
+    banco, ventas = [], []
+    for df in leer_por_bloques(ruta, tamano_bloque):
+        for fila in preparar_bloque(df)['filas']:
+            banco.append(fila[1])
+            ventas.append(fila[11])
+    return banco, ventas
+
+
+def verificar(ruta, bloques):
+    """Compara contra pd.read_excel con cada tamaño de bloque; devuelve si todo coincide"""
+    inicio = time.perf_counter()
+    esperado = hashes_read_excel(ruta)
+    ok = True
+    for tamano in bloques:
+        obtenido = hashes_por_bloques(ruta, tamano)
+        for lado, a, b in zip(('banco', 'ventas'), esperado, obtenido):
+            distintos = sum(x != y for x, y in zip(a, b)) + abs(len(a) - len(b))
+            if distintos:
+                ok = False
+                print(f"  {os.path.basename(ruta)} bloques de {tamano}: {distintos} de {len(a)} hashes de {lado} distintos")
+    estado = 'OK' if ok else 'DISTINTOS'
+    print(f"{os.path.basename(ruta)}: {estado} ({len(esperado[0])} filas, {time.perf_counter() - inicio:.1f}s)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('archivos', nargs='*')
+    parser.add_argument('--bloques', type=int, nargs='+', default=[997, 5000, 100000])
+    parser.add_argument('--filas', type=int, default=12000, help='Filas de los libros de prueba')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        archivos = args.archivos or escribir_casos(carpeta, args.filas)
+        resultados = [verificar(ruta, args.bloques) for ruta in archivos]
+    if not all(resultados):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
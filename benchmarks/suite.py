@@ -0,0 +1,295 @@
+"""
+Suite de benchmarks de los caminos críticos de la aplicación.
+
+Por cada tamaño genera un archivo fusionado sintético (benchmarks.generador),
+lo importa en una base nueva y mide sobre ella: get_stats, los listados
+(primera página, página profunda por offset y por cursor), las búsquedas de
+posibles matches (SQL y con el índice en memoria), la descarga del fusionado
+(xlsx, csv, parquet y arrow), la conciliación automática (con el pico de
+memoria) y la aprobación en lote. Los resultados se guardan en JSON para
+comparar entre commits.
+
+Uso:
+    python -m benchmarks.suite [--filas 10000 100000 1000000] [--salida resultados.json]
+    python -m benchmarks.suite --filas 10000 --comparar benchmarks/resultados_<commit>.json
+
+Sin --salida se escribe benchmarks/resultados_<commit>.json. Con --comparar
+termina con código 1 si alguna operación es más lenta que el umbral.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import auditoria
+import database
+import indice_candidatos
+from benchmarks.generador import generar_fusionado, escribir_xlsx
+
+
+CRITERIOS_BUSQUEDA = {
+    'exacto_7d': {'monto': 'exacto', 'fecha': 7, 'nombre': False, 'codigo': False},
+    '5%_30d_nombre': {'monto': '5%', 'fecha': 30, 'nombre': True, 'codigo': False},
+    'cualquiera_codigo': {'monto': 'cualquiera', 'fecha': None, 'nombre': False, 'codigo': True},
+}
+
+CRITERIOS_CONCILIACION = {
+    'exacto_7d': {'monto': 'exacto', 'fecha': 7},
+    '5%_30d': {'monto': '5%', 'fecha': 30},
+    '10%_30d': {'monto': '10%', 'fecha': 30},
+    '5%_15d_nombre': {'monto': '5%', 'fecha': 15, 'nombre': True},
+}
+
+# Operaciones origen por búsqueda medida
+MUESTRA_BUSQUEDAS = 20
+
+# Diferencias menores no se marcan como regresión (ruido en operaciones de µs)
+RUIDO_SEGUNDOS = 0.001
+
+
+def medir(funcion, repeticiones=5):
+    """Ejecuta la función varias veces y devuelve los tiempos en segundos"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+class Suite:
+    """Acumula los resultados de una corrida"""
+
+    def __init__(self):
+        self.resultados = []
+
+    def registrar(self, filas, operacion, tiempos, **extra):
+        resultado = {
+            'filas': filas,
+            'operacion': operacion,
+            'mediana': statistics.median(tiempos),
+            'minimo': min(tiempos),
+            'repeticiones': len(tiempos),
+            **extra
+        }
+        self.resultados.append(resultado)
+        print(f"  {operacion:<55} {resultado['mediana'] * 1000:>10.2f} ms (min {resultado['minimo'] * 1000:.2f})")
+
+    def medir(self, filas, operacion, funcion, repeticiones=5, **extra):
+        self.registrar(filas, operacion, medir(funcion, repeticiones), **extra)
+
+
+def _ids(tabla, condicion, cantidad):
+    conn = database.get_db()
+    ids = [row[0] for row in conn.execute(f'SELECT id FROM {tabla} WHERE {condicion} ORDER BY id')]
+    conn.close()
+    random.Random(0).shuffle(ids)
+    return ids[:cantidad]
+
+
+def bench_importacion(suite, filas, carpeta):
+    """Genera el xlsx y mide procesar_archivo sobre una base vacía"""
+    ruta_xlsx = os.path.join(carpeta, f'fusionado_{filas}.xlsx')
+    inicio = time.perf_counter()
+    escribir_xlsx(generar_fusionado(filas), ruta_xlsx)
+    print(f"  (xlsx generado en {time.perf_counter() - inicio:.1f}s)")
+
+    from importador import procesar_archivo
+    database.cerrar_conexiones()
+    database.DATABASE_PATH = os.path.join(carpeta, f'bench_{filas}.db')
+    database.init_db()
+    indice_candidatos.invalidar()
+
+    resultado = {}
+
+    def importar():
+        resultado.update(procesar_archivo(ruta_xlsx))
+
+    suite.medir(filas, 'procesar_archivo', importar, repeticiones=1)
+    suite.resultados[-1]['filas_por_segundo'] = resultado['filas_por_segundo']
+
+
+def bench_stats(suite, filas):
+    suite.medir(filas, 'get_stats', database.get_stats)
+    suite.medir(filas, 'get_stats (filtros de fecha)', lambda: database.get_stats(
+        venta_fecha_desde='2025-03-01', venta_fecha_hasta='2025-06-30',
+        banco_fecha_desde='2025-03-01', banco_fecha_hasta='2025-06-30'
+    ))
+
+
+def bench_listados(suite, filas):
+    listados = (
+        ('get_matches_pendientes', database.get_matches_pendientes, database.CLAVES_PENDIENTES, 'pendientes'),
+        ('get_matches_confirmados', database.get_matches_confirmados, database.CLAVES_CONFIRMADOS, 'confirmados'),
+        ('get_ventas_sin_match', database.get_ventas_sin_match, database.CLAVES_SIN_MATCH, 'ventas_sin_match'),
+        ('get_banco_sin_match', database.get_banco_sin_match, database.CLAVES_SIN_MATCH, 'banco_sin_match'),
+    )
+    stats = database.get_stats()
+    for nombre, listado, claves, contador in listados:
+        mitad = max(stats[contador] // 2, 0)
+        suite.medir(filas, f'{nombre} (página 1)', lambda: listado(limit=20))
+        suite.medir(filas, f'{nombre} (offset {mitad})', lambda: listado(limit=20, offset=mitad))
+        previas = listado(limit=1, offset=max(mitad - 1, 0))
+        if previas:
+            cursor = database.codificar_cursor(previas[-1], claves)
+            suite.medir(filas, f'{nombre} (cursor en la mitad)', lambda: listado(limit=20, after=cursor))
+
+
+def bench_busquedas(suite, filas):
+    busquedas = (
+        ('venta', 'operaciones_ventas', database.buscar_posibles_matches_para_venta,
+         indice_candidatos.buscar_para_venta),
+        ('banco', 'operaciones_banco', database.buscar_posibles_matches_para_banco,
+         indice_candidatos.buscar_para_banco),
+    )
+    for lado, tabla, buscar_sql, buscar_indice in busquedas:
+        ids = _ids(tabla, 'conciliado = 0', MUESTRA_BUSQUEDAS)
+        if not ids:
+            continue
+        indice_candidatos.invalidar()
+        suite.medir(filas, f'indice_candidatos ({lado}, construcción)',
+                    lambda: buscar_indice(ids[0], CRITERIOS_BUSQUEDA['exacto_7d']), repeticiones=1)
+        for etiqueta, criterios in CRITERIOS_BUSQUEDA.items():
+            suite.registrar(filas, f'buscar_posibles_matches_para_{lado} ({etiqueta})',
+                            [medir(lambda i=i: buscar_sql(i, criterios), 1)[0] for i in ids])
+            suite.registrar(filas, f'buscar_para_{lado} índice ({etiqueta})',
+                            [medir(lambda i=i: buscar_indice(i, criterios), 1)[0] for i in ids])
+
+
+def bench_descarga(suite, filas):
+    import app as aplicacion
+    cliente = aplicacion.app.test_client()
+    for formato in ('xlsx', 'csv', 'parquet', 'arrow'):
+        tamano = {}
+
+        def descargar():
+            respuesta = cliente.get(f'/descargar-fusionado?formato={formato}')
+            tamano['bytes'] = len(respuesta.get_data())
+
+        suite.medir(filas, f'descargar_fusionado ({formato})', descargar, repeticiones=1)
+        suite.resultados[-1]['bytes'] = tamano['bytes']
+
+
+def bench_conciliacion(suite, filas):
+    """
+    Conciliación automática con cada juego de criterios. Los matches que
+    crea se borran después de cada corrida, así todas parten de la misma
+    base y la aprobación en lote mide lo mismo que antes.
+    """
+    from conciliacion_automatica import conciliar_automaticamente
+    for etiqueta, criterios in CRITERIOS_CONCILIACION.items():
+        resultado = {}
+        tracemalloc.start()
+        suite.medir(filas, f'conciliar_automaticamente ({etiqueta})',
+                    lambda: resultado.update(conciliar_automaticamente(criterios)), repeticiones=1)
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        suite.resultados[-1].update(creados=resultado['creados'], candidatos=resultado['candidatos'],
+                                    pico_mb=round(pico / 2 ** 20, 1))
+        conn = database.get_db()
+        conn.execute("DELETE FROM matches WHERE match_tipo = 'AUTOMATICO'")
+        conn.commit()
+        conn.close()
+
+
+def bench_aprobacion(suite, filas):
+    """Aprobación en lote de todos los pendientes (modifica la base, va al final)"""
+    ids = _ids('matches', "estado = 'PENDIENTE'", 10 ** 9)
+    if not ids:
+        return
+    resultado = {}
+    suite.medir(filas, 'procesar_matches_bulk (aprobar pendientes)',
+                lambda: resultado.update(database.procesar_matches_bulk('aprobar', ids=ids)),
+                repeticiones=1)
+    suite.resultados[-1]['procesados'] = resultado['procesados']
+    # Los eventos van a esta base antes de pasar a la siguiente
+    auditoria.vaciar()
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior, umbral):
+    """Imprime la razón actual/anterior por operación; devuelve las regresiones"""
+    previos = {(r['filas'], r['operacion']): r['mediana'] for r in anterior['resultados']}
+    regresiones = []
+    print(f"\nComparación con {anterior.get('commit')} ({anterior.get('fecha')}):")
+    for r in actual['resultados']:
+        previo = previos.get((r['filas'], r['operacion']))
+        if not previo:
+            continue
+        razon = r['mediana'] / previo
+        regresion = razon > umbral and r['mediana'] - previo > RUIDO_SEGUNDOS
+        marca = ' <-- regresión' if regresion else ''
+        print(f"  {r['filas']:>8} {r['operacion']:<55} {razon:>6.2f}x{marca}")
+        if marca:
+            regresiones.append(r['operacion'])
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--salida')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior')
+    parser.add_argument('--umbral', type=float, default=1.25,
+                        help='Razón actual/anterior a partir de la cual se marca una regresión')
+    args = parser.parse_args()
+
+    suite = Suite()
+    ruta_original = database.DATABASE_PATH
+    with tempfile.TemporaryDirectory() as carpeta:
+        try:
+            for filas in args.filas:
+                print(f"\n== {filas} filas ==")
+                bench_importacion(suite, filas, carpeta)
+                bench_stats(suite, filas)
+                bench_listados(suite, filas)
+                bench_busquedas(suite, filas)
+                bench_descarga(suite, filas)
+                bench_conciliacion(suite, filas)
+                bench_aprobacion(suite, filas)
+        finally:
+            auditoria.vaciar()
+            database.cerrar_conexiones()
+            database.DATABASE_PATH = ruta_original
+
+    commit = _commit_actual()
+    corrida = {
+        'commit': commit,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'plataforma': platform.platform(),
+        'resultados': suite.resultados
+    }
+    salida = args.salida or f"benchmarks/resultados_{commit or 'local'}.json"
+    with open(salida, 'w') as f:
+        json.dump(corrida, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {salida}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            anterior = json.load(f)
+        if comparar(corrida, anterior, args.umbral):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
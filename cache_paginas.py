@@ -0,0 +1,57 @@
+"""
+Caché de páginas renderizadas para el dashboard y los listados.
+
+La clave es la ruta más los query args (filtros de fecha, page, after). Cada
+entrada guarda la versión con la que se generó (get_version_paginas: los
+contadores de datos, de sugerencias y de importaciones): cualquier
+escritura confirmada de operaciones, matches o sugerencias, o un cambio de
+estado de una importación, de este u otro worker o del proceso de
+importación, cambia la versión y la entrada deja de valer sin que las
+funciones de escritura tengan que avisar. El progreso de las importaciones
+y los eventos de auditoría no invalidan páginas. Las entradas además
+vencen a los SEGUNDOS_VIGENCIA y se descartan por LRU al superar
+MAX_ENTRADAS.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session
+
+from database import get_version_paginas
+
+
+MAX_ENTRADAS = 256
+SEGUNDOS_VIGENCIA = 60
+
+_lock = threading.Lock()
+_entradas = OrderedDict()  # clave -> (versión, creada, html)
+
+
+def cachear_pagina(vista):
+    """Decorador de vistas GET que devuelven HTML renderizado"""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        # Los mensajes flash pendientes se muestran una sola vez
+        if session.get('_flashes'):
+            return vista(*args, **kwargs)
+
+        clave = (request.path, tuple(sorted(request.args.items(multi=True))))
+        version = get_version_paginas()
+        with _lock:
+            entrada = _entradas.get(clave)
+            if entrada and entrada[0] == version and time.monotonic() - entrada[1] < SEGUNDOS_VIGENCIA:
+                _entradas.move_to_end(clave)
+                return entrada[2]
+
+        html = vista(*args, **kwargs)
+        if isinstance(html, str):
+            with _lock:
+                _entradas[clave] = (version, time.monotonic(), html)
+                _entradas.move_to_end(clave)
+                while len(_entradas) > MAX_ENTRADAS:
+                    _entradas.popitem(last=False)
+        return html
+    return envoltura
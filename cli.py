@@ -0,0 +1,265 @@
+"""
+Línea de comandos para las corridas programadas (sin la web).
+
+Cada comando importa solo lo que usa: stats y aprobar solo tocan SQLite,
+importar carga pandas, conciliar y sugerencias numpy y exportar openpyxl
+o pyarrow según el formato; Flask nunca se carga. Antes de empezar se
+aplican las migraciones pendientes. Al terminar se imprime un resumen con
+el tiempo total y los contadores del comando; con --json el resumen es la
+última línea de stdout, en JSON, para el planificador o el monitoreo. El
+código de salida es 0 si todo salió bien, 1 ante un error y 2 con
+argumentos inválidos. Las decisiones que tome un comando quedan en el
+registro de auditoría a nombre de cli:<usuario del sistema>.
+
+Uso:
+    python -m cli importar banco1.xlsx banco2.parquet [--procesos 4]
+    python -m cli conciliar [--monto exacto] [--fecha 7] [--nombre] [--codigo]
+    python -m cli aprobar [--ids 1 2 3] [--confianza ALTO] [--diferencia-max 0] ...
+    python -m cli stats [--venta-desde 2025-01-01] [--venta-hasta 2025-01-31] ...
+    python -m cli exportar fusionado.parquet [--formato parquet]
+    python -m cli sugerencias
+    python -m cli reaplicar [--desde 2026-01-01]
+    python -m cli migrar
+
+Opciones generales (antes del comando): --db RUTA para usar otra base y
+--json para el resumen en JSON.
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import auditoria
+import database
+
+
+class ErrorComando(Exception):
+    """Error esperable de un comando: se informa sin traceback"""
+
+
+def cmd_importar(args):
+    """Importa uno o más archivos fusionados (incremental si ya hay datos)"""
+    faltantes = [a for a in args.archivos if not os.path.isfile(a)]
+    if faltantes:
+        raise ErrorComando(f"No existen: {', '.join(faltantes)}")
+
+    activa = database.get_importacion_activa()
+    if activa:
+        raise ErrorComando(f"Ya hay una importación en curso (#{activa['id']}). Espera a que termine.")
+
+    from importador import ejecutar_importacion, LECTORES
+
+    no_soportados = [a for a in args.archivos if os.path.splitext(a)[1].lower() not in LECTORES]
+    if no_soportados:
+        raise ErrorComando(f"Formato no soportado: {', '.join(no_soportados)}")
+
+    stats = database.get_stats()
+    incremental = stats['total_banco'] > 0 or stats['total_ventas'] > 0
+    importacion_id, creada = database.crear_importacion([os.path.abspath(a) for a in args.archivos], incremental)
+    if not creada:
+        raise ErrorComando(f"Ya hay una importación en curso (#{importacion_id}). Espera a que termine.")
+    ejecutar_importacion(importacion_id, args.procesos)
+
+    importacion = database.get_importacion(importacion_id)
+    if importacion['estado'] != 'COMPLETADO':
+        raise ErrorComando(f"Importación #{importacion_id} terminó con error: {importacion['error']}")
+    return {'importacion': importacion_id, 'incremental': incremental, **importacion['resultado']}
+
+
+def cmd_conciliar(args):
+    """Crea matches PENDIENTE entre las operaciones sin match"""
+    if database.get_importacion_activa():
+        raise ErrorComando('Hay una importación en curso')
+
+    from conciliacion_automatica import conciliar_automaticamente
+    from sugerencias import actualizar_sugerencias
+
+    resultado = conciliar_automaticamente({
+        'monto': args.monto,
+        'fecha': args.fecha,
+        'nombre': args.nombre,
+        'codigo': args.codigo,
+    })
+    resultado['sugerencias'] = actualizar_sugerencias()
+    return resultado
+
+
+def cmd_sugerencias(args):
+    """Recalcula las sugerencias afectadas por los últimos cambios"""
+    from sugerencias import actualizar_sugerencias
+
+    return actualizar_sugerencias()
+
+
+def cmd_reaplicar(args):
+    """Reaplica las decisiones registradas (tras un reset y una nueva importación)"""
+    if database.get_importacion_activa():
+        raise ErrorComando('Hay una importación en curso')
+
+    from sugerencias import actualizar_sugerencias
+
+    resultado = database.reaplicar_decisiones(args.desde)
+    resultado['sugerencias'] = actualizar_sugerencias()
+    return resultado
+
+
+def cmd_aprobar(args):
+    """Aprueba en lote los matches pendientes que cumplen ids y/o filtros"""
+    filtros = {
+        'match_tipo': args.match_tipo,
+        'confianza': args.confianza,
+        'venta_fecha_desde': args.venta_desde,
+        'venta_fecha_hasta': args.venta_hasta,
+        'banco_fecha_desde': args.banco_desde,
+        'banco_fecha_hasta': args.banco_hasta,
+        'diferencia_max': args.diferencia_max,
+    }
+    resultado = database.procesar_matches_bulk('aprobar', ids=args.ids, filtros=filtros)
+    # El detalle por id puede ser enorme: el resumen lleva los totales por estado
+    resultado['resultados'] = dict(Counter(resultado['resultados'].values()))
+    return resultado
+
+
+def cmd_stats(args):
+    """Estadísticas del dashboard, con los mismos filtros de fecha"""
+    stats = database.get_stats(
+        venta_fecha_desde=args.venta_desde,
+        venta_fecha_hasta=args.venta_hasta,
+        banco_fecha_desde=args.banco_desde,
+        banco_fecha_hasta=args.banco_hasta
+    )
+    return {clave: valor for clave, valor in stats.items() if not clave.startswith('filtro_') or valor}
+
+
+def cmd_exportar(args):
+    """Escribe el archivo fusionado en streaming"""
+    from exportador import exportar_fusionado, FORMATOS
+
+    formato = args.formato or os.path.splitext(args.salida)[1].lstrip('.').lower() or 'xlsx'
+    if formato not in FORMATOS:
+        raise ErrorComando(f'Formato no soportado: {formato}')
+
+    temporal = f'{args.salida}.tmp'
+    tamano = 0
+    try:
+        with open(temporal, 'wb') as f:
+            for bloque in exportar_fusionado(formato):
+                f.write(bloque)
+                tamano += len(bloque)
+        os.replace(temporal, args.salida)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return {'salida': args.salida, 'formato': formato, 'bytes': tamano}
+
+
+def cmd_migrar(args):
+    """Solo aplica las migraciones pendientes"""
+    conn = database.get_db()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.close()
+    return {'version_esquema': version}
+
+
+def _agregar_filtros_fecha(parser):
+    for lado in ('venta', 'banco'):
+        parser.add_argument(f'--{lado}-desde', metavar='AAAA-MM-DD')
+        parser.add_argument(f'--{lado}-hasta', metavar='AAAA-MM-DD')
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', help=f'Base SQLite (por defecto {database.DATABASE_PATH})')
+    parser.add_argument('--json', action='store_true', help='Resumen final como una línea JSON')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    importar = comandos.add_parser('importar', help=cmd_importar.__doc__)
+    importar.add_argument('archivos', nargs='+', help='Archivos fusionados .xlsx, .parquet o .arrow')
+    importar.add_argument('--procesos', type=int,
+                          help='Procesos de lectura con varios archivos (por defecto, uno por archivo hasta los núcleos)')
+    importar.set_defaults(funcion=cmd_importar)
+
+    conciliar = comandos.add_parser('conciliar', help=cmd_conciliar.__doc__)
+    conciliar.add_argument('--monto', default='exacto', choices=list(database.TOLERANCIAS_MONTO))
+    conciliar.add_argument('--fecha', type=int, default=7, help='Ventana en días')
+    conciliar.add_argument('--nombre', action='store_true', help='Exigir coincidencia de nombre')
+    conciliar.add_argument('--codigo', action='store_true', help='Exigir coincidencia de código')
+    conciliar.set_defaults(funcion=cmd_conciliar)
+
+    aprobar = comandos.add_parser('aprobar', help=cmd_aprobar.__doc__)
+    aprobar.add_argument('--ids', type=int, nargs='+')
+    aprobar.add_argument('--match-tipo')
+    aprobar.add_argument('--confianza')
+    _agregar_filtros_fecha(aprobar)
+    aprobar.add_argument('--diferencia-max', type=float, help='Diferencia máxima de monto')
+    aprobar.set_defaults(funcion=cmd_aprobar)
+
+    stats = comandos.add_parser('stats', help=cmd_stats.__doc__)
+    _agregar_filtros_fecha(stats)
+    stats.set_defaults(funcion=cmd_stats)
+
+    exportar = comandos.add_parser('exportar', help=cmd_exportar.__doc__)
+    exportar.add_argument('salida', help='Archivo de salida')
+    exportar.add_argument('--formato', choices=['xlsx', 'csv', 'parquet', 'arrow'],
+                          help='Por defecto, según la extensión')
+    exportar.set_defaults(funcion=cmd_exportar)
+
+    sugerencias = comandos.add_parser('sugerencias', help=cmd_sugerencias.__doc__)
+    sugerencias.set_defaults(funcion=cmd_sugerencias)
+
+    reaplicar = comandos.add_parser('reaplicar', help=cmd_reaplicar.__doc__)
+    reaplicar.add_argument('--desde', metavar='AAAA-MM-DD', help='Solo decisiones desde esa fecha')
+    reaplicar.set_defaults(funcion=cmd_reaplicar)
+
+    migrar = comandos.add_parser('migrar', help=cmd_migrar.__doc__)
+    migrar.set_defaults(funcion=cmd_migrar)
+    return parser
+
+
+def imprimir_resumen(resumen, en_json):
+    if en_json:
+        print(json.dumps(resumen, ensure_ascii=False, default=str))
+        return
+    estado = 'OK' if resumen['ok'] else f"ERROR: {resumen['error']}"
+    print(f"{resumen['comando']}: {estado} en {resumen['segundos_total']:.3f}s")
+    for clave, valor in resumen.get('resultado', {}).items():
+        print(f"  {clave}: {valor}")
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    if args.db:
+        database.DATABASE_PATH = args.db
+
+    auditoria.set_usuario(f'cli:{getpass.getuser()}')
+
+    inicio = time.perf_counter()
+    resumen = {'comando': args.comando, 'ok': True}
+    try:
+        database.init_db()
+        resumen['resultado'] = args.funcion(args)
+    except (ErrorComando, ValueError) as e:
+        resumen.update(ok=False, error=str(e))
+    except Exception as e:
+        resumen.update(ok=False, error=f'{type(e).__name__}: {e}')
+        raise
+    finally:
+        # También si el comando falló: lo decidido hasta ahí va a esta base
+        # y no a la que quede en DATABASE_PATH al salir del proceso
+        try:
+            auditoria.vaciar()
+        except Exception as e:
+            resumen.update(ok=False, error=f'No se pudieron escribir los eventos de auditoría: {e}')
+        resumen['segundos_total'] = round(time.perf_counter() - inicio, 3)
+        imprimir_resumen(resumen, args.json)
+        database.cerrar_conexiones()
+    return 0 if resumen['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+Conciliación automática de operaciones sin match.
+
+Genera los pares candidatos venta-banco (monto dentro de la tolerancia y
+fecha dentro de la ventana), los ordena con el mismo criterio que la
+búsqueda manual (diferencia de monto y luego de días) y asigna uno a uno de
+forma greedy: cada par se toma si ni la venta ni el banco fueron asignados
+antes. Los matches se crean como PENDIENTE para revisión.
+
+Con tolerancia de monto y ventanas largas los pares crecen casi
+cuadráticamente (a 100k x 100k, 10% y 30 días son ~140M), así que cada
+venta conserva solo sus CANDIDATOS_POR_VENTA mejores y los pares se generan
+por bloques de ventas: la memoria queda acotada por PARES_POR_BLOQUE. Una
+venta que se quedó sin banco porque todas sus candidatas se asignaron
+antes, y tenía más, se vuelve a buscar entre los bancos libres. Por eso,
+con más de CANDIDATOS_POR_VENTA candidatas, el resultado puede diferir en
+algún par del greedy sobre todos los pares.
+
+Un par (venta, banco) es candidato si el banco aparecería en
+buscar_posibles_matches_para_venta(venta, criterios).
+"""
+
+import time
+
+import numpy as np
+
+from database import get_db, reservar_match_codes, patrones_busqueda, rango_centavos, TOLERANCIAS_MONTO
+from indice_candidatos import get_indice, coincide_like
+
+
+CRITERIOS_AUTOMATICOS = {'monto': 'exacto', 'fecha': 7, 'nombre': False, 'codigo': False}
+
+# Las rondas vectorizadas siguen mientras eligen al menos esta fracción de
+# los pares restantes; después conviene el recorrido secuencial
+RONDA_MINIMA = 0.001
+
+# Candidatas que conserva cada venta y pares por bloque de generación. Sin
+# criterios de texto una venta aporta a lo sumo 2 * CANDIDATOS_POR_VENTA
+# pares por día de la ventana; de eso sale cuántas ventas entran por bloque
+CANDIDATOS_POR_VENTA = 20
+PARES_POR_BLOQUE = 2000000
+
+
+def emparejar_identicos(ventas, banco):
+    """
+    Primer nivel del greedy: pares con el mismo monto y el mismo día.
+
+    Son los primeros en el orden (diferencia de monto, de días, ids) y cada
+    operación pertenece a una sola celda (día, monto), así que dentro de
+    cada celda el greedy empareja ventas y bancos en orden de id: la i-ésima
+    venta con el i-ésimo banco. Se resuelve sin generar pares.
+    """
+    validos_v = np.flatnonzero(ventas.tiene_dia & ~np.isnan(ventas.centavos))
+    validos_b = np.flatnonzero(banco.tiene_dia & ~np.isnan(banco.centavos))
+    montos_unicos = np.unique(np.concatenate([ventas.centavos[validos_v], banco.centavos[validos_b]]))
+    k = len(montos_unicos) + 1
+
+    def celdas(indice, validos):
+        claves = indice.dias[validos] * k + np.searchsorted(montos_unicos, indice.centavos[validos])
+        orden = np.argsort(claves, kind='stable')
+        return claves[orden], validos[orden]
+
+    claves_v, posiciones_v = celdas(ventas, validos_v)
+    claves_b, posiciones_b = celdas(banco, validos_b)
+
+    # Número de orden de cada venta dentro de su celda
+    numero_v = np.arange(len(claves_v)) - np.searchsorted(claves_v, claves_v, side='left')
+    inicio_b = np.searchsorted(claves_b, claves_v, side='left')
+    fin_b = np.searchsorted(claves_b, claves_v, side='right')
+    con_pareja = numero_v < fin_b - inicio_b
+    return posiciones_v[con_pareja], posiciones_b[inicio_b[con_pareja] + numero_v[con_pareja]]
+
+
+def generar_candidatos(ventas, banco, criterios, libres_v=None, libres_b=None, limite_por_dia=None):
+    """
+    Pares candidatos como arrays de posiciones (pos_venta, pos_banco).
+
+    Las operaciones de banco se ordenan por (día, rango de monto). Para cada
+    desplazamiento de día dentro de la ventana, los bancos de una venta son
+    un intervalo contiguo de ese orden, que se obtiene con searchsorted.
+    libres_v / libres_b limitan la búsqueda a las operaciones no asignadas.
+
+    limite_por_dia toma de cada intervalo los de monto más cercano al de la
+    venta: hasta limite_por_dia desde su monto hacia arriba y hasta
+    limite_por_dia por debajo. Con monto exacto el intervalo es un único
+    monto, así que son los de menor id para cada día.
+    """
+    dias_ventana = criterios['fecha']
+
+    validos_b = banco.tiene_dia & ~np.isnan(banco.centavos)
+    if libres_b is not None:
+        validos_b &= libres_b
+    validos_b = np.flatnonzero(validos_b)
+    montos_unicos = np.unique(banco.centavos[validos_b])
+    k = len(montos_unicos) + 1
+    claves_b = banco.dias[validos_b] * k + np.searchsorted(montos_unicos, banco.centavos[validos_b])
+    orden = np.argsort(claves_b, kind='stable')
+    claves_b = claves_b[orden]
+    posiciones_b = validos_b[orden]
+
+    validos_v = ventas.tiene_dia & ~np.isnan(ventas.centavos)
+    if libres_v is not None:
+        validos_v &= libres_v
+    validos_v = np.flatnonzero(validos_v)
+    minimo, maximo = rango_centavos(ventas.centavos[validos_v], criterios['monto'])
+    rango_min = np.searchsorted(montos_unicos, minimo, side='left')
+    rango_max = np.searchsorted(montos_unicos, maximo, side='right') - 1
+    con_rango = (minimo <= maximo) & (rango_min <= rango_max)
+    validos_v, rango_min, rango_max = validos_v[con_rango], rango_min[con_rango], rango_max[con_rango]
+    dias_v = ventas.dias[validos_v]
+    # Primer monto mayor o igual al de la venta
+    rango_centro = np.clip(np.searchsorted(montos_unicos, ventas.centavos[validos_v], side='left'),
+                           rango_min, rango_max + 1)
+
+    pares_v, pares_b = [], []
+    for desplazamiento in range(-dias_ventana, dias_ventana + 1):
+        base = (dias_v + desplazamiento) * k
+        inicio = np.searchsorted(claves_b, base + rango_min, side='left')
+        fin = np.searchsorted(claves_b, base + rango_max, side='right')
+        if limite_por_dia is None:
+            intervalos = [(inicio, fin - inicio)]
+        else:
+            # Por debajo del monto de la venta los más cercanos son los últimos
+            centro = np.searchsorted(claves_b, base + rango_centro, side='left')
+            abajo = np.maximum(inicio, centro - limite_por_dia)
+            intervalos = [(abajo, centro - abajo), (centro, np.minimum(fin, centro + limite_por_dia) - centro)]
+        for inicio, cantidades in intervalos:
+            total = int(cantidades.sum())
+            if not total:
+                continue
+            # Expande cada intervalo [inicio, inicio + cantidad) a sus posiciones
+            desde = np.repeat(inicio - np.cumsum(cantidades) + cantidades, cantidades)
+            pares_v.append(np.repeat(validos_v, cantidades))
+            pares_b.append(posiciones_b[np.arange(total) + desde])
+
+    if not pares_v:
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, vacio
+    return np.concatenate(pares_v), np.concatenate(pares_b)
+
+
+def _mejores_por_venta(ventas, banco, pares_v, pares_b, criterios, cantidad):
+    """
+    Las primeras cantidad candidatas de cada venta en el orden del greedy
+    (diferencia de monto, de días, banco) que cumplen los criterios de
+    nombre y código (LIKE '%x%'). Devuelve (pares_v, pares_b, ventas a las
+    que les quedaron candidatas afuera).
+    """
+    diferencia_monto = np.abs(ventas.centavos[pares_v] - banco.centavos[pares_b])
+    diferencia_dias = np.abs(ventas.dias[pares_v] - banco.dias[pares_b])
+    orden = np.lexsort((pares_b, diferencia_dias, diferencia_monto, pares_v))
+    pares_v, pares_b = pares_v[orden], pares_b[orden]
+    del diferencia_monto, diferencia_dias, orden
+    primeras = np.searchsorted(pares_v, pares_v, side='left')
+
+    if criterios.get('nombre') or criterios.get('codigo'):
+        # Se recorre cada venta en orden hasta juntar cantidad que coincidan
+        mantener = np.zeros(len(pares_v), dtype=bool)
+        cortadas = []
+        inicios = np.flatnonzero(primeras == np.arange(len(pares_v)))
+        for inicio, fin in zip(inicios.tolist(), np.append(inicios[1:], len(pares_v)).tolist()):
+            verificadores = [
+                (banco.nombres if columna == 'nombre_norm' else banco.codigos, coincide_like(texto))
+                for columna, texto in patrones_busqueda(ventas.fila_en(int(pares_v[inicio])), criterios)
+            ]
+            aceptadas = 0
+            for i, pos_b in enumerate(pares_b[inicio:fin].tolist(), inicio):
+                if all(coincide(textos[pos_b]) for textos, coincide in verificadores):
+                    if aceptadas == cantidad:
+                        cortadas.append(pares_v[inicio])
+                        break
+                    mantener[i] = True
+                    aceptadas += 1
+        return pares_v[mantener], pares_b[mantener], np.array(cortadas, dtype=np.int64)
+
+    puesto = np.arange(len(pares_v)) - primeras
+    return pares_v[puesto < cantidad], pares_b[puesto < cantidad], pares_v[puesto == cantidad]
+
+
+def _candidatos_por_bloques(ventas, banco, criterios, libres_v, libres_b):
+    """
+    Las mejores CANDIDATOS_POR_VENTA candidatas de cada venta libre,
+    generadas por bloques de ventas. Devuelve (pares_v, pares_b, máscara de
+    las ventas a las que les quedaron candidatas afuera).
+    """
+    # Sin criterios de texto, los más cercanos de cada día alcanzan
+    texto = criterios.get('nombre') or criterios.get('codigo')
+    limite_por_dia = None if texto else CANDIDATOS_POR_VENTA
+    por_bloque = max(1, PARES_POR_BLOQUE // (2 * CANDIDATOS_POR_VENTA * (2 * criterios['fecha'] + 1)))
+
+    pendientes = np.flatnonzero(libres_v)
+    todos_v, todos_b = [], []
+    cortadas = np.zeros(len(ventas.ids), dtype=bool)
+    for inicio in range(0, len(pendientes), por_bloque):
+        bloque = np.zeros(len(ventas.ids), dtype=bool)
+        bloque[pendientes[inicio:inicio + por_bloque]] = True
+        pares_v, pares_b = generar_candidatos(ventas, banco, criterios, bloque, libres_b, limite_por_dia)
+        pares_v, pares_b, cortadas_bloque = _mejores_por_venta(ventas, banco, pares_v, pares_b, criterios,
+                                                               CANDIDATOS_POR_VENTA)
+        todos_v.append(pares_v)
+        todos_b.append(pares_b)
+        cortadas[cortadas_bloque] = True
+
+    if not todos_v:
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, vacio, cortadas
+    return np.concatenate(todos_v), np.concatenate(todos_b), cortadas
+
+
+def asignar_pares(ventas, banco, pares_v, pares_b, usadas_v, usadas_b):
+    """
+    Asignación uno a uno greedy por (diferencia de monto, diferencia de
+    días, ids) entre operaciones no usadas. Marca las elegidas en usadas_v /
+    usadas_b y devuelve arrays (pos_venta, pos_banco).
+
+    Cada ronda toma a la vez todos los pares que son el mejor restante tanto
+    para su venta como para su banco (el greedy los elegiría igual) y
+    descarta los que tocan alguno de ellos. Cuando las rondas dejan de
+    avanzar, el resto se recorre par por par. El resultado es el mismo que
+    el greedy secuencial.
+    """
+    diferencia_monto = np.abs(ventas.centavos[pares_v] - banco.centavos[pares_b])
+    diferencia_dias = np.abs(ventas.dias[pares_v] - banco.dias[pares_b])
+    orden = np.lexsort((pares_b, pares_v, diferencia_dias, diferencia_monto))
+    pares_v, pares_b = pares_v[orden], pares_b[orden]
+    del diferencia_monto, diferencia_dias, orden
+
+    elegidos_v, elegidos_b = [], []
+    while len(pares_v):
+        mejor_v = np.zeros(len(pares_v), dtype=bool)
+        mejor_v[np.unique(pares_v, return_index=True)[1]] = True
+        mejor_b = np.zeros(len(pares_b), dtype=bool)
+        mejor_b[np.unique(pares_b, return_index=True)[1]] = True
+        elegidos = mejor_v & mejor_b
+
+        elegidos_v.append(pares_v[elegidos])
+        elegidos_b.append(pares_b[elegidos])
+        usadas_v[pares_v[elegidos]] = True
+        usadas_b[pares_b[elegidos]] = True
+
+        libres = ~usadas_v[pares_v] & ~usadas_b[pares_b]
+        pares_v, pares_b = pares_v[libres], pares_b[libres]
+        if elegidos.sum() < len(pares_v) * RONDA_MINIMA:
+            break
+
+    # Resto: greedy secuencial
+    secuencial_v, secuencial_b = [], []
+    for pos_v, pos_b in zip(pares_v.tolist(), pares_b.tolist()):
+        if usadas_v[pos_v] or usadas_b[pos_b]:
+            continue
+        usadas_v[pos_v] = usadas_b[pos_b] = True
+        secuencial_v.append(pos_v)
+        secuencial_b.append(pos_b)
+    elegidos_v.append(np.array(secuencial_v, dtype=np.int64))
+    elegidos_b.append(np.array(secuencial_b, dtype=np.int64))
+
+    return np.concatenate(elegidos_v), np.concatenate(elegidos_b)
+
+
+def conciliar_automaticamente(criterios=None):
+    """
+    Crea matches PENDIENTE para las operaciones sin match.
+
+    criterios: como en buscar_posibles_matches_para_venta, pero monto debe
+    ser 'exacto', '1%', '5%' o '10%' y fecha un número de días (sin esos
+    límites la búsqueda no se puede dividir en bloques).
+    """
+    criterios = {**CRITERIOS_AUTOMATICOS, **(criterios or {})}
+    if criterios['monto'] not in TOLERANCIAS_MONTO:
+        raise ValueError("El criterio de monto debe ser 'exacto', '1%', '5%' o '10%'")
+    if not isinstance(criterios['fecha'], int) or criterios['fecha'] < 1:
+        raise ValueError('El criterio de fecha debe ser un número de días')
+
+    inicio = time.time()
+    ventas = get_indice('ventas')
+    banco = get_indice('banco')
+    usadas_v = np.zeros(len(ventas.ids), dtype=bool)
+    usadas_b = np.zeros(len(banco.ids), dtype=bool)
+    asignados_v, asignados_b = [], []
+    candidatos = 0
+
+    # Mismo monto y mismo día (si no hay criterios de texto que filtrar)
+    if not criterios.get('nombre') and not criterios.get('codigo'):
+        identicos_v, identicos_b = emparejar_identicos(ventas, banco)
+        usadas_v[identicos_v] = usadas_b[identicos_b] = True
+        asignados_v.append(identicos_v)
+        asignados_b.append(identicos_b)
+        candidatos += len(identicos_v)
+
+    # Los pares de monto exacto van antes que cualquier par con tolerancia,
+    # así que el greedy se hace por niveles sobre las operaciones libres
+    niveles = ['exacto'] if criterios['monto'] == 'exacto' else ['exacto', criterios['monto']]
+    for nivel in niveles:
+        pendientes = ~usadas_v
+        while pendientes.any():
+            pares_v, pares_b, cortadas = _candidatos_por_bloques(
+                ventas, banco, {**criterios, 'monto': nivel}, pendientes, ~usadas_b
+            )
+            candidatos += len(pares_v)
+            elegidos_v, elegidos_b = asignar_pares(ventas, banco, pares_v, pares_b, usadas_v, usadas_b)
+            asignados_v.append(elegidos_v)
+            asignados_b.append(elegidos_b)
+            # Las que perdieron todas sus candidatas y tenían más se vuelven a buscar
+            pendientes = cortadas & ~usadas_v
+            if not len(elegidos_v):
+                break
+
+    asignados_v = np.concatenate(asignados_v)
+    asignados_b = np.concatenate(asignados_b)
+    exactos = (ventas.centavos[asignados_v] == banco.centavos[asignados_b]) & \
+        (ventas.dias[asignados_v] == banco.dias[asignados_b])
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        codigos = reservar_match_codes(conn, len(asignados_v))
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS stg_auto (
+                match_code TEXT, banco_id INTEGER, venta_id INTEGER, confianza TEXT
+            )
+        ''')
+        cursor.execute('DELETE FROM stg_auto')
+        cursor.executemany('INSERT INTO stg_auto VALUES (?, ?, ?, ?)', zip(
+            codigos, banco.ids[asignados_b].tolist(), ventas.ids[asignados_v].tolist(),
+            ['ALTO' if exacto else 'MEDIO' for exacto in exactos.tolist()]
+        ))
+        # Solo se crea el match si ambas operaciones siguen sin match
+        cursor.execute('''
+            INSERT INTO matches (match_code, banco_id, venta_id, match_tipo, confianza, estado)
+            SELECT s.match_code, s.banco_id, s.venta_id, 'AUTOMATICO', s.confianza, 'PENDIENTE'
+            FROM stg_auto s
+            JOIN operaciones_banco b ON b.id = s.banco_id AND b.conciliado = 0
+            JOIN operaciones_ventas v ON v.id = s.venta_id AND v.conciliado = 0
+            ORDER BY s.banco_id
+        ''')
+        creados = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    segundos = time.time() - inicio
+    print(f"Conciliación automática: {candidatos} candidatos, {creados} matches en {segundos:.3f}s")
+    return {
+        'candidatos': candidatos,
+        'creados': creados,
+        'segundos': round(segundos, 3),
+    }
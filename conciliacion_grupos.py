@@ -0,0 +1,182 @@
+"""
+Búsqueda de matches de grupo: una transferencia que paga varias facturas
+(un banco con varias ventas) o varias transferencias que saldan una
+factura (una venta con varios bancos).
+
+Es un subset-sum acotado sobre las operaciones sin match del otro lado
+dentro de la ventana de fechas: los montos positivos que no superan el
+objetivo se ordenan y se recorren en profundidad por cantidad de elementos
+(2, 3, ... hasta el máximo). En cada nivel se poda con las cotas de la
+suma (los más chicos que siguen y los más grandes que quedan) y los dos
+últimos elementos se resuelven juntos con un searchsorted vectorizado, así
+que nunca se enumeran combinaciones que no pueden cerrar. Cada consulta tiene un presupuesto de tiempo: al
+agotarse se devuelven los grupos encontrados con completo=False.
+
+Los grupos elegidos se crean con database.crear_match_grupo.
+"""
+
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+from database import get_db, patrones_busqueda, rango_centavos, TOLERANCIAS_MONTO
+from indice_candidatos import TABLAS, get_indice, coincide_like
+
+
+CRITERIOS_GRUPO = {'monto': 'exacto', 'fecha': 7, 'nombre': False, 'elementos': 4}
+
+# Límites de cada consulta
+MAX_ELEMENTOS = 6
+SEGUNDOS_POR_CONSULTA = 0.5
+MAX_COMBINACIONES = 200
+
+# Cada cuántos nodos del recorrido se mira el reloj
+NODOS_POR_CONTROL = 256
+
+
+class _TiempoAgotado(Exception):
+    pass
+
+
+def combinaciones_suma(montos, minimo, maximo, max_elementos, limite=MAX_COMBINACIONES, segundos=None):
+    """
+    Combinaciones de 2 a max_elementos posiciones de montos (enteros
+    ordenados de menor a mayor) cuya suma queda en [minimo, maximo].
+
+    Devuelve (combinaciones, completo): las combinaciones van de menos a
+    más elementos y completo es False si se cortó por el límite de
+    combinaciones o de tiempo.
+    """
+    n = len(montos)
+    valores = np.array(montos, dtype=np.int64)
+    acumulados = [0]
+    for monto in montos:
+        acumulados.append(acumulados[-1] + monto)
+    fin = None if segundos is None else time.perf_counter() + segundos
+    combinaciones = []
+    nodos = 0
+
+    def recorrer(inicio, restantes, minimo, maximo, parcial):
+        nonlocal nodos
+        nodos += 1
+        if fin is not None and nodos % NODOS_POR_CONTROL == 0 and time.perf_counter() > fin:
+            raise _TiempoAgotado
+        if restantes == 2:
+            # Todos los primeros elementos a la vez: el rango del segundo
+            # de cada uno sale de un searchsorted vectorizado
+            primeros = np.arange(max(inicio, bisect_left(montos, minimo - montos[-1], inicio)), n - 1)
+            primeros = primeros[valores[primeros] + valores[primeros + 1] <= maximo]
+            desde = np.maximum(np.searchsorted(valores, minimo - valores[primeros], side='left'), primeros + 1)
+            hasta = np.searchsorted(valores, maximo - valores[primeros], side='right')
+            con_pareja = hasta > desde
+            for i, d, h in zip(primeros[con_pareja].tolist(), desde[con_pareja].tolist(), hasta[con_pareja].tolist()):
+                for j in range(d, h):
+                    combinaciones.append(parcial + (i, j))
+                    if len(combinaciones) >= limite:
+                        return
+            return
+        # Con este elemento y los restantes - 1 más grandes no se llega al mínimo
+        mayores = acumulados[n] - acumulados[n - restantes + 1]
+        for i in range(max(inicio, bisect_left(montos, minimo - mayores, inicio)), n - restantes + 1):
+            # Con este elemento y los siguientes más chicos ya se pasa del máximo
+            if acumulados[i + restantes] - acumulados[i] > maximo:
+                break
+            recorrer(i + 1, restantes - 1, minimo - montos[i], maximo - montos[i], parcial + (i,))
+            if len(combinaciones) >= limite:
+                return
+
+    try:
+        for elementos in range(2, min(max_elementos, n) + 1):
+            recorrer(0, elementos, minimo, maximo, ())
+            if len(combinaciones) >= limite:
+                return combinaciones, False
+    except _TiempoAgotado:
+        return combinaciones, False
+    return combinaciones, True
+
+
+def _validar_criterios(criterios):
+    criterios = {**CRITERIOS_GRUPO, **(criterios or {})}
+    if criterios['monto'] not in TOLERANCIAS_MONTO:
+        raise ValueError("El criterio de monto debe ser 'exacto', '1%', '5%' o '10%'")
+    if not isinstance(criterios['fecha'], int) or criterios['fecha'] < 0:
+        raise ValueError('El criterio de fecha debe ser un número de días')
+    if not isinstance(criterios['elementos'], int) or not 2 <= criterios['elementos'] <= MAX_ELEMENTOS:
+        raise ValueError(f'El máximo de elementos debe estar entre 2 y {MAX_ELEMENTOS}')
+    return criterios
+
+
+def _candidatos(indice, origen, criterios, maximo):
+    """Posiciones del índice con monto en (0, maximo] dentro de la ventana de fechas"""
+    dia = origen['dia']
+    inicio = np.searchsorted(indice.dias_ordenados, dia - criterios['fecha'], side='left')
+    fin = np.searchsorted(indice.dias_ordenados, dia + criterios['fecha'], side='right')
+    posiciones = indice.orden_dia[inicio:fin]
+    centavos = indice.centavos[posiciones]
+    posiciones = posiciones[(centavos > 0) & (centavos <= maximo)]
+
+    # Criterio de nombre (LIKE '%x%' sobre nombre_norm, como en la búsqueda manual)
+    if criterios['nombre'] and len(posiciones):
+        patrones = [coincide_like(texto) for columna, texto in patrones_busqueda(origen, {'nombre': True})
+                    if columna == 'nombre_norm']
+        nombres = indice.nombres
+        posiciones = np.array([p for p in posiciones.tolist()
+                               if all(coincide(nombres[p]) for coincide in patrones)], dtype=np.int64)
+    return posiciones
+
+
+def _buscar(lado_origen, lado, origen_id, criterios, limit):
+    criterios = _validar_criterios(criterios)
+    inicio = time.perf_counter()
+    resultado = {'grupos': [], 'candidatos': 0, 'completo': True}
+
+    origen = get_indice(lado_origen).fila(origen_id)
+    if origen is None:
+        conn = get_db()
+        origen = conn.execute(f'SELECT * FROM {TABLAS[lado_origen]} WHERE id = ?', (origen_id,)).fetchone()
+        conn.close()
+    if not origen or not origen['centavos'] or origen['centavos'] <= 0 or origen['dia'] is None:
+        return resultado
+
+    minimo, maximo = rango_centavos(origen['centavos'], criterios['monto'])
+    indice = get_indice(lado)
+    posiciones = _candidatos(indice, origen, criterios, maximo)
+    orden = np.argsort(indice.centavos[posiciones], kind='stable')
+    posiciones = posiciones[orden]
+    montos = indice.centavos[posiciones].astype(np.int64).tolist()
+    resultado['candidatos'] = len(montos)
+
+    restantes = SEGUNDOS_POR_CONSULTA - (time.perf_counter() - inicio)
+    combinaciones, completo = combinaciones_suma(
+        montos, minimo, maximo, criterios['elementos'], segundos=max(restantes, 0)
+    )
+    resultado['completo'] = completo
+
+    # Orden: menos elementos, menor diferencia de monto, menor distancia en días
+    grupos = []
+    for combinacion in combinaciones:
+        total = sum(montos[i] for i in combinacion)
+        dias = [abs(int(indice.dias[posiciones[i]]) - origen['dia']) for i in combinacion]
+        grupos.append((len(combinacion), abs(total - origen['centavos']), max(dias), sum(dias), combinacion, total))
+    grupos.sort(key=lambda g: g[:4])
+
+    for elementos, diferencia, dias_max, _, combinacion, total in grupos[:limit]:
+        resultado['grupos'].append({
+            'operaciones': [indice.fila_en(posiciones[i]) for i in combinacion],
+            'total': total / 100,
+            'diferencia_monto': diferencia / 100,
+            'dias_diferencia_max': dias_max,
+        })
+    resultado['segundos'] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+def buscar_grupos_para_banco(banco_id, criterios=None, limit=10):
+    """Combinaciones de ventas sin match cuyo total cubre la operación de banco"""
+    return _buscar('banco', 'ventas', banco_id, criterios, limit)
+
+
+def buscar_grupos_para_venta(venta_id, criterios=None, limit=10):
+    """Combinaciones de operaciones de banco sin match cuyo total cubre la venta"""
+    return _buscar('ventas', 'banco', venta_id, criterios, limit)
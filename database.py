@@ -1,24 +1,171 @@
 import sqlite3
+import base64
 import hashlib
-from datetime import datetime
+import json
+import math
+import re
+import string
+import threading
+import time
+import unicodedata
+from datetime import date, datetime, timedelta
 import os
 
+import auditoria
+import metricas
+
 DATABASE_PATH = 'data/match_bancario.db'
 
 
+# Pragmas aplicados a cada conexión nueva. WAL permite leer mientras otro
+# escribe y synchronous=NORMAL es seguro en WAL (solo se pierde la última
+# transacción ante un corte de energía, nunca se corrompe la base).
+PRAGMAS_CONEXION = (
+    'PRAGMA busy_timeout = 10000',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -32000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Conexiones libres que guarda cada hilo para reutilizar
+CONEXIONES_LIBRES_POR_HILO = 2
+
+_pool = threading.local()
+
+
+class ConexionPool(sqlite3.Connection):
+    """
+    Conexión del pool: close() la devuelve al pool del hilo en lugar de
+    cerrarla, descartando la transacción abierta y restaurando row_factory.
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        self.row_factory = sqlite3.Row
+        libres = _conexiones_libres()
+        if self.pid == os.getpid() and len(libres) < CONEXIONES_LIBRES_POR_HILO:
+            libres.append(self)
+        else:
+            self.cerrar()
+
+    def cerrar(self):
+        """Cierra la conexión de verdad"""
+        super().close()
+
+
+class ConexionMedida(ConexionPool):
+    """Conexión del pool cuyas consultas registran métricas (METRICAS_ACTIVAS=1)"""
+
+    def cursor(self, factory=metricas.CursorMedido):
+        return super().cursor(factory)
+
+    # Connection.execute no pasa por cursor(), así que se redirige
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.cursor().executemany(sql, secuencia)
+
+
+def _conexiones_libres():
+    """Lista de conexiones libres del hilo actual (vacía tras un fork)"""
+    if getattr(_pool, 'pid', None) != os.getpid():
+        _pool.pid = os.getpid()
+        _pool.libres = []
+    return _pool.libres
+
+
+def cerrar_conexiones():
+    """Cierra las conexiones libres del pool del hilo actual"""
+    libres = _conexiones_libres()
+    while libres:
+        libres.pop().cerrar()
+
+
 def get_db():
-    """Obtiene conexión a la base de datos"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """Obtiene una conexión del pool del hilo (close() la devuelve al pool)"""
+    libres = _conexiones_libres()
+    while libres:
+        conn = libres.pop()
+        if conn.ruta == DATABASE_PATH:
+            return conn
+        conn.cerrar()
+
+    conn = sqlite3.connect(DATABASE_PATH, factory=ConexionMedida if metricas.ACTIVAS else ConexionPool)
+    conn.ruta = DATABASE_PATH
+    conn.pid = os.getpid()
+    for pragma in PRAGMAS_CONEXION:
+        conn.execute(pragma)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+# Conexión propia de cada proceso para leer las versiones
+_conexion_version = None
+_clave_version = None
+_data_version = None
+_versiones = None
+_lock_version = threading.Lock()
+
+
+def _leer_versiones():
+    """
+    Contadores (datos, sugerencias, importaciones) de la tabla versiones.
+
+    PRAGMA data_version cambia cada vez que otra conexión (de este u otro
+    proceso) confirma escrituras en cualquier tabla: mientras no cambie,
+    los contadores no se vuelven a leer.
+    """
+    global _conexion_version, _clave_version, _data_version, _versiones
+    with _lock_version:
+        if _conexion_version is None or _clave_version != (os.getpid(), DATABASE_PATH):
+            _conexion_version = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+            _clave_version = (os.getpid(), DATABASE_PATH)
+            _data_version = None
+        data_version = _conexion_version.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != _data_version:
+            valores = dict(_conexion_version.execute('SELECT clave, valor FROM versiones').fetchall())
+            _versiones = (valores['datos'], valores['sugerencias'], valores['importaciones'])
+            _data_version = data_version
+        return _versiones
+
+
+def get_version_datos():
+    """
+    Versión de las operaciones y los matches vista por este proceso.
+
+    La suben los triggers de esas tablas en cada escritura confirmada, de
+    cualquier conexión o proceso; escribir en otras tablas (sugerencias,
+    progreso de importaciones, eventos) no la cambia. Sirve para invalidar
+    datos en memoria como los índices de candidatos.
+    """
+    return _leer_versiones()[0]
+
+
+def get_version_paginas():
+    """
+    Versión de lo que muestran las páginas: los datos, las sugerencias y el
+    estado de las importaciones (el aviso del dashboard)
+    """
+    return _leer_versiones()
+
+
 def init_db():
-    """Inicializa las tablas de la base de datos"""
-    os.makedirs('data', exist_ok=True)
+    """
+    Inicializa la base de datos aplicando las migraciones pendientes. No se
+    llama al importar el módulo: la llaman la app al arrancar y la CLI.
+    """
+    os.makedirs(os.path.dirname(DATABASE_PATH) or '.', exist_ok=True)
     conn = get_db()
-    cursor = conn.cursor()
+    aplicar_migraciones(conn)
+    conn.close()
+
 
+def _migracion_esquema_base(cursor):
+    """Tablas de operaciones, matches e importaciones con sus índices iniciales"""
     # Tabla operaciones_banco
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS operaciones_banco (
@@ -65,6 +212,22 @@ def init_db():
         )
     ''')
 
+    # Tabla importaciones (cola de importación en segundo plano)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS importaciones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            archivos TEXT,
+            estado TEXT DEFAULT 'EN_COLA',
+            filas_total INTEGER,
+            filas_procesadas INTEGER DEFAULT 0,
+            resultado TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
     # Índices para búsqueda rápida
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_banco_monto ON operaciones_banco(monto)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_banco_fecha ON operaciones_banco(fecha)')
@@ -72,8 +235,429 @@ def init_db():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON operaciones_ventas(fecha)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_estado ON matches(estado)')
 
-    conn.commit()
-    conn.close()
+
+def _migracion_conciliado_y_resumen(cursor):
+    """
+    Índices de matches, columna conciliado con índices parciales para los
+    listados sin match, y tabla resumen mantenida por triggers.
+    """
+    # Índices de matches: los pares (banco_id, venta_id) cubren las búsquedas
+    # de duplicados y de matches existentes sin tocar la tabla
+    cursor.execute('DROP INDEX IF EXISTS idx_matches_banco')
+    cursor.execute('DROP INDEX IF EXISTS idx_matches_venta')
+    cursor.execute('DROP INDEX IF EXISTS idx_matches_estado')
+    cursor.execute('CREATE INDEX idx_matches_banco_venta ON matches(banco_id, venta_id)')
+    cursor.execute('CREATE INDEX idx_matches_venta_banco ON matches(venta_id, banco_id)')
+    cursor.execute('CREATE INDEX idx_matches_estado_confirmed ON matches(estado, confirmed_at)')
+
+    # conciliado = 1 si la operación tiene al menos un match
+    for tabla, columna in (('operaciones_banco', 'banco_id'), ('operaciones_ventas', 'venta_id')):
+        cursor.execute(f'ALTER TABLE {tabla} ADD COLUMN conciliado INTEGER NOT NULL DEFAULT 0')
+        cursor.execute(f'UPDATE {tabla} SET conciliado = 1 WHERE id IN (SELECT {columna} FROM matches)')
+
+    # Índices parciales para los listados y conteos sin match
+    cursor.execute('CREATE INDEX idx_banco_sin_match ON operaciones_banco(fecha, monto) WHERE conciliado = 0')
+    cursor.execute('CREATE INDEX idx_ventas_sin_match ON operaciones_ventas(fecha, monto) WHERE conciliado = 0')
+
+    # Tabla resumen (contadores materializados para get_stats)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resumen (
+            clave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for trigger in TRIGGERS_RESUMEN:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger.split()[2]}')
+        cursor.execute(trigger)
+    recalcular_resumen(cursor)
+
+
+def _migracion_importacion_incremental(cursor):
+    """Modo de la importación: completa o incremental (solo filas nuevas)"""
+    cursor.execute('ALTER TABLE importaciones ADD COLUMN incremental INTEGER NOT NULL DEFAULT 0')
+
+
+def _migracion_busqueda_normalizada(cursor):
+    """
+    Columnas nombre_norm y codigo_norm con índices FTS5 de trigramas para
+    las búsquedas por nombre y código, cargadas para las filas existentes.
+    """
+    conn = cursor.connection
+    conn.create_function('normalizar_nombre', 1, normalizar_nombre, deterministic=True)
+    conn.create_function('normalizar_codigo', 1, normalizar_codigo, deterministic=True)
+    for tabla, columna_codigo, fts in (('operaciones_banco', 'codigo_banco', 'fts_banco'),
+                                       ('operaciones_ventas', 'codigo_venta', 'fts_ventas')):
+        cursor.execute(f'ALTER TABLE {tabla} ADD COLUMN nombre_norm TEXT')
+        cursor.execute(f'ALTER TABLE {tabla} ADD COLUMN codigo_norm TEXT')
+        cursor.execute(f'''
+            UPDATE {tabla}
+            SET nombre_norm = normalizar_nombre(nombre), codigo_norm = normalizar_codigo({columna_codigo})
+        ''')
+        # Tabla FTS de contenido externo: el texto vive en la tabla original
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE {fts} USING fts5(
+                nombre_norm, codigo_norm, content='{tabla}', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    for trigger in TRIGGERS_BUSQUEDA:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {trigger.split()[2]}')
+        cursor.execute(trigger)
+
+
+def _migracion_dia_y_centavos(cursor):
+    """
+    Columnas enteras dia (días desde 1970-01-01) y centavos, cargadas para
+    las filas existentes, con índices para las búsquedas por rango.
+    """
+    conn = cursor.connection
+    conn.create_function('dia_fecha', 1, dia_fecha, deterministic=True)
+    conn.create_function('a_centavos', 1, a_centavos, deterministic=True)
+    for tabla, prefijo in (('operaciones_banco', 'banco'), ('operaciones_ventas', 'ventas')):
+        cursor.execute(f'ALTER TABLE {tabla} ADD COLUMN dia INTEGER')
+        cursor.execute(f'ALTER TABLE {tabla} ADD COLUMN centavos INTEGER')
+        cursor.execute(f'UPDATE {tabla} SET dia = dia_fecha(fecha), centavos = a_centavos(monto)')
+
+        # Los índices por fecha y monto de texto/REAL se reemplazan por los enteros
+        cursor.execute(f'DROP INDEX IF EXISTS idx_{prefijo}_monto')
+        cursor.execute(f'DROP INDEX IF EXISTS idx_{prefijo}_fecha')
+        cursor.execute(f'CREATE INDEX idx_{prefijo}_dia ON {tabla}(dia)')
+        # Parciales: las búsquedas de candidatos solo miran operaciones sin match
+        for nombre, columnas in (('sin_match_centavos', 'centavos, dia'), ('sin_match_dia', 'dia, centavos')):
+            cursor.execute(f'CREATE INDEX idx_{prefijo}_{nombre} ON {tabla}({columnas}) WHERE conciliado = 0')
+
+
+def _migracion_secuencia_match_code(cursor):
+    """
+    Secuencia de códigos de match. Arranca después del mayor código con
+    formato de secuencia que ya exista (los aleatorios anteriores tienen
+    otro largo y no pueden coincidir).
+    """
+    cursor.execute('CREATE TABLE secuencias (nombre TEXT PRIMARY KEY, valor INTEGER NOT NULL)')
+    cursor.execute(f"SELECT match_code FROM matches WHERE match_code LIKE '{PREFIJO_MATCH_CODE}%'")
+    numeros = [numero_match_code(row[0]) for row in cursor.fetchall()]
+    ultimo = max((n for n in numeros if n is not None), default=0)
+    cursor.execute("INSERT INTO secuencias VALUES ('match_code', ?)", (ultimo,))
+
+
+def _migracion_grupos_match(cursor):
+    """
+    Matches de grupo (un banco con varias ventas o una venta con varios
+    bancos). Cada par del grupo es una fila de matches con grupo_id, así
+    que conciliado, resumen y exportación no cambian.
+    """
+    cursor.execute('''
+        CREATE TABLE grupos_match (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            match_code TEXT UNIQUE,
+            tipo TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('ALTER TABLE matches ADD COLUMN grupo_id INTEGER REFERENCES grupos_match(id)')
+    cursor.execute('CREATE INDEX idx_matches_grupo ON matches(grupo_id) WHERE grupo_id IS NOT NULL')
+    # El grupo desaparece con su último par
+    cursor.execute('''
+        CREATE TRIGGER trg_grupos_match_delete AFTER DELETE ON matches
+        WHEN OLD.grupo_id IS NOT NULL
+        BEGIN
+            DELETE FROM grupos_match WHERE id = OLD.grupo_id
+                AND NOT EXISTS (SELECT 1 FROM matches WHERE grupo_id = OLD.grupo_id);
+        END
+    ''')
+
+
+def _migracion_sugerencias(cursor):
+    """
+    Sugerencias precalculadas (ver sugerencias.py): los mejores candidatos
+    de cada operación sin match y el registro de las operaciones ya
+    calculadas, con el que se detecta qué cambió desde la última vez.
+    """
+    cursor.execute('''
+        CREATE TABLE sugerencias (
+            lado TEXT NOT NULL,
+            operacion_id INTEGER NOT NULL,
+            posicion INTEGER NOT NULL,
+            candidato_id INTEGER NOT NULL,
+            diferencia_monto REAL,
+            dias_diferencia INTEGER,
+            PRIMARY KEY (lado, operacion_id, posicion)
+        ) WITHOUT ROWID
+    ''')
+    # Al tomar match una operación se recalculan las que la sugerían
+    cursor.execute('CREATE INDEX idx_sugerencias_candidato ON sugerencias(lado, candidato_id)')
+    cursor.execute('''
+        CREATE TABLE sugerencias_calculadas (
+            lado TEXT NOT NULL,
+            operacion_id INTEGER NOT NULL,
+            PRIMARY KEY (lado, operacion_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migracion_eventos(cursor):
+    """
+    Registro de auditoría de solo agregado (ver auditoria.py). Las
+    operaciones se identifican por hash_unico para poder reaplicar las
+    decisiones después de un reset.
+    """
+    cursor.execute('''
+        CREATE TABLE eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            creado_en TIMESTAMP NOT NULL,
+            usuario TEXT,
+            accion TEXT NOT NULL,
+            origen TEXT,
+            estado TEXT,
+            match_code TEXT,
+            grupo_code TEXT,
+            grupo_tipo TEXT,
+            banco_hash TEXT,
+            venta_hash TEXT,
+            match_tipo TEXT,
+            confianza TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_eventos_par ON eventos(banco_hash, venta_hash)')
+    for operacion in ('UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER trg_eventos_{operacion.lower()} BEFORE {operacion} ON eventos
+            BEGIN
+                SELECT RAISE(ABORT, 'eventos es de solo agregado');
+            END
+        ''')
+
+
+def _migracion_versiones(cursor):
+    """
+    Contadores de versión (ver get_version_datos): datos lo suben los
+    triggers de operaciones y matches, sugerencias actualizar_sugerencias.
+    """
+    cursor.execute('CREATE TABLE versiones (clave TEXT PRIMARY KEY, valor INTEGER NOT NULL)')
+    cursor.execute("INSERT INTO versiones VALUES ('datos', 0), ('sugerencias', 0)")
+    for tabla in ('operaciones_banco', 'operaciones_ventas', 'matches'):
+        for operacion in ('INSERT', 'UPDATE', 'DELETE'):
+            # conciliado solo cambia por los triggers de matches, que ya cuentan
+            cuando = 'WHEN NEW.conciliado IS OLD.conciliado' if operacion == 'UPDATE' and tabla != 'matches' else ''
+            cursor.execute(f'''
+                CREATE TRIGGER trg_version_{tabla}_{operacion.lower()} AFTER {operacion} ON {tabla} {cuando}
+                BEGIN
+                    UPDATE versiones SET valor = valor + 1 WHERE clave = 'datos';
+                END
+            ''')
+
+
+def _migracion_latido_importaciones(cursor):
+    """
+    Columna actualizado de importaciones: la última señal de vida del
+    proceso que la corre (ver get_importacion_activa). Las que estaban
+    activas arrancan con la hora de la migración.
+    """
+    cursor.execute('ALTER TABLE importaciones ADD COLUMN actualizado TIMESTAMP')
+    cursor.execute('''
+        UPDATE importaciones SET actualizado = ?
+        WHERE estado IN ('EN_COLA', 'PROCESANDO')
+    ''', (datetime.now().isoformat(),))
+
+
+def _migracion_version_importaciones(cursor):
+    """
+    Contador importaciones: lo suben los triggers al encolar una importación
+    y al cambiar su estado. El progreso y el latido no lo cambian; el
+    dashboard los consulta aparte (/api/import).
+    """
+    cursor.execute("INSERT INTO versiones VALUES ('importaciones', 0)")
+    for operacion, cuando in (('INSERT', ''), ('UPDATE', 'WHEN NEW.estado IS NOT OLD.estado'), ('DELETE', '')):
+        cursor.execute(f'''
+            CREATE TRIGGER trg_version_importaciones_{operacion.lower()} AFTER {operacion} ON importaciones {cuando}
+            BEGIN
+                UPDATE versiones SET valor = valor + 1 WHERE clave = 'importaciones';
+            END
+        ''')
+
+
+# Migraciones de esquema, aplicadas en orden según PRAGMA user_version.
+# Una migración publicada no se modifica: los cambios van en una nueva.
+MIGRACIONES = [
+    (1, 'Esquema base', _migracion_esquema_base),
+    (2, 'Índices de matches, columna conciliado y tabla resumen', _migracion_conciliado_y_resumen),
+    (3, 'Modo incremental de importaciones', _migracion_importacion_incremental),
+    (4, 'Búsqueda normalizada por nombre y código', _migracion_busqueda_normalizada),
+    (5, 'Columnas enteras de día y centavos', _migracion_dia_y_centavos),
+    (6, 'Secuencia de códigos de match', _migracion_secuencia_match_code),
+    (7, 'Matches de grupo', _migracion_grupos_match),
+    (8, 'Sugerencias precalculadas', _migracion_sugerencias),
+    (9, 'Registro de auditoría', _migracion_eventos),
+    (10, 'Contadores de versión de los datos', _migracion_versiones),
+    (11, 'Latido de las importaciones', _migracion_latido_importaciones),
+    (12, 'Contador de versión de las importaciones', _migracion_version_importaciones),
+]
+
+
+def aplicar_migraciones(conn):
+    """Aplica las migraciones pendientes, cada una en su propia transacción"""
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for numero, descripcion, migracion in MIGRACIONES:
+        if numero <= version:
+            continue
+        cursor.execute('BEGIN IMMEDIATE')
+        # Otro proceso pudo aplicarla mientras esperábamos el bloqueo
+        if cursor.execute('PRAGMA user_version').fetchone()[0] >= numero:
+            conn.rollback()
+            continue
+        try:
+            migracion(cursor)
+            cursor.execute(f'PRAGMA user_version = {numero}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migración {numero} aplicada: {descripcion}")
+
+
+# Triggers que mantienen la tabla resumen y la columna conciliado al día
+# en cada escritura
+TRIGGERS_RESUMEN = [
+    '''
+    CREATE TRIGGER trg_resumen_banco_insert AFTER INSERT ON operaciones_banco
+    BEGIN
+        UPDATE resumen SET valor = valor + 1 WHERE clave = 'total_banco';
+        UPDATE resumen SET valor = valor + 1 WHERE clave = 'banco_sin_match' AND NEW.conciliado = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_resumen_banco_delete AFTER DELETE ON operaciones_banco
+    BEGIN
+        UPDATE resumen SET valor = valor - 1 WHERE clave = 'total_banco';
+        UPDATE resumen SET valor = valor - 1 WHERE clave = 'banco_sin_match' AND OLD.conciliado = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_resumen_ventas_insert AFTER INSERT ON operaciones_ventas
+    BEGIN
+        UPDATE resumen SET valor = valor + 1 WHERE clave = 'total_ventas';
+        UPDATE resumen SET valor = valor + 1 WHERE clave = 'ventas_sin_match' AND NEW.conciliado = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_resumen_ventas_delete AFTER DELETE ON operaciones_ventas
+    BEGIN
+        UPDATE resumen SET valor = valor - 1 WHERE clave = 'total_ventas';
+        UPDATE resumen SET valor = valor - 1 WHERE clave = 'ventas_sin_match' AND OLD.conciliado = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_resumen_matches_insert AFTER INSERT ON matches
+    BEGIN
+        UPDATE resumen SET valor = valor + 1
+            WHERE clave = CASE NEW.estado WHEN 'CONFIRMADO' THEN 'confirmados'
+                                          WHEN 'PENDIENTE' THEN 'pendientes' END;
+        UPDATE resumen SET valor = valor - 1 WHERE clave = 'banco_sin_match'
+            AND EXISTS (SELECT 1 FROM operaciones_banco WHERE id = NEW.banco_id AND conciliado = 0);
+        UPDATE resumen SET valor = valor - 1 WHERE clave = 'ventas_sin_match'
+            AND EXISTS (SELECT 1 FROM operaciones_ventas WHERE id = NEW.venta_id AND conciliado = 0);
+        UPDATE operaciones_banco SET conciliado = 1 WHERE id = NEW.banco_id AND conciliado = 0;
+        UPDATE operaciones_ventas SET conciliado = 1 WHERE id = NEW.venta_id AND conciliado = 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_resumen_matches_delete AFTER DELETE ON matches
+    BEGIN
+        UPDATE resumen SET valor = valor - 1
+            WHERE clave = CASE OLD.estado WHEN 'CONFIRMADO' THEN 'confirmados'
+                                          WHEN 'PENDIENTE' THEN 'pendientes' END;
+        UPDATE resumen SET valor = valor + 1 WHERE clave = 'banco_sin_match'
+            AND EXISTS (SELECT 1 FROM operaciones_banco WHERE id = OLD.banco_id AND conciliado = 1)
+            AND NOT EXISTS (SELECT 1 FROM matches WHERE banco_id = OLD.banco_id);
+        UPDATE resumen SET valor = valor + 1 WHERE clave = 'ventas_sin_match'
+            AND EXISTS (SELECT 1 FROM operaciones_ventas WHERE id = OLD.venta_id AND conciliado = 1)
+            AND NOT EXISTS (SELECT 1 FROM matches WHERE venta_id = OLD.venta_id);
+        UPDATE operaciones_banco SET conciliado = 0 WHERE id = OLD.banco_id
+            AND NOT EXISTS (SELECT 1 FROM matches WHERE banco_id = OLD.banco_id);
+        UPDATE operaciones_ventas SET conciliado = 0 WHERE id = OLD.venta_id
+            AND NOT EXISTS (SELECT 1 FROM matches WHERE venta_id = OLD.venta_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_resumen_matches_estado AFTER UPDATE OF estado ON matches
+    WHEN OLD.estado IS NOT NEW.estado
+    BEGIN
+        UPDATE resumen SET valor = valor - 1
+            WHERE clave = CASE OLD.estado WHEN 'CONFIRMADO' THEN 'confirmados'
+                                          WHEN 'PENDIENTE' THEN 'pendientes' END;
+        UPDATE resumen SET valor = valor + 1
+            WHERE clave = CASE NEW.estado WHEN 'CONFIRMADO' THEN 'confirmados'
+                                          WHEN 'PENDIENTE' THEN 'pendientes' END;
+    END
+    ''',
+]
+
+
+# Triggers que mantienen los índices FTS de nombre_norm / codigo_norm. Los
+# cambios de conciliado no tocan esas columnas y no reescriben el índice.
+TRIGGERS_BUSQUEDA = [
+    '''
+    CREATE TRIGGER trg_fts_banco_insert AFTER INSERT ON operaciones_banco
+    BEGIN
+        INSERT INTO fts_banco(rowid, nombre_norm, codigo_norm) VALUES (NEW.id, NEW.nombre_norm, NEW.codigo_norm);
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_fts_banco_delete AFTER DELETE ON operaciones_banco
+    BEGIN
+        INSERT INTO fts_banco(fts_banco, rowid, nombre_norm, codigo_norm)
+            VALUES ('delete', OLD.id, OLD.nombre_norm, OLD.codigo_norm);
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_fts_banco_update AFTER UPDATE OF nombre_norm, codigo_norm ON operaciones_banco
+    BEGIN
+        INSERT INTO fts_banco(fts_banco, rowid, nombre_norm, codigo_norm)
+            VALUES ('delete', OLD.id, OLD.nombre_norm, OLD.codigo_norm);
+        INSERT INTO fts_banco(rowid, nombre_norm, codigo_norm) VALUES (NEW.id, NEW.nombre_norm, NEW.codigo_norm);
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_fts_ventas_insert AFTER INSERT ON operaciones_ventas
+    BEGIN
+        INSERT INTO fts_ventas(rowid, nombre_norm, codigo_norm) VALUES (NEW.id, NEW.nombre_norm, NEW.codigo_norm);
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_fts_ventas_delete AFTER DELETE ON operaciones_ventas
+    BEGIN
+        INSERT INTO fts_ventas(fts_ventas, rowid, nombre_norm, codigo_norm)
+            VALUES ('delete', OLD.id, OLD.nombre_norm, OLD.codigo_norm);
+    END
+    ''',
+    '''
+    CREATE TRIGGER trg_fts_ventas_update AFTER UPDATE OF nombre_norm, codigo_norm ON operaciones_ventas
+    BEGIN
+        INSERT INTO fts_ventas(fts_ventas, rowid, nombre_norm, codigo_norm)
+            VALUES ('delete', OLD.id, OLD.nombre_norm, OLD.codigo_norm);
+        INSERT INTO fts_ventas(rowid, nombre_norm, codigo_norm) VALUES (NEW.id, NEW.nombre_norm, NEW.codigo_norm);
+    END
+    ''',
+]
+
+
+def recalcular_resumen(conn):
+    """Recalcula desde cero los contadores de la tabla resumen"""
+    conn.execute('''
+        INSERT OR REPLACE INTO resumen (clave, valor)
+        SELECT 'total_banco', COUNT(*) FROM operaciones_banco
+        UNION ALL
+        SELECT 'total_ventas', COUNT(*) FROM operaciones_ventas
+        UNION ALL
+        SELECT 'confirmados', COUNT(*) FROM matches WHERE estado = 'CONFIRMADO'
+        UNION ALL
+        SELECT 'pendientes', COUNT(*) FROM matches WHERE estado = 'PENDIENTE'
+        UNION ALL
+        SELECT 'banco_sin_match', COUNT(*) FROM operaciones_banco WHERE conciliado = 0
+        UNION ALL
+        SELECT 'ventas_sin_match', COUNT(*) FROM operaciones_ventas WHERE conciliado = 0
+    ''')
 
 
 def generar_hash_banco(fecha, monto, codigo_banco, nombre):
@@ -88,11 +672,152 @@ def generar_hash_venta(factura, fecha, monto, nombre, codigo_venta):
     return hashlib.sha256(datos.encode()).hexdigest()[:16]
 
 
-def generar_match_code():
-    """Genera código de match de 6 caracteres"""
-    import random
-    import string
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+_SEPARADORES = re.compile(r'[\W_]+')
+
+
+def _sin_tildes(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', str(texto)) if not unicodedata.combining(c))
+
+
+def normalizar_nombre(texto):
+    """Nombre para búsquedas: sin tildes, en mayúsculas y con un espacio entre palabras"""
+    if texto is None:
+        return None
+    return _SEPARADORES.sub(' ', _sin_tildes(texto).upper()).strip()
+
+
+def normalizar_codigo(texto):
+    """Código para búsquedas: sin tildes, en mayúsculas y sin separadores"""
+    if texto is None:
+        return None
+    return _SEPARADORES.sub('', _sin_tildes(texto).upper())
+
+
+_EPOCA = date(1970, 1, 1)
+_FECHA_ISO = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def dia_fecha(fecha):
+    """Número de día (desde 1970-01-01) de una fecha 'YYYY-MM-DD'; None si no es válida"""
+    if not isinstance(fecha, str) or not _FECHA_ISO.fullmatch(fecha):
+        return None
+    try:
+        return (date.fromisoformat(fecha) - _EPOCA).days
+    except ValueError:
+        return None
+
+
+def a_centavos(monto):
+    """Monto en centavos enteros; None si no hay monto"""
+    if monto is None or isinstance(monto, str):
+        return None
+    if math.isnan(monto) or math.isinf(monto):
+        return None
+    return int(round(monto * 100))
+
+
+# Tolerancia de cada criterio de monto, en porcentaje ('cualquiera' no acota)
+TOLERANCIAS_MONTO = {'exacto': 0, '1%': 1, '5%': 5, '10%': 10}
+
+
+def rango_centavos(centavos, monto_criterio):
+    """
+    Límites [mínimo, máximo] en centavos aceptados para el criterio de
+    monto. Aritmética entera: sirve para ints y para arrays de NumPy.
+    """
+    if centavos is None:
+        return None, None
+    porcentaje = TOLERANCIAS_MONTO[monto_criterio]
+    return -(-centavos * (100 - porcentaje) // 100), centavos * (100 + porcentaje) // 100
+
+
+def patrones_busqueda(origen, criterios):
+    """
+    Textos que deben contener nombre_norm / codigo_norm de los candidatos
+    según los criterios: las dos primeras palabras del nombre (de más de
+    2 letras) y los primeros 8 caracteres del código de la operación origen.
+    Devuelve una lista de (columna, texto).
+    """
+    patrones = []
+    if criterios.get('nombre') and origen['nombre_norm']:
+        patrones += [('nombre_norm', parte) for parte in origen['nombre_norm'].split()[:2] if len(parte) > 2]
+    if criterios.get('codigo') and origen['codigo_norm']:
+        patrones.append(('codigo_norm', origen['codigo_norm'][:8]))
+    return patrones
+
+
+def _condiciones_texto(alias, fts, patrones, usar_indice):
+    """
+    Condiciones LIKE '%x%' sobre las columnas normalizadas y sus parámetros.
+
+    Con usar_indice (sin criterio de monto que acote los candidatos) se
+    agrega la búsqueda en el índice FTS de trigramas, que entonces guía la
+    consulta. Los textos de menos de 3 caracteres no tienen trigramas y
+    solo se verifican con LIKE.
+    """
+    condiciones = [f"{alias}.{columna} LIKE ?" for columna, _ in patrones]
+    parametros = [f"%{texto}%" for _, texto in patrones]
+    terminos = [f'{columna}:"{texto}"' for columna, texto in patrones if len(texto) >= 3]
+    if usar_indice and terminos:
+        condiciones.append(f"{alias}.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)")
+        parametros.append(' AND '.join(terminos))
+    return condiciones, parametros
+
+
+# Códigos de match: PREFIJO_MATCH_CODE + número de secuencia en base 36 con
+# al menos 6 dígitos (M00001A). Los códigos aleatorios de versiones
+# anteriores tienen 6 caracteres, así que nunca coinciden con estos.
+PREFIJO_MATCH_CODE = 'M'
+_BASE36 = string.digits + string.ascii_uppercase
+_MATCH_CODE_SECUENCIA = re.compile(rf'{PREFIJO_MATCH_CODE}[0-9A-Z]{{6,}}')
+
+
+def codificar_match_code(numero):
+    """Código de match del número de secuencia"""
+    digitos = ''
+    while numero:
+        numero, resto = divmod(numero, 36)
+        digitos = _BASE36[resto] + digitos
+    return PREFIJO_MATCH_CODE + digitos.rjust(6, '0')
+
+
+def numero_match_code(codigo):
+    """Número de secuencia de un código, o None si no tiene ese formato"""
+    if isinstance(codigo, str) and _MATCH_CODE_SECUENCIA.fullmatch(codigo):
+        return int(codigo[len(PREFIJO_MATCH_CODE):], 36)
+    return None
+
+
+def reservar_match_codes(conn, cantidad):
+    """
+    Reserva un bloque de códigos de match consecutivos.
+
+    El UPDATE toma el bloqueo de escritura, así que dos procesos nunca
+    reciben el mismo bloque; los números de una transacción que se
+    deshace quedan sin usar. No hace commit.
+    """
+    if cantidad <= 0:
+        return []
+    ultimo = conn.execute(
+        "UPDATE secuencias SET valor = valor + ? WHERE nombre = 'match_code' RETURNING valor",
+        (cantidad,)
+    ).fetchone()[0]
+    return [codificar_match_code(n) for n in range(ultimo - cantidad + 1, ultimo + 1)]
+
+
+def generar_match_code(conn):
+    """Reserva un código de match nuevo (no hace commit)"""
+    return reservar_match_codes(conn, 1)[0]
+
+
+def avanzar_secuencia_match_code(conn, codigos):
+    """
+    Lleva la secuencia más allá de los códigos dados que tengan su formato
+    (códigos que vienen en un archivo), para no volver a generarlos.
+    """
+    numeros = [n for n in map(numero_match_code, codigos) if n is not None]
+    if numeros:
+        conn.execute("UPDATE secuencias SET valor = MAX(valor, ?) WHERE nombre = 'match_code'", (max(numeros),))
 
 
 def determinar_estado_match(match_tipo, confianza):
@@ -145,9 +870,10 @@ def insertar_banco(conn, row_original, fecha, codigo_banco, nombre, monto):
     try:
         cursor.execute('''
             INSERT OR IGNORE INTO operaciones_banco
-            (hash_unico, row_original, fecha, codigo_banco, nombre, monto)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (hash_unico, row_original, fecha_str, codigo_banco, nombre, monto))
+            (hash_unico, row_original, fecha, codigo_banco, nombre, monto, nombre_norm, codigo_norm, dia, centavos)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (hash_unico, row_original, fecha_str, codigo_banco, nombre, monto,
+              normalizar_nombre(nombre), normalizar_codigo(codigo_banco), dia_fecha(fecha_str), a_centavos(monto)))
 
         # Obtener el ID (sea nuevo o existente)
         cursor.execute('SELECT id FROM operaciones_banco WHERE hash_unico = ?', (hash_unico,))
@@ -167,9 +893,11 @@ def insertar_venta(conn, row_original, factura, codigo_venta, fecha, nombre, mon
     try:
         cursor.execute('''
             INSERT OR IGNORE INTO operaciones_ventas
-            (hash_unico, row_original, factura, codigo_venta, fecha, nombre, monto)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (hash_unico, row_original, factura, codigo_venta, fecha_str, nombre, monto))
+            (hash_unico, row_original, factura, codigo_venta, fecha, nombre, monto,
+             nombre_norm, codigo_norm, dia, centavos)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (hash_unico, row_original, factura, codigo_venta, fecha_str, nombre, monto,
+              normalizar_nombre(nombre), normalizar_codigo(codigo_venta), dia_fecha(fecha_str), a_centavos(monto)))
 
         # Obtener el ID (sea nuevo o existente)
         cursor.execute('SELECT id FROM operaciones_ventas WHERE hash_unico = ?', (hash_unico,))
@@ -192,7 +920,7 @@ def insertar_match(conn, banco_id, venta_id, match_tipo, confianza, estado):
     if cursor.fetchone():
         return None  # Ya existe
 
-    match_code = generar_match_code()
+    match_code = generar_match_code(conn)
     confirmed_at = datetime.now().isoformat() if estado == 'CONFIRMADO' else None
 
     try:
@@ -219,6 +947,7 @@ def insertar_match_con_codigo(conn, banco_id, venta_id, match_tipo, confianza, e
         return None  # Ya existe
 
     confirmed_at = datetime.now().isoformat() if estado == 'CONFIRMADO' else None
+    avanzar_secuencia_match_code(conn, [match_code])
 
     try:
         cursor.execute('''
@@ -242,111 +971,79 @@ def get_stats(venta_fecha_desde=None, venta_fecha_hasta=None, banco_fecha_desde=
         banco_fecha_hasta: Fecha fin para filtrar banco (YYYY-MM-DD)
 
     Filtros independientes para ventas y banco.
-    Los totales siempre son globales.
+    Los totales siempre son globales. Sin filtros, los contadores se leen
+    de la tabla resumen; con filtros se calculan con consultas.
     """
     conn = get_db()
     cursor = conn.cursor()
 
-    stats = {}
+    # Contadores materializados (globales)
+    cursor.execute('SELECT clave, valor FROM resumen')
+    stats = {row['clave']: row['valor'] for row in cursor.fetchall()}
 
-    # Totales siempre globales (sin filtro de fecha)
-    cursor.execute('SELECT COUNT(*) as count FROM operaciones_banco')
-    stats['total_banco'] = cursor.fetchone()['count']
-
-    cursor.execute('SELECT COUNT(*) as count FROM operaciones_ventas')
-    stats['total_ventas'] = cursor.fetchone()['count']
+    filtro_ventas = bool(venta_fecha_desde and venta_fecha_hasta)
+    filtro_banco = bool(banco_fecha_desde and banco_fecha_hasta)
 
     # Construir filtros de fecha independientes para matches
     fecha_conditions = []
     fecha_params = []
 
-    if venta_fecha_desde and venta_fecha_hasta:
-        fecha_conditions.append("(v.fecha >= ? AND v.fecha <= ?)")
-        fecha_params.extend([venta_fecha_desde, venta_fecha_hasta])
+    dias_ventas = [dia_fecha(venta_fecha_desde), dia_fecha(venta_fecha_hasta)]
+    dias_banco = [dia_fecha(banco_fecha_desde), dia_fecha(banco_fecha_hasta)]
+
+    if filtro_ventas:
+        fecha_conditions.append("v.dia BETWEEN ? AND ?")
+        fecha_params.extend(dias_ventas)
 
-    if banco_fecha_desde and banco_fecha_hasta:
-        fecha_conditions.append("(b.fecha >= ? AND b.fecha <= ?)")
-        fecha_params.extend([banco_fecha_desde, banco_fecha_hasta])
+    if filtro_banco:
+        fecha_conditions.append("b.dia BETWEEN ? AND ?")
+        fecha_params.extend(dias_banco)
 
-    fecha_filter = ""
     if fecha_conditions:
         fecha_filter = " AND " + " AND ".join(fecha_conditions)
 
-    # Confirmados (con filtro de fecha si aplica)
-    query = f'''
-        SELECT COUNT(*) as count FROM matches m
-        JOIN operaciones_ventas v ON m.venta_id = v.id
-        JOIN operaciones_banco b ON m.banco_id = b.id
-        WHERE m.estado = 'CONFIRMADO' {fecha_filter}
-    '''
-    cursor.execute(query, fecha_params)
-    stats['confirmados'] = cursor.fetchone()['count']
-
-    # Pendientes (con filtro de fecha si aplica)
-    query = f'''
-        SELECT COUNT(*) as count FROM matches m
-        JOIN operaciones_ventas v ON m.venta_id = v.id
-        JOIN operaciones_banco b ON m.banco_id = b.id
-        WHERE m.estado = 'PENDIENTE' {fecha_filter}
-    '''
-    cursor.execute(query, fecha_params)
-    stats['pendientes'] = cursor.fetchone()['count']
+        # Confirmados y pendientes (con filtro de fecha)
+        for estado, clave in (('CONFIRMADO', 'confirmados'), ('PENDIENTE', 'pendientes')):
+            query = f'''
+                SELECT COUNT(*) as count FROM matches m
+                JOIN operaciones_ventas v ON m.venta_id = v.id
+                JOIN operaciones_banco b ON m.banco_id = b.id
+                WHERE m.estado = ? {fecha_filter}
+            '''
+            cursor.execute(query, [estado] + fecha_params)
+            stats[clave] = cursor.fetchone()['count']
 
     # Sin match banco (con filtro de fecha si aplica)
-    if banco_fecha_desde and banco_fecha_hasta:
+    if filtro_banco:
         cursor.execute('''
             SELECT COUNT(*) as count
             FROM operaciones_banco b
-            LEFT JOIN matches m ON b.id = m.banco_id
-            WHERE m.id IS NULL
-            AND b.fecha >= ? AND b.fecha <= ?
-        ''', [banco_fecha_desde, banco_fecha_hasta])
-    else:
-        cursor.execute('''
-            SELECT COUNT(*) as count
-            FROM operaciones_banco b
-            LEFT JOIN matches m ON b.id = m.banco_id
-            WHERE m.id IS NULL
-        ''')
-    stats['banco_sin_match'] = cursor.fetchone()['count']
+            WHERE b.conciliado = 0
+            AND b.dia BETWEEN ? AND ?
+        ''', dias_banco)
+        stats['banco_sin_match'] = cursor.fetchone()['count']
 
     # Sin match ventas (con filtro de fecha si aplica)
-    if venta_fecha_desde and venta_fecha_hasta:
-        cursor.execute('''
-            SELECT COUNT(*) as count
-            FROM operaciones_ventas v
-            LEFT JOIN matches m ON v.id = m.venta_id
-            WHERE m.id IS NULL
-            AND v.fecha >= ? AND v.fecha <= ?
-        ''', [venta_fecha_desde, venta_fecha_hasta])
-    else:
+    if filtro_ventas:
         cursor.execute('''
             SELECT COUNT(*) as count
             FROM operaciones_ventas v
-            LEFT JOIN matches m ON v.id = m.venta_id
-            WHERE m.id IS NULL
-        ''')
-    stats['ventas_sin_match'] = cursor.fetchone()['count']
-
-    # Rango de fechas banco (excluyendo nulos) - siempre global
-    cursor.execute('''
-        SELECT MIN(fecha) as min_fecha, MAX(fecha) as max_fecha
-        FROM operaciones_banco
-        WHERE fecha IS NOT NULL AND fecha != '' AND fecha NOT LIKE '%NaT%'
-    ''')
-    row = cursor.fetchone()
-    stats['banco_fecha_min'] = row['min_fecha']
-    stats['banco_fecha_max'] = row['max_fecha']
-
-    # Rango de fechas ventas (excluyendo nulos) - siempre global
-    cursor.execute('''
-        SELECT MIN(fecha) as min_fecha, MAX(fecha) as max_fecha
-        FROM operaciones_ventas
-        WHERE fecha IS NOT NULL AND fecha != '' AND fecha NOT LIKE '%NaT%'
-    ''')
-    row = cursor.fetchone()
-    stats['ventas_fecha_min'] = row['min_fecha']
-    stats['ventas_fecha_max'] = row['max_fecha']
+            WHERE v.conciliado = 0
+            AND v.dia BETWEEN ? AND ?
+        ''', dias_ventas)
+        stats['ventas_sin_match'] = cursor.fetchone()['count']
+
+    # Rangos de fechas (solo fechas válidas) - siempre globales.
+    # ORDER BY ... LIMIT 1 recorre el índice de día desde cada extremo.
+    for tabla, prefijo in (('operaciones_banco', 'banco'), ('operaciones_ventas', 'ventas')):
+        for extremo, orden in (('min', 'ASC'), ('max', 'DESC')):
+            cursor.execute(f'''
+                SELECT fecha FROM {tabla}
+                WHERE dia IS NOT NULL
+                ORDER BY dia {orden} LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            stats[f'{prefijo}_fecha_{extremo}'] = row['fecha'] if row else None
 
     # Guardar filtros aplicados
     stats['filtro_venta_fecha_desde'] = venta_fecha_desde
@@ -358,12 +1055,128 @@ def get_stats(venta_fecha_desde=None, venta_fecha_hasta=None, banco_fecha_desde=
     return stats
 
 
-def get_matches_pendientes(limit=50, offset=0):
-    """Obtiene matches pendientes de aprobación"""
+# Claves de orden de cada listado, usadas para la paginación por cursor
+CLAVES_PENDIENTES = ('id',)
+CLAVES_CONFIRMADOS = ('confirmed_at', 'id')
+CLAVES_SIN_MATCH = ('fecha', 'monto', 'id')
+
+
+def codificar_cursor(fila, claves):
+    """Cursor opaco (?after=) con los valores de orden de la última fila"""
+    datos = json.dumps([fila[c] for c in claves], separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor_str, claves):
+    """Devuelve los valores del cursor o None si no es válido"""
+    if not cursor_str:
+        return None
+    try:
+        relleno = '=' * (-len(cursor_str) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor_str + relleno))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != len(claves):
+        return None
+    return valores
+
+
+def _tramos_cursor_sin_match(alias, valores, antes=False):
+    """
+    Condiciones "después de" (o "antes de", recorriendo hacia atrás) para
+    el orden fecha DESC, monto DESC, id DESC, en el orden en que se recorren.
+
+    fecha es NULL si el archivo no trae la columna (y va al final del
+    orden); monto nunca, el importador descarta las filas sin monto. Un OR
+    con fecha IS NULL obligaría a recorrer el índice parcial (fecha, monto)
+    desde el principio, así que cada tramo es una comparación por row-value
+    que busca directo en el índice.
+    """
+    fecha, monto, id_ = valores
+    if antes:
+        if fecha is None:
+            return [
+                (f"{alias}.fecha IS NULL AND ({alias}.monto, {alias}.id) > (?, ?)", [monto, id_]),
+                (f"{alias}.fecha IS NOT NULL", []),
+            ]
+        return [(f"({alias}.fecha, {alias}.monto, {alias}.id) > (?, ?, ?)", [fecha, monto, id_])]
+    if fecha is None:
+        return [(f"{alias}.fecha IS NULL AND ({alias}.monto, {alias}.id) < (?, ?)", [monto, id_])]
+    return [
+        # Con fecha NULL la comparación no es verdadera: van en el tramo siguiente
+        (f"({alias}.fecha, {alias}.monto, {alias}.id) < (?, ?, ?)", [fecha, monto, id_]),
+        (f"{alias}.fecha IS NULL", []),
+    ]
+
+
+def _listar_sin_match(select, alias, limit, offset, after, before):
+    """
+    Filas de select (FROM la tabla de operaciones con ese alias) sin match,
+    en orden fecha DESC, monto DESC, id DESC. Con cursor, los tramos se
+    consultan por separado hasta completar la página.
+    """
     conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute('''
+    tramos = [('', [])]
+    direccion = 'DESC'
+    valores = decodificar_cursor(after, CLAVES_SIN_MATCH)
+    antes = decodificar_cursor(before, CLAVES_SIN_MATCH)
+    if valores:
+        tramos = _tramos_cursor_sin_match(alias, valores)
+        offset = 0
+    elif antes:
+        tramos = _tramos_cursor_sin_match(alias, antes, antes=True)
+        direccion = 'ASC'
+        offset = 0
+
+    results = []
+    for condicion, params in tramos:
+        cursor.execute(f'''
+            {select}
+            WHERE {alias}.conciliado = 0 {'AND ' + condicion if condicion else ''}
+            ORDER BY {alias}.fecha {direccion}, {alias}.monto {direccion}, {alias}.id {direccion}
+            LIMIT ? OFFSET ?
+        ''', params + [limit - len(results), offset])
+        results += [dict(row) for row in cursor.fetchall()]
+        if len(results) == limit:
+            break
+    conn.close()
+
+    if antes:
+        # Si antes no queda una página entera, la anterior es la primera
+        if len(results) < limit:
+            return _listar_sin_match(select, alias, limit, 0, None, None)
+        results.reverse()
+    return results
+
+
+def get_matches_pendientes(limit=50, offset=0, after=None, before=None):
+    """
+    Obtiene matches pendientes de aprobación.
+
+    after: cursor de la página anterior (reemplaza a offset)
+    before: cursor de la página siguiente, para volver atrás (ídem)
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+
+    condicion = ''
+    params = []
+    orden = 'm.id'
+    valores = decodificar_cursor(after, CLAVES_PENDIENTES)
+    antes = decodificar_cursor(before, CLAVES_PENDIENTES)
+    if valores:
+        condicion = 'AND m.id > ?'
+        params = valores
+        offset = 0
+    elif antes:
+        condicion = 'AND m.id < ?'
+        params = antes
+        orden = 'm.id DESC'
+        offset = 0
+
+    cursor.execute(f'''
         SELECT
             m.id, m.match_code, m.match_tipo, m.confianza, m.estado,
             v.row_original as row_venta, v.factura, v.codigo_venta, v.fecha as fecha_venta,
@@ -373,24 +1186,49 @@ def get_matches_pendientes(limit=50, offset=0):
         FROM matches m
         JOIN operaciones_ventas v ON m.venta_id = v.id
         JOIN operaciones_banco b ON m.banco_id = b.id
-        WHERE m.estado = 'PENDIENTE'
-        ORDER BY m.id
+        WHERE m.estado = 'PENDIENTE' {condicion}
+        ORDER BY {orden}
         LIMIT ? OFFSET ?
-    ''', (limit, offset))
+    ''', params + [limit, offset])
 
     results = [dict(row) for row in cursor.fetchall()]
     conn.close()
+    if antes:
+        # Si antes no queda una página entera, la anterior es la primera
+        if len(results) < limit:
+            return get_matches_pendientes(limit)
+        results.reverse()
     return results
 
 
-def get_matches_confirmados(limit=50, offset=0):
-    """Obtiene matches confirmados"""
+def get_matches_confirmados(limit=50, offset=0, after=None, before=None):
+    """
+    Obtiene matches confirmados.
+
+    after: cursor de la página anterior (reemplaza a offset)
+    before: cursor de la página siguiente, para volver atrás (ídem)
+    """
     conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute('''
+    condicion = ''
+    params = []
+    orden = 'm.confirmed_at DESC, m.id DESC'
+    valores = decodificar_cursor(after, CLAVES_CONFIRMADOS)
+    antes = decodificar_cursor(before, CLAVES_CONFIRMADOS)
+    if valores:
+        condicion = 'AND (m.confirmed_at, m.id) < (?, ?)'
+        params = valores
+        offset = 0
+    elif antes:
+        condicion = 'AND (m.confirmed_at, m.id) > (?, ?)'
+        params = antes
+        orden = 'm.confirmed_at, m.id'
+        offset = 0
+
+    cursor.execute(f'''
         SELECT
-            m.id, m.match_code, m.match_tipo, m.confianza, m.estado,
+            m.id, m.match_code, m.match_tipo, m.confianza, m.estado, m.confirmed_at,
             v.row_original as row_venta, v.factura, v.codigo_venta, v.fecha as fecha_venta,
             v.nombre as nombre_venta, v.monto as monto_venta,
             b.row_original as row_banco, b.codigo_banco, b.fecha as fecha_banco,
@@ -398,80 +1236,291 @@ def get_matches_confirmados(limit=50, offset=0):
         FROM matches m
         JOIN operaciones_ventas v ON m.venta_id = v.id
         JOIN operaciones_banco b ON m.banco_id = b.id
-        WHERE m.estado = 'CONFIRMADO'
-        ORDER BY m.confirmed_at DESC
+        WHERE m.estado = 'CONFIRMADO' {condicion}
+        ORDER BY {orden}
         LIMIT ? OFFSET ?
-    ''', (limit, offset))
+    ''', params + [limit, offset])
 
     results = [dict(row) for row in cursor.fetchall()]
     conn.close()
+    if antes:
+        # Si antes no queda una página entera, la anterior es la primera
+        if len(results) < limit:
+            return get_matches_confirmados(limit)
+        results.reverse()
     return results
 
 
-def get_ventas_sin_match(limit=50, offset=0):
-    """Obtiene ventas sin match"""
-    conn = get_db()
-    cursor = conn.cursor()
+def get_ventas_sin_match(limit=50, offset=0, after=None, before=None):
+    """
+    Obtiene ventas sin match.
 
-    cursor.execute('''
-        SELECT v.*
+    Cada fila trae su mejor sugerencia precalculada en las columnas
+    sugerencia_* (NULL si no hay o si la candidata ya tomó match).
+
+    after: cursor de la página anterior (reemplaza a offset)
+    before: cursor de la página siguiente, para volver atrás (ídem)
+    """
+    return _listar_sin_match('''
+        SELECT v.*,
+            c.id as sugerencia_id, c.codigo_banco as sugerencia_codigo_banco, c.nombre as sugerencia_nombre,
+            c.fecha as sugerencia_fecha, c.monto as sugerencia_monto,
+            s.diferencia_monto as sugerencia_diferencia_monto, s.dias_diferencia as sugerencia_dias_diferencia
         FROM operaciones_ventas v
-        LEFT JOIN matches m ON v.id = m.venta_id
-        WHERE m.id IS NULL
-        ORDER BY v.fecha DESC, v.monto DESC
-        LIMIT ? OFFSET ?
-    ''', (limit, offset))
+        LEFT JOIN sugerencias s ON s.lado = 'ventas' AND s.operacion_id = v.id AND s.posicion = 0
+        LEFT JOIN operaciones_banco c ON c.id = s.candidato_id AND c.conciliado = 0
+    ''', 'v', limit, offset, after, before)
 
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return results
 
+def get_banco_sin_match(limit=50, offset=0, after=None, before=None):
+    """
+    Obtiene operaciones de banco sin match.
 
-def get_banco_sin_match(limit=50, offset=0):
-    """Obtiene operaciones de banco sin match"""
-    conn = get_db()
-    cursor = conn.cursor()
+    Cada fila trae su mejor sugerencia precalculada en las columnas
+    sugerencia_* (NULL si no hay o si la candidata ya tomó match).
 
-    cursor.execute('''
-        SELECT b.*
+    after: cursor de la página anterior (reemplaza a offset)
+    before: cursor de la página siguiente, para volver atrás (ídem)
+    """
+    return _listar_sin_match('''
+        SELECT b.*,
+            c.id as sugerencia_id, c.factura as sugerencia_factura, c.nombre as sugerencia_nombre,
+            c.fecha as sugerencia_fecha, c.monto as sugerencia_monto,
+            s.diferencia_monto as sugerencia_diferencia_monto, s.dias_diferencia as sugerencia_dias_diferencia
         FROM operaciones_banco b
-        LEFT JOIN matches m ON b.id = m.banco_id
-        WHERE m.id IS NULL
-        ORDER BY b.fecha DESC, b.monto DESC
-        LIMIT ? OFFSET ?
-    ''', (limit, offset))
+        LEFT JOIN sugerencias s ON s.lado = 'banco' AND s.operacion_id = b.id AND s.posicion = 0
+        LEFT JOIN operaciones_ventas c ON c.id = s.candidato_id AND c.conciliado = 0
+    ''', 'b', limit, offset, after, before)
 
-    results = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return results
+
+# El match pedido y, si es parte de un grupo, el resto de sus pares
+CONDICION_MATCH_O_GRUPO = '''
+    (id = ? OR grupo_id = (SELECT grupo_id FROM matches WHERE id = ?))
+'''
+
+
+def _pares_auditoria(cursor, condicion, params=()):
+    """
+    Pares (match_code, grupo_code, grupo_tipo, banco_hash, venta_hash,
+    match_tipo, confianza) de los matches m que cumplen la condición, para
+    auditoria.registrar. Se leen dentro de la transacción de la escritura.
+    """
+    cursor.execute(f'''
+        SELECT m.match_code, g.match_code, g.tipo, b.hash_unico, v.hash_unico, m.match_tipo, m.confianza
+        FROM matches m
+        JOIN operaciones_banco b ON b.id = m.banco_id
+        JOIN operaciones_ventas v ON v.id = m.venta_id
+        LEFT JOIN grupos_match g ON g.id = m.grupo_id
+        WHERE {condicion}
+    ''', params)
+    return [tuple(row) for row in cursor.fetchall()]
 
 
 def aprobar_match(match_id):
-    """Aprueba un match pendiente"""
+    """Aprueba un match pendiente (si es de un grupo, el grupo entero)"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE matches
-        SET estado = 'CONFIRMADO', confirmed_at = ?
-        WHERE id = ? AND estado = 'PENDIENTE'
-    ''', (datetime.now().isoformat(), match_id))
-    conn.commit()
-    affected = cursor.rowcount
-    conn.close()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        pares = _pares_auditoria(cursor, f"m.id IN (SELECT id FROM matches WHERE {CONDICION_MATCH_O_GRUPO}) "
+                                         "AND m.estado = 'PENDIENTE'", (match_id, match_id))
+        cursor.execute(f'''
+            UPDATE matches
+            SET estado = 'CONFIRMADO', confirmed_at = ?
+            WHERE {CONDICION_MATCH_O_GRUPO} AND estado = 'PENDIENTE'
+        ''', (datetime.now().isoformat(), match_id, match_id))
+        affected = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    auditoria.registrar('APROBAR', 'aprobar_match', pares, 'CONFIRMADO')
     return affected > 0
 
 
 def rechazar_match(match_id):
-    """Rechaza y elimina un match pendiente"""
+    """Rechaza y elimina un match pendiente (si es de un grupo, el grupo entero)"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM matches WHERE id = ? AND estado = "PENDIENTE"', (match_id,))
-    conn.commit()
-    affected = cursor.rowcount
-    conn.close()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        pares = _pares_auditoria(cursor, f"m.id IN (SELECT id FROM matches WHERE {CONDICION_MATCH_O_GRUPO}) "
+                                         "AND m.estado = 'PENDIENTE'", (match_id, match_id))
+        cursor.execute(f'DELETE FROM matches WHERE {CONDICION_MATCH_O_GRUPO} AND estado = "PENDIENTE"',
+                       (match_id, match_id))
+        affected = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    auditoria.registrar('RECHAZAR', 'rechazar_match', pares)
     return affected > 0
 
 
+def aprobar_todos():
+    """Aprueba todos los matches pendientes; devuelve cuántos"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        pares = _pares_auditoria(cursor, "m.estado = 'PENDIENTE'")
+        cursor.execute('''
+            UPDATE matches
+            SET estado = 'CONFIRMADO', confirmed_at = ?
+            WHERE estado = 'PENDIENTE'
+        ''', (datetime.now().isoformat(),))
+        affected = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    auditoria.registrar('APROBAR', 'aprobar_todos', pares, 'CONFIRMADO')
+    return affected
+
+
+ACCIONES_BULK = {'aprobar': 'aprobado', 'rechazar': 'rechazado'}
+
+
+def _condiciones_filtro_bulk(filtros):
+    """Condiciones SQL (sobre m, v y b) para los filtros de la acción en lote"""
+    conditions = []
+    params = []
+    for campo in ('match_tipo', 'confianza'):
+        if filtros.get(campo):
+            conditions.append(f"m.{campo} = ?")
+            params.append(filtros[campo])
+    for alias, lado in (('v', 'venta'), ('b', 'banco')):
+        if filtros.get(f'{lado}_fecha_desde'):
+            conditions.append(f"{alias}.dia >= ?")
+            params.append(dia_fecha(filtros[f'{lado}_fecha_desde']))
+        if filtros.get(f'{lado}_fecha_hasta'):
+            conditions.append(f"{alias}.dia <= ?")
+            params.append(dia_fecha(filtros[f'{lado}_fecha_hasta']))
+    if filtros.get('diferencia_max') is not None:
+        conditions.append("ABS(b.centavos - v.centavos) <= ?")
+        params.append(round(float(filtros['diferencia_max']) * 100))
+    return conditions, params
+
+
+def procesar_matches_bulk(accion, ids=None, filtros=None):
+    """
+    Aprueba o rechaza en una sola transacción los matches pendientes.
+
+    Args:
+        accion: 'aprobar' o 'rechazar'
+        ids: lista de ids de matches (opcional)
+        filtros: dict con match_tipo, confianza, venta_fecha_desde/hasta,
+                 banco_fecha_desde/hasta y diferencia_max de monto (opcional)
+
+    Si se pasan ids y filtros, solo se procesan los ids que cumplen los
+    filtros. Devuelve el resultado por id ('aprobado'/'rechazado',
+    'no_encontrado', 'no_pendiente' o 'excluido' por los filtros) y el
+    rendimiento de la operación.
+    """
+    if accion not in ACCIONES_BULK:
+        raise ValueError(f"Acción no válida: {accion}")
+    if filtros is not None and not isinstance(filtros, dict):
+        raise ValueError("filtros debe ser un objeto")
+    try:
+        ids = [int(match_id) for match_id in ids or []]
+    except (TypeError, ValueError):
+        raise ValueError("ids debe ser una lista de enteros")
+
+    conditions, params = _condiciones_filtro_bulk(filtros or {})
+    if not ids and not conditions:
+        raise ValueError("Indica ids o al menos un filtro")
+
+    inicio = time.time()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_seleccion (id INTEGER PRIMARY KEY)')
+        cursor.execute('DELETE FROM bulk_seleccion')
+
+        if ids:
+            cursor.execute('CREATE TEMP TABLE IF NOT EXISTS bulk_pedidos (id INTEGER PRIMARY KEY)')
+            cursor.execute('DELETE FROM bulk_pedidos')
+            cursor.executemany('INSERT OR IGNORE INTO bulk_pedidos VALUES (?)', ((match_id,) for match_id in ids))
+            conditions.append("m.id IN (SELECT id FROM bulk_pedidos)")
+            cursor.execute('''
+                SELECT p.id, m.estado FROM bulk_pedidos p
+                LEFT JOIN matches m ON m.id = p.id
+            ''')
+            estados_previos = dict(cursor.fetchall())
+
+        cursor.execute(f'''
+            INSERT INTO bulk_seleccion
+            SELECT m.id FROM matches m
+            JOIN operaciones_ventas v ON m.venta_id = v.id
+            JOIN operaciones_banco b ON m.banco_id = b.id
+            WHERE m.estado = 'PENDIENTE' AND {" AND ".join(conditions)}
+        ''', params)
+        # Los grupos se aprueban o rechazan enteros
+        cursor.execute('''
+            INSERT OR IGNORE INTO bulk_seleccion
+            SELECT id FROM matches WHERE estado = 'PENDIENTE' AND grupo_id IN (
+                SELECT m.grupo_id FROM matches m JOIN bulk_seleccion s ON s.id = m.id
+            )
+        ''')
+
+        pares = _pares_auditoria(cursor, 'm.id IN (SELECT id FROM bulk_seleccion)')
+        if accion == 'aprobar':
+            cursor.execute('''
+                UPDATE matches
+                SET estado = 'CONFIRMADO', confirmed_at = ?
+                WHERE id IN (SELECT id FROM bulk_seleccion)
+            ''', (datetime.now().isoformat(),))
+        else:
+            cursor.execute('DELETE FROM matches WHERE id IN (SELECT id FROM bulk_seleccion)')
+
+        cursor.execute('SELECT id FROM bulk_seleccion')
+        procesados = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if accion == 'aprobar':
+        auditoria.registrar('APROBAR', 'procesar_matches_bulk', pares, 'CONFIRMADO')
+    else:
+        auditoria.registrar('RECHAZAR', 'procesar_matches_bulk', pares)
+
+    hecho = ACCIONES_BULK[accion]
+    if ids:
+        seleccionados = set(procesados)
+        resultados = {}
+        for match_id in ids:
+            estado = estados_previos[match_id]
+            if match_id in seleccionados:
+                resultados[match_id] = hecho
+            elif estado is None:
+                resultados[match_id] = 'no_encontrado'
+            elif estado != 'PENDIENTE':
+                resultados[match_id] = 'no_pendiente'
+            else:
+                resultados[match_id] = 'excluido'
+    else:
+        resultados = {match_id: hecho for match_id in procesados}
+
+    segundos = time.time() - inicio
+    print(f"Lote ({accion}): {len(procesados)} matches en {segundos:.3f}s")
+    return {
+        'procesados': len(procesados),
+        'resultados': resultados,
+        'segundos': round(segundos, 3),
+        'por_segundo': round(len(procesados) / segundos) if segundos > 0 else None
+    }
+
+
 def buscar_posibles_matches_para_venta(venta_id, criterios=None, limit=10):
     """
     Busca posibles matches en banco para una venta sin match.
@@ -497,61 +1546,47 @@ def buscar_posibles_matches_para_venta(venta_id, criterios=None, limit=10):
         return []
 
     # Construir query dinámica
-    conditions = ["m.id IS NULL"]  # Sin match existente
+    conditions = ["b.conciliado = 0"]  # Sin match existente
     params = []
 
-    # Criterio de monto
+    # Criterio de monto (en centavos)
     monto_criterio = criterios.get('monto', 'exacto')
     if monto_criterio == 'exacto':
-        conditions.append("b.monto = ?")
-        params.append(venta['monto'])
-    elif monto_criterio == '1%':
-        conditions.append("b.monto BETWEEN ? AND ?")
-        params.extend([venta['monto'] * 0.99, venta['monto'] * 1.01])
-    elif monto_criterio == '5%':
-        conditions.append("b.monto BETWEEN ? AND ?")
-        params.extend([venta['monto'] * 0.95, venta['monto'] * 1.05])
-    elif monto_criterio == '10%':
-        conditions.append("b.monto BETWEEN ? AND ?")
-        params.extend([venta['monto'] * 0.90, venta['monto'] * 1.10])
+        conditions.append("b.centavos = ?")
+        params.append(venta['centavos'])
+    elif monto_criterio in TOLERANCIAS_MONTO:
+        conditions.append("b.centavos BETWEEN ? AND ?")
+        params.extend(rango_centavos(venta['centavos'], monto_criterio))
     # 'cualquiera' no agrega condición de monto
 
     # Criterio de fecha
     dias_fecha = criterios.get('fecha')
     if dias_fecha:
-        conditions.append("ABS(julianday(b.fecha) - julianday(?)) <= ?")
-        params.extend([venta['fecha'], dias_fecha])
-
-    # Criterio de nombre (búsqueda parcial)
-    if criterios.get('nombre') and venta['nombre']:
-        # Buscar coincidencia parcial del nombre
-        nombre_partes = venta['nombre'].upper().split()[:2]  # Primeras 2 palabras
-        for parte in nombre_partes:
-            if len(parte) > 2:
-                conditions.append("UPPER(b.nombre) LIKE ?")
-                params.append(f"%{parte}%")
-
-    # Criterio de código (búsqueda parcial)
-    if criterios.get('codigo') and venta['codigo_venta']:
-        # Buscar coincidencia parcial del código
-        codigo_limpio = venta['codigo_venta'].upper().replace('-', '').replace('_', '')[:8]
-        conditions.append("UPPER(REPLACE(REPLACE(b.codigo_banco, '-', ''), '_', '')) LIKE ?")
-        params.append(f"%{codigo_limpio}%")
+        dia = venta['dia']
+        conditions.append("b.dia BETWEEN ? AND ?")
+        params.extend([dia - dias_fecha, dia + dias_fecha] if dia is not None else [None, None])
+
+    # Criterios de nombre y código (búsqueda parcial)
+    patrones = patrones_busqueda(venta, criterios)
+    if patrones:
+        usar_indice = monto_criterio not in TOLERANCIAS_MONTO
+        condiciones, parametros = _condiciones_texto('b', 'fts_banco', patrones, usar_indice)
+        conditions.extend(condiciones)
+        params.extend(parametros)
 
     # Construir query
     where_clause = " AND ".join(conditions)
 
     query = f'''
         SELECT b.*,
-               ABS(julianday(b.fecha) - julianday(?)) as dias_diferencia,
-               ABS(b.monto - ?) as diferencia_monto
+               CAST(ABS(b.dia - ?) AS REAL) as dias_diferencia,
+               ABS(b.centavos - ?) / 100.0 as diferencia_monto
         FROM operaciones_banco b
-        LEFT JOIN matches m ON b.id = m.banco_id
         WHERE {where_clause}
         ORDER BY diferencia_monto ASC, dias_diferencia ASC
         LIMIT ?
     '''
-    params = [venta['fecha'], venta['monto']] + params + [limit]
+    params = [venta['dia'], venta['centavos']] + params + [limit]
 
     cursor.execute(query, params)
     results = [dict(row) for row in cursor.fetchall()]
@@ -576,57 +1611,45 @@ def buscar_posibles_matches_para_banco(banco_id, criterios=None, limit=10):
         conn.close()
         return []
 
-    conditions = ["m.id IS NULL"]
+    conditions = ["v.conciliado = 0"]
     params = []
 
-    # Criterio de monto
+    # Criterio de monto (en centavos)
     monto_criterio = criterios.get('monto', 'exacto')
     if monto_criterio == 'exacto':
-        conditions.append("v.monto = ?")
-        params.append(banco['monto'])
-    elif monto_criterio == '1%':
-        conditions.append("v.monto BETWEEN ? AND ?")
-        params.extend([banco['monto'] * 0.99, banco['monto'] * 1.01])
-    elif monto_criterio == '5%':
-        conditions.append("v.monto BETWEEN ? AND ?")
-        params.extend([banco['monto'] * 0.95, banco['monto'] * 1.05])
-    elif monto_criterio == '10%':
-        conditions.append("v.monto BETWEEN ? AND ?")
-        params.extend([banco['monto'] * 0.90, banco['monto'] * 1.10])
+        conditions.append("v.centavos = ?")
+        params.append(banco['centavos'])
+    elif monto_criterio in TOLERANCIAS_MONTO:
+        conditions.append("v.centavos BETWEEN ? AND ?")
+        params.extend(rango_centavos(banco['centavos'], monto_criterio))
 
     # Criterio de fecha
     dias_fecha = criterios.get('fecha')
     if dias_fecha:
-        conditions.append("ABS(julianday(v.fecha) - julianday(?)) <= ?")
-        params.extend([banco['fecha'], dias_fecha])
-
-    # Criterio de nombre
-    if criterios.get('nombre') and banco['nombre']:
-        nombre_partes = banco['nombre'].upper().split()[:2]
-        for parte in nombre_partes:
-            if len(parte) > 2:
-                conditions.append("UPPER(v.nombre) LIKE ?")
-                params.append(f"%{parte}%")
-
-    # Criterio de código
-    if criterios.get('codigo') and banco['codigo_banco']:
-        codigo_limpio = banco['codigo_banco'].upper().replace('-', '').replace('_', '')[:8]
-        conditions.append("UPPER(REPLACE(REPLACE(v.codigo_venta, '-', ''), '_', '')) LIKE ?")
-        params.append(f"%{codigo_limpio}%")
+        dia = banco['dia']
+        conditions.append("v.dia BETWEEN ? AND ?")
+        params.extend([dia - dias_fecha, dia + dias_fecha] if dia is not None else [None, None])
+
+    # Criterios de nombre y código
+    patrones = patrones_busqueda(banco, criterios)
+    if patrones:
+        usar_indice = monto_criterio not in TOLERANCIAS_MONTO
+        condiciones, parametros = _condiciones_texto('v', 'fts_ventas', patrones, usar_indice)
+        conditions.extend(condiciones)
+        params.extend(parametros)
 
     where_clause = " AND ".join(conditions)
 
     query = f'''
         SELECT v.*,
-               ABS(julianday(v.fecha) - julianday(?)) as dias_diferencia,
-               ABS(v.monto - ?) as diferencia_monto
+               CAST(ABS(v.dia - ?) AS REAL) as dias_diferencia,
+               ABS(v.centavos - ?) / 100.0 as diferencia_monto
         FROM operaciones_ventas v
-        LEFT JOIN matches m ON v.id = m.venta_id
         WHERE {where_clause}
         ORDER BY diferencia_monto ASC, dias_diferencia ASC
         LIMIT ?
     '''
-    params = [banco['fecha'], banco['monto']] + params + [limit]
+    params = [banco['dia'], banco['centavos']] + params + [limit]
 
     cursor.execute(query, params)
     results = [dict(row) for row in cursor.fetchall()]
@@ -634,39 +1657,443 @@ def buscar_posibles_matches_para_banco(banco_id, criterios=None, limit=10):
     return results
 
 
+def crear_match_grupo(banco_ids, venta_ids, estado='CONFIRMADO'):
+    """
+    Crea un match de grupo: un banco con varias ventas o una venta con
+    varios bancos, todas operaciones sin match. Cada par recibe su código
+    y el grupo el suyo. Devuelve (grupo_id, error).
+    """
+    try:
+        banco_ids = list(dict.fromkeys(int(i) for i in banco_ids))
+        venta_ids = list(dict.fromkeys(int(i) for i in venta_ids))
+    except (TypeError, ValueError):
+        return None, "Los ids deben ser enteros"
+    if len(banco_ids) == 1 and len(venta_ids) >= 2:
+        tipo = 'VARIAS_VENTAS'
+    elif len(venta_ids) == 1 and len(banco_ids) >= 2:
+        tipo = 'VARIOS_BANCOS'
+    else:
+        return None, "Un grupo es un banco con varias ventas o una venta con varios bancos"
+
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        totales = []
+        for tabla, ids in (('operaciones_banco', banco_ids), ('operaciones_ventas', venta_ids)):
+            marcadores = ', '.join('?' * len(ids))
+            cursor.execute(f'''
+                SELECT COUNT(*), SUM(centavos) FROM {tabla}
+                WHERE id IN ({marcadores}) AND conciliado = 0
+            ''', ids)
+            cantidad, total = cursor.fetchone()
+            if cantidad != len(ids):
+                conn.rollback()
+                return None, "Alguna operación no existe o ya tiene match"
+            totales.append(total)
+
+        pares = [(banco_id, venta_id) for banco_id in banco_ids for venta_id in venta_ids]
+        codigos = reservar_match_codes(conn, len(pares) + 1)
+        cursor.execute('INSERT INTO grupos_match (match_code, tipo) VALUES (?, ?)', (codigos[0], tipo))
+        grupo_id = cursor.lastrowid
+        confianza = 'ALTO' if totales[0] == totales[1] else 'MEDIO'
+        confirmed_at = datetime.now().isoformat() if estado == 'CONFIRMADO' else None
+        cursor.executemany('''
+            INSERT INTO matches (match_code, banco_id, venta_id, match_tipo, confianza, estado, confirmed_at, grupo_id)
+            VALUES (?, ?, ?, 'GRUPO', ?, ?, ?, ?)
+        ''', [(codigo, banco_id, venta_id, confianza, estado, confirmed_at, grupo_id)
+              for codigo, (banco_id, venta_id) in zip(codigos[1:], pares)])
+        pares = _pares_auditoria(cursor, 'm.grupo_id = ?', (grupo_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    auditoria.registrar('CREAR_GRUPO', 'crear_match_grupo', pares, estado)
+    return grupo_id, None
+
+
 def crear_match_manual(banco_id, venta_id):
     """Crea un match manual (confirmado)"""
     conn = get_db()
+    cursor = conn.cursor()
+    # La verificación va en la misma transacción que el INSERT: dos
+    # peticiones a la vez no pueden matchear la misma operación
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Verificar que no existan matches previos
+        cursor.execute('SELECT id FROM matches WHERE banco_id = ? OR venta_id = ?', (banco_id, venta_id))
+        if cursor.fetchone():
+            conn.rollback()
+            return None, "Ya existe un match para esta operación"
 
-    # Verificar que no existan matches previos
+        match_code = generar_match_code(conn)
+        cursor.execute('''
+            INSERT INTO matches (match_code, banco_id, venta_id, match_tipo, confianza, estado, confirmed_at)
+            VALUES (?, ?, ?, 'MANUAL', 'MANUAL', 'CONFIRMADO', ?)
+        ''', (match_code, banco_id, venta_id, datetime.now().isoformat()))
+        match_id = cursor.lastrowid
+        pares = _pares_auditoria(cursor, 'm.id = ?', (match_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    auditoria.registrar('CREAR_MANUAL', 'crear_match_manual', pares, 'CONFIRMADO')
+    return match_id, None
+
+
+def reaplicar_decisiones(desde=None):
+    """
+    Vuelve a aplicar sobre los datos actuales la última decisión registrada
+    de cada par (banco, venta), por ejemplo después de un reset y una nueva
+    importación. Las operaciones se buscan por hash_unico y todo se resuelve
+    con sentencias por conjunto en una transacción:
+    - RECHAZAR elimina el match del par si está pendiente;
+    - el resto aprueba el match del par si está pendiente o, si el par no
+      existe y ambas operaciones están sin match, lo crea con el código, el
+      tipo y el estado registrados (un código ya usado se reemplaza por uno
+      nuevo de la secuencia).
+
+    Si dos decisiones piden la misma operación gana la más reciente; un
+    grupo solo se recrea entero. Los pares cuyas operaciones no están
+    cuentan como sin_operaciones y los bloqueados como conflictos.
+
+    desde: solo eventos con creado_en >= desde (opcional)
+    """
+    auditoria.vaciar()
+    inicio = time.time()
+    desde = desde or ''
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT id FROM matches WHERE banco_id = ? OR venta_id = ?', (banco_id, venta_id))
-    if cursor.fetchone():
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS stg_decisiones (
+                banco_id INTEGER, venta_id INTEGER, accion TEXT, estado TEXT, creado_en TEXT,
+                match_code TEXT, grupo_code TEXT, grupo_tipo TEXT, match_tipo TEXT, confianza TEXT
+            )
+        ''')
+        cursor.execute('DELETE FROM stg_decisiones')
+        cursor.execute('''
+            INSERT INTO stg_decisiones
+            SELECT b.id, v.id, e.accion, e.estado, e.creado_en,
+                   e.match_code, e.grupo_code, e.grupo_tipo, e.match_tipo, e.confianza
+            FROM (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY banco_hash, venta_hash ORDER BY creado_en DESC, id DESC
+                ) AS n
+                FROM eventos
+                WHERE banco_hash IS NOT NULL AND venta_hash IS NOT NULL AND creado_en >= ?
+            ) e
+            JOIN operaciones_banco b ON b.hash_unico = e.banco_hash
+            JOIN operaciones_ventas v ON v.hash_unico = e.venta_hash
+            WHERE e.n = 1
+        ''', (desde,))
+        decisiones = cursor.rowcount
+        cursor.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT DISTINCT banco_hash, venta_hash FROM eventos
+                WHERE banco_hash IS NOT NULL AND venta_hash IS NOT NULL AND creado_en >= ?
+            )
+        ''', (desde,))
+        sin_operaciones = cursor.fetchone()[0] - decisiones
+
+        cursor.execute('''
+            DELETE FROM matches WHERE estado = 'PENDIENTE' AND id IN (
+                SELECT m.id FROM stg_decisiones d
+                JOIN matches m ON m.banco_id = d.banco_id AND m.venta_id = d.venta_id
+                WHERE d.accion = 'RECHAZAR'
+            )
+        ''')
+        rechazados = cursor.rowcount
+
+        cursor.execute('''
+            UPDATE matches SET estado = 'CONFIRMADO', confirmed_at = d.creado_en
+            FROM stg_decisiones d
+            WHERE matches.banco_id = d.banco_id AND matches.venta_id = d.venta_id
+              AND matches.estado = 'PENDIENTE' AND d.estado = 'CONFIRMADO'
+        ''')
+        aprobados = cursor.rowcount
+
+        # Pares a crear: los que no existen, entre operaciones sin match
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS stg_nuevos (
+                banco_id INTEGER, venta_id INTEGER, estado TEXT, creado_en TEXT,
+                match_code TEXT, grupo_code TEXT, grupo_tipo TEXT, match_tipo TEXT, confianza TEXT
+            )
+        ''')
+        cursor.execute('DELETE FROM stg_nuevos')
+        cursor.execute('''
+            SELECT COUNT(*) FROM stg_decisiones d
+            WHERE d.accion != 'RECHAZAR' AND NOT EXISTS (
+                SELECT 1 FROM matches m WHERE m.banco_id = d.banco_id AND m.venta_id = d.venta_id
+            )
+        ''')
+        por_crear = cursor.fetchone()[0]
+        cursor.execute('''
+            INSERT INTO stg_nuevos
+            SELECT d.banco_id, d.venta_id, d.estado, d.creado_en,
+                   d.match_code, d.grupo_code, d.grupo_tipo, d.match_tipo, d.confianza
+            FROM stg_decisiones d
+            JOIN operaciones_banco b ON b.id = d.banco_id AND b.conciliado = 0
+            JOIN operaciones_ventas v ON v.id = d.venta_id AND v.conciliado = 0
+            WHERE d.accion != 'RECHAZAR'
+        ''')
+        # Por operación queda la decisión más reciente (los pares de un
+        # mismo grupo comparten la clave y quedan todos)
+        cursor.execute('''
+            DELETE FROM stg_nuevos WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, clave,
+                           MAX(clave) OVER (PARTITION BY banco_id) AS ultima_banco,
+                           MAX(clave) OVER (PARTITION BY venta_id) AS ultima_venta
+                    FROM (SELECT rowid, *, creado_en || '|' || COALESCE(grupo_code, match_code, '') AS clave
+                          FROM stg_nuevos)
+                )
+                WHERE clave < ultima_banco OR clave < ultima_venta
+            )
+        ''')
+        cursor.execute('''
+            DELETE FROM stg_nuevos WHERE grupo_code IN (
+                SELECT d.grupo_code FROM stg_decisiones d
+                WHERE d.grupo_code IS NOT NULL AND d.accion != 'RECHAZAR'
+                GROUP BY d.grupo_code
+                HAVING COUNT(*) > (SELECT COUNT(*) FROM stg_nuevos n WHERE n.grupo_code = d.grupo_code)
+            )
+        ''')
+
+        # Códigos: el registrado salvo que ya esté en uso
+        cursor.execute('''
+            UPDATE stg_nuevos SET match_code = NULL
+            WHERE match_code IN (SELECT match_code FROM matches)
+               OR rowid NOT IN (SELECT MIN(rowid) FROM stg_nuevos GROUP BY match_code)
+        ''')
+        sin_codigo = [row[0] for row in cursor.execute('SELECT rowid FROM stg_nuevos WHERE match_code IS NULL')]
+        cursor.executemany('UPDATE stg_nuevos SET match_code = ? WHERE rowid = ?',
+                           zip(reservar_match_codes(conn, len(sin_codigo)), sin_codigo))
+        avanzar_secuencia_match_code(conn, [row[0] for row in cursor.execute(
+            'SELECT match_code FROM stg_nuevos UNION SELECT grupo_code FROM stg_nuevos WHERE grupo_code IS NOT NULL'
+        )])
+        cursor.execute('''
+            INSERT OR IGNORE INTO grupos_match (match_code, tipo)
+            SELECT DISTINCT grupo_code, grupo_tipo FROM stg_nuevos WHERE grupo_code IS NOT NULL
+        ''')
+        cursor.execute('''
+            INSERT INTO matches (match_code, banco_id, venta_id, match_tipo, confianza, estado, confirmed_at, grupo_id)
+            SELECT n.match_code, n.banco_id, n.venta_id, n.match_tipo, n.confianza, n.estado,
+                   CASE WHEN n.estado = 'CONFIRMADO' THEN n.creado_en END, g.id
+            FROM stg_nuevos n
+            LEFT JOIN grupos_match g ON g.match_code = n.grupo_code
+        ''')
+        creados = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        return None, "Ya existe un match para esta operación"
 
-    match_code = generar_match_code()
+    resultado = {
+        'decisiones': decisiones,
+        'aprobados': aprobados,
+        'rechazados': rechazados,
+        'creados': creados,
+        'conflictos': por_crear - creados,
+        'sin_cambios': decisiones - aprobados - rechazados - por_crear,
+        'sin_operaciones': sin_operaciones,
+    }
+    auditoria.registrar('REAPLICAR', 'reaplicar_decisiones')
+    segundos = time.time() - inicio
+    print(f"Decisiones reaplicadas: {resultado} en {segundos:.3f}s")
+    resultado['segundos'] = round(segundos, 3)
+    return resultado
+
+
+# El proceso que corre una importación registra actividad cada
+# SEGUNDOS_LATIDO; sin actividad por SEGUNDOS_SIN_LATIDO se la da por
+# abandonada (un worker que murió no deja bloqueadas subidas ni reset)
+SEGUNDOS_LATIDO = 10
+SEGUNDOS_SIN_LATIDO = 120
+
+
+def crear_importacion(archivos, incremental=False):
+    """
+    Registra una importación en cola si no hay otra activa. Devuelve
+    (id, True), o (id de la activa, False) si ya había una en cola o en
+    proceso. La comprobación y el INSERT van en la misma transacción para
+    que dos workers o hilos no encolen dos importaciones a la vez.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT * FROM importaciones
+                WHERE estado IN ('EN_COLA', 'PROCESANDO')
+                ORDER BY id LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            # _abandonada confirma al marcar la importación: se vuelve a empezar
+            if row is None or not _abandonada(conn, row):
+                break
+        if row is not None:
+            conn.rollback()
+            return row['id'], False
+        cursor.execute(
+            'INSERT INTO importaciones (archivos, incremental, actualizado) VALUES (?, ?, ?)',
+            (json.dumps(archivos), int(incremental), datetime.now().isoformat())
+        )
+        conn.commit()
+        return cursor.lastrowid, True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def iniciar_importacion(importacion_id, filas_total):
+    """Marca una importación en cola como PROCESANDO (False si ya fue tomada)"""
+    conn = get_db()
+    cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO matches (match_code, banco_id, venta_id, match_tipo, confianza, estado, confirmed_at)
-        VALUES (?, ?, ?, 'MANUAL', 'MANUAL', 'CONFIRMADO', ?)
-    ''', (match_code, banco_id, venta_id, datetime.now().isoformat()))
+        UPDATE importaciones
+        SET estado = 'PROCESANDO', filas_total = ?, started_at = ?, actualizado = ?
+        WHERE id = ? AND estado = 'EN_COLA'
+    ''', (filas_total, *[datetime.now().isoformat()] * 2, importacion_id))
+    conn.commit()
+    affected = cursor.rowcount
+    conn.close()
+    return affected > 0
+
 
+def latir_importacion(importacion_id):
+    """Registra que el proceso de una importación activa sigue vivo"""
+    conn = get_db()
+    conn.execute('''
+        UPDATE importaciones SET actualizado = ?
+        WHERE id = ? AND estado IN ('EN_COLA', 'PROCESANDO')
+    ''', (datetime.now().isoformat(), importacion_id))
     conn.commit()
-    match_id = cursor.lastrowid
     conn.close()
-    return match_id, None
+
+
+def actualizar_progreso_importacion(conn, importacion_id, filas_procesadas):
+    """Actualiza el progreso dentro de la transacción del bloque importado"""
+    conn.execute(
+        'UPDATE importaciones SET filas_procesadas = ? WHERE id = ?',
+        (filas_procesadas, importacion_id)
+    )
+
+
+def finalizar_importacion(importacion_id, resultado=None, error=None):
+    """Marca una importación como COMPLETADO o ERROR"""
+    conn = get_db()
+    conn.execute('''
+        UPDATE importaciones
+        SET estado = ?, resultado = ?, error = ?, finished_at = ?
+        WHERE id = ?
+    ''', (
+        'ERROR' if error else 'COMPLETADO',
+        json.dumps(resultado) if resultado is not None else None,
+        error, datetime.now().isoformat(), importacion_id
+    ))
+    conn.commit()
+    conn.close()
+
+
+def _importacion_a_dict(row):
+    """Convierte una fila de importaciones en dict con velocidad y ETA"""
+    importacion = dict(row)
+    importacion['archivos'] = json.loads(importacion['archivos'] or '[]')
+    importacion['resultado'] = json.loads(importacion['resultado']) if importacion['resultado'] else None
+    importacion['incremental'] = bool(importacion['incremental'])
+
+    filas_por_segundo = None
+    eta_segundos = None
+    if importacion['started_at']:
+        fin = datetime.fromisoformat(importacion['finished_at']) if importacion['finished_at'] else datetime.now()
+        segundos = (fin - datetime.fromisoformat(importacion['started_at'])).total_seconds()
+        if segundos > 0:
+            filas_por_segundo = round(importacion['filas_procesadas'] / segundos)
+        if importacion['estado'] == 'PROCESANDO' and filas_por_segundo and importacion['filas_total']:
+            restantes = max(importacion['filas_total'] - importacion['filas_procesadas'], 0)
+            eta_segundos = round(restantes / filas_por_segundo)
+    importacion['filas_por_segundo'] = filas_por_segundo
+    importacion['eta_segundos'] = eta_segundos
+    return importacion
+
+
+def _abandonada(conn, row):
+    """
+    Si la importación activa no da señales de vida hace más de
+    SEGUNDOS_SIN_LATIDO (el proceso murió sin finalizarla), la marca como
+    ERROR. Devuelve si la marcó.
+    """
+    if row['estado'] not in ('EN_COLA', 'PROCESANDO'):
+        return False
+    limite = datetime.now() - timedelta(seconds=SEGUNDOS_SIN_LATIDO)
+    if row['actualizado'] and datetime.fromisoformat(row['actualizado']) > limite:
+        return False
+    # Solo si no latió entre la lectura y la escritura
+    cursor = conn.execute('''
+        UPDATE importaciones SET estado = 'ERROR', error = ?, finished_at = ?
+        WHERE id = ? AND estado = ? AND actualizado IS ?
+    ''', (
+        'La importación dejó de responder: el proceso terminó sin finalizarla',
+        datetime.now().isoformat(), row['id'], row['estado'], row['actualizado']
+    ))
+    conn.commit()
+    if cursor.rowcount:
+        print(f"Importación {row['id']} sin actividad desde {row['actualizado']}: marcada como ERROR")
+    return True
+
+
+def get_importacion(importacion_id):
+    """Obtiene el estado de una importación"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM importaciones WHERE id = ?', (importacion_id,))
+    row = cursor.fetchone()
+    if row and _abandonada(conn, row):
+        row = cursor.execute('SELECT * FROM importaciones WHERE id = ?', (importacion_id,)).fetchone()
+    conn.close()
+    return _importacion_a_dict(row) if row else None
+
+
+def get_importacion_activa():
+    """
+    Obtiene la importación en cola o en proceso más antigua, si existe.
+    Las abandonadas por un proceso que murió pasan a ERROR y no cuentan.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    while True:
+        cursor.execute('''
+            SELECT * FROM importaciones
+            WHERE estado IN ('EN_COLA', 'PROCESANDO')
+            ORDER BY id LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        if row is None or not _abandonada(conn, row):
+            break
+    conn.close()
+    return _importacion_a_dict(row) if row else None
 
 
 def reset_database():
-    """Limpia todas las tablas"""
+    """Limpia todas las tablas (menos el registro de auditoría)"""
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM matches')
     cursor.execute('DELETE FROM operaciones_banco')
     cursor.execute('DELETE FROM operaciones_ventas')
+    cursor.execute('DELETE FROM sugerencias')
+    cursor.execute('DELETE FROM sugerencias_calculadas')
     conn.commit()
     conn.close()
-
-
-# Inicializar base de datos al importar
-init_db()
+    auditoria.registrar('RESET', 'reset_database')
@@ -0,0 +1,251 @@
+"""
+Exportación en streaming del archivo fusionado.
+
+Una sola consulta UNION ALL ordenada (confirmados, pendientes, ventas sin
+match y banco sin match) se recorre con fetchmany y se escribe fila a fila:
+en CSV los bytes se envían a medida que se generan; en xlsx se usa un libro
+openpyxl write-only (memoria constante) sobre un archivo temporal: openpyxl
+arma el zip al guardar, así que el primer byte sale recién con el libro
+completo.
+
+Parquet y Arrow IPC (con pyarrow) llevan las mismas columnas: se escriben
+por lotes de filas convertidos a columnas y cada row group / record batch
+se envía apenas se escribe (el índice va en el pie, al final).
+Las fechas van como texto 'YYYY-MM-DD', igual que en xlsx y csv, para que
+el archivo se pueda volver a importar con los mismos hashes.
+"""
+
+import csv
+import io
+import os
+import tempfile
+
+from database import get_db
+
+
+COLUMNAS_FUSIONADO = [
+    'row_venta', 'Factura', 'Codigo_venta', 'Fecha_Venta', 'Nombre_Venta', 'Monto_Venta',
+    'row_banco', 'Fecha_Banco', 'codigo_banco', 'Nombre_Banco', 'Monto_Banco',
+    'Match_Tipo', 'Confianza', 'Match_Code'
+]
+
+# orden: 0 confirmados, 1 pendientes (sin código), 2 ventas sin match, 3 banco sin match
+CONSULTA_FUSIONADO = '''
+    SELECT 0 AS orden, m.id AS clave,
+           v.row_original, v.factura, v.codigo_venta, v.fecha, v.nombre, v.monto,
+           b.row_original, b.fecha, b.codigo_banco, b.nombre, b.monto,
+           m.match_tipo, m.confianza, m.match_code
+    FROM matches m
+    JOIN operaciones_ventas v ON m.venta_id = v.id
+    JOIN operaciones_banco b ON m.banco_id = b.id
+    WHERE m.estado = 'CONFIRMADO'
+    UNION ALL
+    SELECT 1, m.id,
+           v.row_original, v.factura, v.codigo_venta, v.fecha, v.nombre, v.monto,
+           b.row_original, b.fecha, b.codigo_banco, b.nombre, b.monto,
+           m.match_tipo, m.confianza, NULL
+    FROM matches m
+    JOIN operaciones_ventas v ON m.venta_id = v.id
+    JOIN operaciones_banco b ON m.banco_id = b.id
+    WHERE m.estado = 'PENDIENTE'
+    UNION ALL
+    SELECT 2, v.id,
+           v.row_original, v.factura, v.codigo_venta, v.fecha, v.nombre, v.monto,
+           NULL, NULL, NULL, NULL, NULL,
+           'SIN_MATCH', NULL, NULL
+    FROM operaciones_ventas v
+    WHERE v.conciliado = 0
+    UNION ALL
+    SELECT 3, b.id,
+           NULL, NULL, NULL, NULL, NULL, NULL,
+           b.row_original, b.fecha, b.codigo_banco, b.nombre, b.monto,
+           'SIN_MATCH', NULL, NULL
+    FROM operaciones_banco b
+    WHERE b.conciliado = 0
+    ORDER BY orden, clave
+'''
+
+# Tipo Arrow de cada columna en Parquet y Arrow IPC
+TIPOS_ARROW = dict(zip(COLUMNAS_FUSIONADO, (
+    'int64', 'string', 'string', 'string', 'string', 'float64',
+    'int64', 'string', 'string', 'string', 'float64',
+    'string', 'string', 'string',
+)))
+
+FILAS_POR_LOTE = 2000
+BYTES_POR_BLOQUE = 64 * 1024
+
+# Filas por row group de Parquet / record batch de Arrow
+FILAS_POR_GRUPO = 50000
+
+FORMATOS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+
+def lotes_fusionado(filas_por_lote=FILAS_POR_LOTE):
+    """Genera las filas del fusionado en listas de hasta filas_por_lote tuplas"""
+    conn = get_db()
+    conn.row_factory = None
+    try:
+        cursor = conn.execute(CONSULTA_FUSIONADO)
+        while True:
+            lote = cursor.fetchmany(filas_por_lote)
+            if not lote:
+                break
+            yield [fila[2:] for fila in lote]
+    finally:
+        conn.close()
+
+
+def filas_fusionado():
+    """Genera las filas del fusionado (tuplas en el orden de COLUMNAS_FUSIONADO)"""
+    for lote in lotes_fusionado():
+        yield from lote
+
+
+def exportar_csv(filas):
+    """Genera el CSV por bloques de bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNAS_FUSIONADO)
+    for fila in filas:
+        writer.writerow(fila)
+        if buffer.tell() >= BYTES_POR_BLOQUE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _exportar_por_temporal(sufijo, escribir):
+    """
+    Genera por bloques de bytes un archivo que escribir(ruta) arma completo
+    en un temporal (para el xlsx, que openpyxl solo sabe guardar en un zip
+    terminado).
+    """
+    descriptor, ruta = tempfile.mkstemp(suffix=sufijo)
+    os.close(descriptor)
+    try:
+        escribir(ruta)
+        with open(ruta, 'rb') as f:
+            while True:
+                bloque = f.read(BYTES_POR_BLOQUE)
+                if not bloque:
+                    break
+                yield bloque
+    finally:
+        os.remove(ruta)
+
+
+def exportar_xlsx(filas):
+    """Genera el xlsx por bloques de bytes, armado con un libro write-only"""
+    def escribir(ruta):
+        from openpyxl import Workbook  # solo al exportar en xlsx
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
+        ws.append(COLUMNAS_FUSIONADO)
+        for fila in filas:
+            ws.append(fila)
+        wb.save(ruta)
+
+    return _exportar_por_temporal('.xlsx', escribir)
+
+
+def esquema_arrow():
+    """Esquema Arrow del fusionado, según TIPOS_ARROW"""
+    import pyarrow as pa
+
+    return pa.schema([(columna, pa.type_for_alias(tipo)) for columna, tipo in TIPOS_ARROW.items()])
+
+
+def lote_arrow(lote, esquema):
+    """RecordBatch con las columnas de una lista de filas del fusionado"""
+    import pyarrow as pa
+
+    columnas = []
+    for valores, campo in zip(zip(*lote), esquema):
+        try:
+            columnas.append(pa.array(valores, type=campo.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Un valor de otro tipo en una columna de texto (p. ej. una fecha numérica)
+            columnas.append(pa.array([v if v is None else str(v) for v in valores], type=campo.type))
+    return pa.RecordBatch.from_arrays(columnas, schema=esquema)
+
+
+class _Salida:
+    """
+    Destino de un writer de pyarrow que junta lo escrito hasta retirarlo.
+    tell() cuenta todo lo escrito: los writers anotan ahí los offsets del pie.
+    """
+
+    def __init__(self):
+        self.bloques = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self.bloques.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        bloques, self.bloques = self.bloques, []
+        return bloques
+
+
+def _exportar_por_lotes(abrir_writer, lotes):
+    """
+    Genera por bloques de bytes un archivo columnar: abrir_writer(destino,
+    esquema) da un writer de pyarrow y lo escrito se envía tras cada lote.
+    Estos formatos solo agregan al final, así que no hace falta un temporal.
+    """
+    import pyarrow as pa
+
+    esquema = esquema_arrow()
+    salida = _Salida()
+    with abrir_writer(pa.PythonFile(salida, mode='w'), esquema) as writer:
+        for lote in lotes:
+            writer.write_batch(lote_arrow(lote, esquema))
+            yield from salida.retirar()
+    # El pie con el índice
+    yield from salida.retirar()
+
+
+def exportar_parquet(lotes):
+    """Genera el Parquet por bloques de bytes, un row group por lote"""
+    import pyarrow.parquet as pq
+
+    return _exportar_por_lotes(pq.ParquetWriter, lotes)
+
+
+def exportar_arrow(lotes):
+    """Genera el Arrow IPC (formato archivo) por bloques de bytes, un record batch por lote"""
+    import pyarrow as pa
+
+    return _exportar_por_lotes(pa.ipc.new_file, lotes)
+
+
+def exportar_fusionado(formato='xlsx'):
+    """Generador de bytes del archivo fusionado en el formato pedido"""
+    if formato == 'csv':
+        return exportar_csv(filas_fusionado())
+    if formato == 'parquet':
+        return exportar_parquet(lotes_fusionado(FILAS_POR_GRUPO))
+    if formato == 'arrow':
+        return exportar_arrow(lotes_fusionado(FILAS_POR_GRUPO))
+    return exportar_xlsx(filas_fusionado())
@@ -0,0 +1,865 @@
+"""
+Motor de importación columnar del archivo fusionado.
+
+En lugar de recorrer el DataFrame fila por fila, calcula fechas, hashes y
+estados de match sobre columnas completas, carga las filas con executemany
+en una tabla de staging y resuelve ids y matches con SQL por conjuntos.
+
+El fusionado puede venir en xlsx o, para transferencias entre sistemas, en
+Parquet o Arrow IPC con las mismas columnas: estos se leen con pyarrow por
+lotes de columnas, sin pasar por filas de openpyxl.
+"""
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+from database import (
+    get_db, generar_hash_banco, generar_hash_venta, reservar_match_codes, avanzar_secuencia_match_code,
+    determinar_estado_match, normalizar_nombre, normalizar_codigo, dia_fecha, a_centavos,
+    crear_importacion, iniciar_importacion, actualizar_progreso_importacion,
+    finalizar_importacion, get_importacion, latir_importacion, SEGUNDOS_LATIDO
+)
+from sugerencias import actualizar_sugerencias
+
+
+# Columnas de la tabla de staging, en el orden en que se cargan
+COLUMNAS_STAGING = (
+    'pos',
+    'b_hash', 'b_row', 'b_fecha', 'b_codigo', 'b_nombre', 'b_monto',
+    'b_nombre_norm', 'b_codigo_norm', 'b_dia', 'b_centavos',
+    'v_hash', 'v_row', 'v_factura', 'v_codigo', 'v_fecha', 'v_nombre', 'v_monto',
+    'v_nombre_norm', 'v_codigo_norm', 'v_dia', 'v_centavos',
+    'match_tipo', 'confianza', 'match_code', 'estado'
+)
+
+# Contadores que acumula una importación (por bloque, archivo y cola)
+CONTADORES = (
+    'nuevos_banco', 'nuevos_ventas', 'sin_cambios_banco', 'sin_cambios_ventas',
+    'confirmados', 'pendientes', 'matches_sin_cambios', 'conflictos', 'sin_match', 'filas'
+)
+
+# Filas por bloque en el modo streaming
+TAMANO_BLOQUE = 5000
+# Bloques preparados que cada proceso de importar_lote deja esperando al escritor
+BLOQUES_EN_COLA = 2
+
+def _columna(df, nombre):
+    """Devuelve la columna o una columna de None si no existe (como row.get)"""
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+
+def _fechas_str(serie):
+    """Equivalente columnar de str(fecha)[:10]"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.strftime('%Y-%m-%d').fillna('NaT').tolist()
+    return [str(f)[:10] if f is not None else None for f in serie.tolist()]
+
+
+def _enteros(serie, mascara):
+    """Convierte la columna a int de Python donde aplica la máscara"""
+    return [int(x) if m else None for x, m in zip(serie.tolist(), mascara)]
+
+
+def _estados(match_tipos, confianzas):
+    """
+    Aplica determinar_estado_match sobre columnas completas.
+
+    Las combinaciones (Match_Tipo, Confianza) distintas son pocas, así que
+    la regla se evalúa una vez por combinación y se mapea al resto.
+    """
+    cache = {}
+    estados = []
+    for clave in zip(match_tipos, confianzas):
+        if clave not in cache:
+            cache[clave] = determinar_estado_match(*clave)
+        estados.append(cache[clave])
+    return estados
+
+
+def _por_valor(valores, funcion):
+    """Aplica la función una vez por valor distinto (nombres y fechas se repiten)"""
+    cache = {}
+    resultado = []
+    for valor in valores:
+        if valor not in cache:
+            cache[valor] = funcion(valor) if pd.notna(valor) else None
+        resultado.append(cache[valor])
+    return resultado
+
+
+def preparar_bloque(df, pos_inicial=0):
+    """
+    Calcula las filas de staging de un bloque del archivo fusionado.
+
+    No toca la base de datos. Devuelve un dict con las filas listas para
+    executemany y los contadores que no dependen de la DB.
+    """
+    n = len(df)
+
+    row_banco = _columna(df, 'row_banco')
+    monto_banco = _columna(df, 'Monto_Banco')
+    row_venta = _columna(df, 'row_venta')
+    monto_venta = _columna(df, 'Monto_Venta')
+
+    tiene_banco = (row_banco.notna() & monto_banco.notna()).tolist()
+    tiene_venta = (row_venta.notna() & monto_venta.notna()).tolist()
+
+    # Banco
+    b_fecha = _fechas_str(_columna(df, 'Fecha_Banco'))
+    b_codigo = _columna(df, 'codigo_banco').tolist()
+    b_nombre = _columna(df, 'Nombre_Banco').tolist()
+    b_monto = monto_banco.tolist()
+    b_row = _enteros(row_banco, tiene_banco)
+    b_hash = [
+        generar_hash_banco(f, m, c, nom) if t else None
+        for t, f, m, c, nom in zip(tiene_banco, b_fecha, b_monto, b_codigo, b_nombre)
+    ]
+    b_nombre_norm = _por_valor(b_nombre, normalizar_nombre)
+    b_codigo_norm = _por_valor(b_codigo, normalizar_codigo)
+    b_dia = _por_valor(b_fecha, dia_fecha)
+    b_centavos = [a_centavos(m) for m in b_monto]
+
+    # Ventas
+    v_factura = _columna(df, 'Factura').tolist()
+    v_codigo = _columna(df, 'Codigo_venta').tolist()
+    v_fecha = _fechas_str(_columna(df, 'Fecha_Venta'))
+    v_nombre = _columna(df, 'Nombre_Venta').tolist()
+    v_monto = monto_venta.tolist()
+    v_row = _enteros(row_venta, tiene_venta)
+    v_hash = [
+        generar_hash_venta(fac, f, m, nom, c) if t else None
+        for t, fac, f, m, nom, c in zip(tiene_venta, v_factura, v_fecha, v_monto, v_nombre, v_codigo)
+    ]
+    v_nombre_norm = _por_valor(v_nombre, normalizar_nombre)
+    v_codigo_norm = _por_valor(v_codigo, normalizar_codigo)
+    v_dia = _por_valor(v_fecha, dia_fecha)
+    v_centavos = [a_centavos(m) for m in v_monto]
+
+    # Matches: Match_Code existente => CONFIRMADO, si no, reglas. Los
+    # códigos nuevos los asigna cargar_bloque al escribir
+    match_tipo = _columna(df, 'Match_Tipo').tolist()
+    confianza = _columna(df, 'Confianza').tolist()
+    codigos_existentes = [
+        str(c).strip() if pd.notna(c) and str(c).strip() else None
+        for c in _columna(df, 'Match_Code').tolist()
+    ]
+    estados_reglas = _estados(match_tipo, confianza)
+
+    match_code = []
+    estado = []
+    sin_match = 0
+    for tb, tv, codigo, est in zip(tiene_banco, tiene_venta, codigos_existentes, estados_reglas):
+        if not (tb and tv):
+            match_code.append(None)
+            estado.append(None)
+        elif codigo:
+            match_code.append(codigo)
+            estado.append('CONFIRMADO')
+        elif est:
+            match_code.append(None)
+            estado.append(est)
+        else:
+            match_code.append(None)
+            estado.append(None)
+            sin_match += 1
+
+    filas = list(zip(
+        range(pos_inicial, pos_inicial + n),
+        b_hash, b_row, b_fecha, b_codigo, b_nombre, b_monto,
+        b_nombre_norm, b_codigo_norm, b_dia, b_centavos,
+        v_hash, v_row, v_factura, v_codigo, v_fecha, v_nombre, v_monto,
+        v_nombre_norm, v_codigo_norm, v_dia, v_centavos,
+        match_tipo, confianza, match_code, estado
+    ))
+    return {'filas': filas, 'n': n, 'sin_match': sin_match}
+
+
+def _crear_staging(cursor):
+    """Crea (o vacía) la tabla temporal de staging de la conexión"""
+    cursor.execute(f'''
+        CREATE TEMP TABLE IF NOT EXISTS stg_import (
+            {', '.join(COLUMNAS_STAGING)},
+            banco_id INTEGER,
+            venta_id INTEGER
+        )
+    ''')
+    cursor.execute('DELETE FROM stg_import')
+
+
+# Primera fila del archivo por cada par (banco, venta) con match
+PRIMERA_FILA_POR_PAR = '''
+    s.pos IN (
+        SELECT MIN(pos) FROM stg_import
+        WHERE estado IS NOT NULL AND banco_id IS NOT NULL AND venta_id IS NOT NULL
+        GROUP BY banco_id, venta_id
+    )
+'''
+
+
+def cargar_bloque(conn, preparado, incremental=False):
+    """
+    Carga un bloque preparado en SQLite con operaciones por conjuntos.
+
+    Las operaciones ya conocidas (mismo hash_unico) se descartan con un
+    anti-join. Con incremental=True además se conservan los matches
+    existentes: un match del archivo cuya operación ya tiene otro match es
+    un conflicto y no se inserta.
+
+    No hace commit: el llamador decide el alcance de la transacción.
+    """
+    cursor = conn.cursor()
+    _crear_staging(cursor)
+
+    marcadores = ', '.join('?' * len(COLUMNAS_STAGING))
+    cursor.executemany(
+        f'INSERT INTO stg_import ({", ".join(COLUMNAS_STAGING)}) VALUES ({marcadores})',
+        preparado['filas']
+    )
+
+    # Operaciones nuevas: anti-join por hash_unico; si un hash se repite en
+    # el bloque, la primera fila del archivo gana
+    cursor.execute('''
+        INSERT INTO operaciones_banco
+        (hash_unico, row_original, fecha, codigo_banco, nombre, monto, nombre_norm, codigo_norm, dia, centavos)
+        SELECT s.b_hash, s.b_row, s.b_fecha, s.b_codigo, s.b_nombre, s.b_monto,
+               s.b_nombre_norm, s.b_codigo_norm, s.b_dia, s.b_centavos
+        FROM stg_import s
+        WHERE s.pos IN (SELECT MIN(pos) FROM stg_import WHERE b_hash IS NOT NULL GROUP BY b_hash)
+        AND NOT EXISTS (SELECT 1 FROM operaciones_banco b WHERE b.hash_unico = s.b_hash)
+        ORDER BY s.pos
+    ''')
+    nuevos_banco = cursor.rowcount
+    cursor.execute('''
+        INSERT INTO operaciones_ventas
+        (hash_unico, row_original, factura, codigo_venta, fecha, nombre, monto,
+         nombre_norm, codigo_norm, dia, centavos)
+        SELECT s.v_hash, s.v_row, s.v_factura, s.v_codigo, s.v_fecha, s.v_nombre, s.v_monto,
+               s.v_nombre_norm, s.v_codigo_norm, s.v_dia, s.v_centavos
+        FROM stg_import s
+        WHERE s.pos IN (SELECT MIN(pos) FROM stg_import WHERE v_hash IS NOT NULL GROUP BY v_hash)
+        AND NOT EXISTS (SELECT 1 FROM operaciones_ventas v WHERE v.hash_unico = s.v_hash)
+        ORDER BY s.pos
+    ''')
+    nuevos_ventas = cursor.rowcount
+
+    # Resolver ids con joins por hash
+    cursor.execute('''
+        UPDATE stg_import SET banco_id = b.id
+        FROM operaciones_banco b WHERE b.hash_unico = stg_import.b_hash
+    ''')
+    cursor.execute('''
+        UPDATE stg_import SET venta_id = v.id
+        FROM operaciones_ventas v WHERE v.hash_unico = stg_import.v_hash
+    ''')
+
+    # Pares del archivo y cuántos ya estaban registrados
+    cursor.execute(f'''
+        SELECT COUNT(*) AS pares, COUNT(m.id) AS existentes
+        FROM stg_import s
+        LEFT JOIN matches m ON m.banco_id = s.banco_id AND m.venta_id = s.venta_id
+        WHERE {PRIMERA_FILA_POR_PAR}
+    ''')
+    pares = cursor.fetchone()
+
+    # Códigos de la secuencia, solo para los pares que todavía no tienen
+    # match; los que trae el archivo adelantan la secuencia
+    cursor.execute('SELECT match_code FROM stg_import WHERE match_code IS NOT NULL')
+    avanzar_secuencia_match_code(conn, [row[0] for row in cursor.fetchall()])
+    cursor.execute(f'''
+        SELECT s.pos FROM stg_import s
+        LEFT JOIN matches m ON m.banco_id = s.banco_id AND m.venta_id = s.venta_id
+        WHERE s.match_code IS NULL AND m.id IS NULL
+        AND {PRIMERA_FILA_POR_PAR}
+        ORDER BY s.pos
+    ''')
+    posiciones = [row[0] for row in cursor.fetchall()]
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS stg_codigos (pos INTEGER PRIMARY KEY, match_code TEXT)')
+    cursor.execute('DELETE FROM stg_codigos')
+    cursor.executemany('INSERT INTO stg_codigos VALUES (?, ?)',
+                       zip(posiciones, reservar_match_codes(conn, len(posiciones))))
+    cursor.execute('''
+        UPDATE stg_import SET match_code = c.match_code
+        FROM stg_codigos c WHERE c.pos = stg_import.pos
+    ''')
+
+    # Incremental: cada operación queda con un solo match, el existente o
+    # el de la primera fila del archivo que la nombra
+    sin_match_previo = ''
+    if incremental:
+        sin_match_previo = '''
+            AND NOT EXISTS (SELECT 1 FROM matches WHERE banco_id = s.banco_id)
+            AND NOT EXISTS (SELECT 1 FROM matches WHERE venta_id = s.venta_id)
+            AND s.pos IN (
+                SELECT MIN(pos) FROM stg_import
+                WHERE estado IS NOT NULL AND venta_id IS NOT NULL GROUP BY banco_id
+            )
+            AND s.pos IN (
+                SELECT MIN(pos) FROM stg_import
+                WHERE estado IS NOT NULL AND banco_id IS NOT NULL GROUP BY venta_id
+            )
+        '''
+
+    # Un match por par (banco, venta): la primera fila del archivo gana
+    confirmed_at = datetime.now().isoformat()
+    contadores = {}
+    for estado in ('CONFIRMADO', 'PENDIENTE'):
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO matches
+            (match_code, banco_id, venta_id, match_tipo, confianza, estado, confirmed_at)
+            SELECT s.match_code, s.banco_id, s.venta_id, s.match_tipo, s.confianza, s.estado,
+                   CASE WHEN s.estado = 'CONFIRMADO' THEN ? END
+            FROM stg_import s
+            LEFT JOIN matches m ON m.banco_id = s.banco_id AND m.venta_id = s.venta_id
+            WHERE s.estado = ? AND m.id IS NULL
+            AND {PRIMERA_FILA_POR_PAR}
+            {sin_match_previo}
+            ORDER BY s.pos
+        ''', (confirmed_at, estado))
+        contadores[estado] = cursor.rowcount
+
+    cursor.execute('''
+        SELECT COUNT(b_hash) AS banco, COUNT(v_hash) AS ventas FROM stg_import
+    ''')
+    row = cursor.fetchone()
+
+    return {
+        'nuevos_banco': nuevos_banco,
+        'nuevos_ventas': nuevos_ventas,
+        'sin_cambios_banco': row['banco'] - nuevos_banco,
+        'sin_cambios_ventas': row['ventas'] - nuevos_ventas,
+        'confirmados': contadores['CONFIRMADO'],
+        'pendientes': contadores['PENDIENTE'],
+        'matches_sin_cambios': pares['existentes'],
+        'conflictos': pares['pares'] - pares['existentes'] - contadores['CONFIRMADO'] - contadores['PENDIENTE'],
+        'sin_match': preparado['sin_match']
+    }
+
+
+# Un valor de cada clase, para que el parser de pd.read_excel decida el
+# tipo de una columna en todo el archivo (ver _tipos_archivo)
+REPRESENTANTES = {
+    'vacio': '', 'entero': 1, 'decimal': 1.5, 'bool': True, 'fecha': datetime(2000, 1, 1), 'texto': 'x',
+}
+_CLASE_POR_KIND = {'i': 'entero', 'u': 'entero', 'f': 'decimal', 'b': 'bool', 'M': 'fecha'}
+
+
+def _agregar_clases(clases, columna, hay_vacios, hay_valores, clase):
+    presentes = clases.setdefault(columna, set())
+    if hay_vacios:
+        presentes.add('vacio')
+    if hay_valores:
+        presentes.add(clase)
+
+
+def _clases_bloque(clases, df):
+    """Acumula las clases de valores de cada columna de un bloque ya parseado"""
+    for columna in df.columns:
+        vacios = df[columna].isna()
+        _agregar_clases(clases, columna, vacios.any(), not vacios.all(),
+                        _CLASE_POR_KIND.get(df[columna].dtype.kind, 'texto'))
+
+
+def _clases_lote(clases, lote):
+    """Acumula las clases de cada columna de un RecordBatch según su tipo Arrow"""
+    import pyarrow as pa
+
+    for campo, columna in zip(lote.schema, lote.columns):
+        if pa.types.is_integer(campo.type):
+            clase = 'entero'
+        elif pa.types.is_floating(campo.type):
+            clase = 'decimal'
+        elif pa.types.is_boolean(campo.type):
+            clase = 'bool'
+        elif pa.types.is_timestamp(campo.type) or pa.types.is_date(campo.type):
+            clase = 'fecha'
+        else:
+            clase = 'texto'
+        _agregar_clases(clases, campo.name, columna.null_count > 0, columna.null_count < len(columna), clase)
+
+
+def _tipos_archivo(clases):
+    """
+    Tipo de cada columna en todo el archivo.
+
+    pd.read_excel infiere el tipo mirando la columna entera (un vacío pasa
+    los enteros a float, un texto deja la columna como objetos): se le da
+    al mismo parser un valor de cada clase que apareció en la columna. Así
+    el tipo, y con él los hashes, no dependen del tamaño de los bloques.
+    """
+    tipos = {}
+    for columna, presentes in clases.items():
+        filas = [['c'], *([REPRESENTANTES[clase]] for clase in sorted(presentes))]
+        tipos[columna] = TextParser(filas, header=0, skip_blank_lines=False).read()['c'].dtype
+    return tipos
+
+
+def _con_tipos(df, tipos):
+    """Lleva cada columna del bloque al tipo que tiene en todo el archivo"""
+    for columna, tipo in tipos.items():
+        serie = df[columna]
+        if tipo == object:
+            df[columna] = serie.astype(object).where(serie.notna(), float('nan'))
+        elif serie.dtype != tipo:
+            df[columna] = pd.to_datetime(serie) if tipo.kind == 'M' else serie.astype(tipo)
+    return df
+
+
+def _celda(valor):
+    """Valor de openpyxl como lo entrega pd.read_excel (números enteros como int)"""
+    if valor is None:
+        return ''
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        entero = int(valor)
+        return entero if entero == valor else float(valor)
+    if isinstance(valor, str) and valor in ERROR_CODES:
+        return float('nan')
+    return valor
+
+
+def _parsear(encabezado, filas, objetos=()):
+    """Parsea filas con el mismo parser que pd.read_excel; las columnas objetos quedan sin convertir"""
+    return TextParser([encabezado, *filas], header=0, skip_blank_lines=False,
+                      dtype=dict.fromkeys(objetos, object)).read()
+
+
+def _filas_xlsx(hoja, ancho):
+    """
+    Filas de datos con las celdas convertidas. Como pd.read_excel, se
+    conservan las filas vacías intermedias (cuentan como vacíos al inferir
+    los tipos) y se descartan las del final.
+    """
+    vacias = 0
+    for fila in hoja:
+        if all(v is None for v in fila):
+            vacias += 1
+            continue
+        for _ in range(vacias):
+            yield [''] * ancho
+        vacias = 0
+        yield ([_celda(v) for v in fila] + [''] * ancho)[:ancho]
+
+
+def leer_xlsx_por_bloques(filepath, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Lee la primera hoja del xlsx en modo read-only y produce DataFrames
+    de tamano_bloque filas con los tipos que daría pd.read_excel.
+
+    Primera pasada: se parsea cada bloque, se acumulan las clases de
+    valores de cada columna y las filas se vuelcan a un archivo temporal.
+    Segunda pasada: los bloques se leen del temporal y se llevan a los
+    tipos del archivo entero. La memoria no crece con el tamaño del
+    archivo y el xlsx se lee una sola vez.
+    """
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    with tempfile.TemporaryFile() as temporal:
+        try:
+            filas = wb.worksheets[0].iter_rows(values_only=True)
+            encabezado = next(filas, None)
+            if encabezado is None:
+                return
+            encabezado = [_celda(c) for c in encabezado]
+            clases = {}
+            for bloque in _en_bloques(_filas_xlsx(filas, len(encabezado)), tamano_bloque):
+                _clases_bloque(clases, _parsear(encabezado, bloque))
+                pickle.dump(bloque, temporal, pickle.HIGHEST_PROTOCOL)
+        finally:
+            wb.close()
+
+        tipos = _tipos_archivo(clases)
+        objetos = [columna for columna, tipo in tipos.items() if tipo == object]
+        temporal.seek(0)
+        while True:
+            try:
+                bloque = pickle.load(temporal)
+            except EOFError:
+                break
+            yield _con_tipos(_parsear(encabezado, bloque, objetos), tipos)
+
+
+def _en_bloques(filas, tamano_bloque):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano_bloque:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def _lote_a_dataframe(lote, tipos):
+    """
+    Convierte un RecordBatch de Arrow en un DataFrame con los tipos del
+    archivo. Las columnas pasan enteras, sin armar filas; los enteros con
+    vacíos salen como int de Python y pasan a float si la columna tiene
+    vacíos en algún lote, igual que al leer el xlsx.
+    """
+    return _con_tipos(lote.to_pandas(date_as_object=False, integer_object_nulls=True), tipos)
+
+
+def leer_parquet_por_bloques(filepath, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Lee el Parquet por lotes de tamano_bloque filas (pyarrow, solo al
+    usarlo). El esquema fija el tipo de cada columna; una primera pasada
+    mira solo dónde hay vacíos.
+    """
+    import pyarrow.parquet as pq
+
+    archivo = pq.ParquetFile(filepath)
+    try:
+        clases = {}
+        for lote in archivo.iter_batches(batch_size=tamano_bloque):
+            _clases_lote(clases, lote)
+        tipos = _tipos_archivo(clases)
+        for lote in archivo.iter_batches(batch_size=tamano_bloque):
+            yield _lote_a_dataframe(lote, tipos)
+    finally:
+        archivo.close()
+
+
+def _lotes_arrow(fuente):
+    """RecordBatches de un archivo Arrow IPC, en formato archivo o stream"""
+    import pyarrow as pa
+
+    try:
+        lector = pa.ipc.open_file(fuente)
+    except pa.ArrowInvalid:
+        fuente.seek(0)
+        yield from pa.ipc.open_stream(fuente)
+        return
+    for i in range(lector.num_record_batches):
+        yield lector.get_batch(i)
+
+
+def leer_arrow_por_bloques(filepath, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Lee el archivo Arrow IPC (.arrow / .feather) mapeado en memoria y
+    produce DataFrames de hasta tamano_bloque filas. Como en Parquet, una
+    primera pasada (sin copiar datos) mira dónde hay vacíos.
+    """
+    import pyarrow as pa
+
+    with pa.memory_map(filepath) as fuente:
+        clases = {}
+        for lote in _lotes_arrow(fuente):
+            _clases_lote(clases, lote)
+        tipos = _tipos_archivo(clases)
+        fuente.seek(0)
+        for lote in _lotes_arrow(fuente):
+            for inicio in range(0, lote.num_rows, tamano_bloque):
+                yield _lote_a_dataframe(lote.slice(inicio, tamano_bloque), tipos)
+
+
+# Lector por extensión de archivo
+LECTORES = {
+    '.xlsx': leer_xlsx_por_bloques,
+    '.parquet': leer_parquet_por_bloques,
+    '.arrow': leer_arrow_por_bloques,
+    '.feather': leer_arrow_por_bloques,
+}
+
+
+def _extension(filepath):
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension not in LECTORES:
+        raise ValueError(f'Formato no soportado: {extension or filepath}')
+    return extension
+
+
+def leer_por_bloques(filepath, tamano_bloque=TAMANO_BLOQUE):
+    """DataFrames de tamano_bloque filas del archivo fusionado, según su extensión"""
+    return LECTORES[_extension(filepath)](filepath, tamano_bloque)
+
+
+def contar_filas(filepath):
+    """Filas de datos del archivo para el progreso (None si no se saben sin leerlo)"""
+    extension = _extension(filepath)
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(filepath).metadata.num_rows
+    if extension != '.xlsx':
+        import pyarrow as pa
+        with pa.memory_map(filepath) as fuente:
+            return sum(lote.num_rows for lote in _lotes_arrow(fuente))
+    return contar_filas_xlsx(filepath)
+
+
+def contar_filas_xlsx(filepath):
+    """Filas de datos según la dimensión de la hoja (None si no la declara)"""
+    wb = load_workbook(filepath, read_only=True)
+    try:
+        max_row = wb.worksheets[0].max_row
+    finally:
+        wb.close()
+    return max_row - 1 if max_row else None
+
+
+def _preparar_bloques(bloques):
+    """Prepara una secuencia de DataFrames numerando las filas del archivo"""
+    filas = 0
+    for df in bloques:
+        yield preparar_bloque(df, pos_inicial=filas)
+        filas += len(df)
+
+
+def importar_preparados(conn, preparados, al_terminar_bloque=None, incremental=False, result=None):
+    """
+    Carga bloques ya preparados acumulando los contadores en result.
+
+    Si se indica al_terminar_bloque(conn, result), se llama tras cada bloque
+    y el bloque se confirma por separado, para no bloquear a los lectores
+    durante importaciones largas.
+    """
+    if result is None:
+        result = dict.fromkeys(CONTADORES, 0)
+    for preparado in preparados:
+        parcial = cargar_bloque(conn, preparado, incremental)
+        for clave, valor in parcial.items():
+            result[clave] += valor
+        result['filas'] += preparado['n']
+        if al_terminar_bloque:
+            al_terminar_bloque(conn, result)
+            conn.commit()
+    return result
+
+
+def importar_bloques(conn, bloques, al_terminar_bloque=None, incremental=False):
+    """Importa una secuencia de DataFrames acumulando los contadores"""
+    return importar_preparados(conn, _preparar_bloques(bloques), al_terminar_bloque, incremental)
+
+
+def procesar_archivo(filepath, streaming=True, tamano_bloque=TAMANO_BLOQUE, al_terminar_bloque=None,
+                     incremental=False):
+    """
+    Procesa el archivo fusionado e importa a SQLite.
+
+    Con streaming=True el archivo se lee por bloques de tamano_bloque filas
+    (memoria constante); con streaming=False un xlsx se carga completo con
+    pd.read_excel (Parquet y Arrow siempre van por lotes). Sin
+    al_terminar_bloque, todo el archivo se importa en una sola transacción.
+    Con incremental=True solo se agregan operaciones y matches nuevos sobre
+    los datos existentes (ver cargar_bloque).
+    """
+    inicio = time.perf_counter()
+    if streaming or _extension(filepath) != '.xlsx':
+        bloques = leer_por_bloques(filepath, tamano_bloque)
+    else:
+        bloques = [pd.read_excel(filepath)]
+
+    conn = get_db()
+    try:
+        result = importar_bloques(conn, bloques, al_terminar_bloque, incremental)
+        conn.commit()
+    finally:
+        conn.close()
+
+    segundos = time.perf_counter() - inicio
+    result['segundos'] = round(segundos, 3)
+    result['filas_por_segundo'] = round(result['filas'] / segundos) if segundos > 0 else 0
+    print(f"Importación{' incremental' if incremental else ''}: {result['filas']} filas en {result['segundos']}s "
+          f"({result['filas_por_segundo']} filas/s)")
+    if incremental:
+        print(f"  Nuevas: {result['nuevos_banco']} banco, {result['nuevos_ventas']} ventas | "
+              f"sin cambios: {result['sin_cambios_banco']} banco, {result['sin_cambios_ventas']} ventas | "
+              f"conflictos: {result['conflictos']}")
+    return result
+
+
+def preparar_archivo(filepath, tamano_bloque, cola):
+    """
+    Lee y prepara los bloques de un archivo. Corre en los procesos del pool
+    de importar_lote: entrega cada bloque por cola en cuanto está listo (la
+    cola es acotada, así que espera al escritor) y al final None. Devuelve
+    los segundos de preparación, sin contar la espera.
+    """
+    segundos = 0.0
+    inicio = time.perf_counter()
+    for preparado in _preparar_bloques(leer_por_bloques(filepath, tamano_bloque)):
+        segundos += time.perf_counter() - inicio
+        cola.put(preparado)
+        inicio = time.perf_counter()
+    cola.put(None)
+    return segundos + time.perf_counter() - inicio
+
+
+def _bloques_de(cola, futuro, tiempos):
+    """Bloques preparados de un archivo a medida que llegan; acumula la espera en tiempos"""
+    while True:
+        inicio = time.perf_counter()
+        try:
+            preparado = cola.get(timeout=1)
+        except queue.Empty:
+            tiempos['espera'] += time.perf_counter() - inicio
+            if futuro.done():
+                futuro.result()  # propaga el error del proceso, si lo hubo
+                raise RuntimeError('La preparación terminó sin entregar todos los bloques')
+            continue
+        tiempos['espera'] += time.perf_counter() - inicio
+        if preparado is None:
+            return
+        yield preparado
+
+
+def _preparar_en_paralelo(archivos, procesos, tamano_bloque):
+    """
+    Prepara los archivos en un pool de procesos y los entrega en el orden
+    recibido como (archivo, bloques, futuro, tiempos): bloques se consume a
+    medida que los procesos preparan y futuro da los segundos de preparación.
+    Cada archivo en curso retiene a lo sumo BLOQUES_EN_COLA bloques listos,
+    así que la memoria no crece con el tamaño de los archivos.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    # Al salir se apaga primero el manager: si el escritor falla, los
+    # procesos bloqueados en cola.put terminan con error y el pool no se cuelga
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool, contexto.Manager() as manager:
+        def enviar(archivo):
+            cola = manager.Queue(BLOQUES_EN_COLA)
+            return archivo, cola, pool.submit(preparar_archivo, archivo, tamano_bloque, cola)
+
+        restantes = iter(archivos)
+        en_vuelo = deque(enviar(archivo) for archivo in itertools.islice(restantes, procesos))
+        while en_vuelo:
+            archivo, cola, futuro = en_vuelo.popleft()
+            tiempos = {'espera': 0.0}
+            yield archivo, _bloques_de(cola, futuro, tiempos), futuro, tiempos
+            siguiente = next(restantes, None)
+            if siguiente is not None:
+                en_vuelo.append(enviar(siguiente))
+
+
+def importar_lote(archivos, procesos=None, tamano_bloque=TAMANO_BLOQUE, al_terminar_bloque=None,
+                  incremental=False):
+    """
+    Importa varios archivos fusionados a la vez.
+
+    La lectura de los archivos, los hashes y la normalización (preparar_archivo)
+    corren en un pool de procesos; este proceso es el único escritor y
+    carga los bloques a medida que llegan, en el orden de archivos, con una transacción por
+    archivo (o por bloque si se indica al_terminar_bloque). Así el parseo
+    escala con los núcleos y SQLite sigue viendo un solo escritor.
+    """
+    inicio = time.perf_counter()
+    procesos = procesos or min(len(archivos), os.cpu_count() or 1)
+    result = dict.fromkeys(CONTADORES, 0)
+    segundos_preparacion = 0.0
+    segundos_escritura = 0.0
+
+    conn = get_db()
+    try:
+        for archivo, bloques, futuro, tiempos in _preparar_en_paralelo(archivos, procesos, tamano_bloque):
+            inicio_escritura = time.perf_counter()
+            filas_previas = result['filas']
+            importar_preparados(conn, bloques, al_terminar_bloque, incremental, result)
+            conn.commit()
+            escritura = time.perf_counter() - inicio_escritura - tiempos['espera']
+            segundos = futuro.result()
+            segundos_preparacion += segundos
+            segundos_escritura += escritura
+            print(f"  {os.path.basename(archivo)}: {result['filas'] - filas_previas} filas "
+                  f"(preparado {segundos:.2f}s, escrito {escritura:.2f}s)")
+    finally:
+        conn.close()
+
+    segundos = time.perf_counter() - inicio
+    result['archivos'] = len(archivos)
+    result['procesos'] = procesos
+    result['segundos_preparacion'] = round(segundos_preparacion, 3)
+    result['segundos_escritura'] = round(segundos_escritura, 3)
+    result['segundos'] = round(segundos, 3)
+    result['filas_por_segundo'] = round(result['filas'] / segundos) if segundos > 0 else 0
+    print(f"Importación en lote{' incremental' if incremental else ''}: {len(archivos)} archivos, "
+          f"{result['filas']} filas en {result['segundos']}s ({result['filas_por_segundo']} filas/s) "
+          f"con {procesos} procesos; escritura {result['segundos_escritura']}s")
+    return result
+
+
+# Pool de un proceso por worker de gunicorn: la importación no compite por
+# el GIL con las peticiones y SQLite sigue viendo un único escritor.
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def encolar_importacion(archivos, incremental=False):
+    """
+    Registra la importación y la envía al pool; devuelve al instante
+    (id, True), o (id de la activa, False) si ya había otra en curso.
+    """
+    importacion_id, creada = crear_importacion(archivos, incremental)
+    if creada:
+        _get_pool().submit(ejecutar_importacion, importacion_id)
+    return importacion_id, creada
+
+
+def _latir(importacion_id, terminada):
+    """Registra actividad hasta que termine la importación (ver get_importacion_activa)"""
+    while not terminada.wait(SEGUNDOS_LATIDO):
+        try:
+            latir_importacion(importacion_id)
+        except Exception as e:
+            print(f"Error al registrar actividad de la importación {importacion_id}: {e}")
+
+
+def ejecutar_importacion(importacion_id, procesos=None):
+    """
+    Ejecuta una importación en cola, registrando el progreso por bloque.
+    procesos: tamaño del pool de importar_lote cuando hay varios archivos.
+    """
+    importacion = get_importacion(importacion_id)
+    if importacion is None:
+        return
+
+    # Contar filas y leer el archivo antes del primer bloque también lleva tiempo
+    terminada = threading.Event()
+    threading.Thread(target=_latir, args=(importacion_id, terminada),
+                     name='latido-importacion', daemon=True).start()
+    try:
+        archivos = importacion['archivos']
+        filas_total = sum(contar_filas(a) or 0 for a in archivos) or None
+        if not iniciar_importacion(importacion_id, filas_total):
+            return  # Ya la tomó otro proceso
+
+        def progreso(conn, result):
+            actualizar_progreso_importacion(conn, importacion_id, result['filas'])
+
+        try:
+            # Varios archivos: se preparan en paralelo con un único escritor
+            if len(archivos) > 1:
+                total = importar_lote(archivos, procesos, al_terminar_bloque=progreso,
+                                      incremental=importacion['incremental'])
+            else:
+                total = procesar_archivo(archivos[0], al_terminar_bloque=progreso,
+                                         incremental=importacion['incremental'])
+            finalizar_importacion(importacion_id, resultado=total)
+        except Exception as e:
+            print(f"Error en importación {importacion_id}: {e}")
+            finalizar_importacion(importacion_id, error=str(e))
+            return
+    finally:
+        terminada.set()
+
+    # La importación ya figura completa: las sugerencias se calculan después
+    try:
+        actualizar_sugerencias()
+    except Exception as e:
+        print(f"Error al actualizar sugerencias tras la importación {importacion_id}: {e}")
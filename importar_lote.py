@@ -0,0 +1,22 @@
+"""
+Importación en lote de varios archivos fusionados desde la línea de comandos.
+
+Los archivos se leen y preparan (hashes, normalización) en un pool de
+procesos y este proceso los escribe en SQLite como único escritor. La
+importación se registra en la tabla importaciones: la web muestra su
+progreso y no acepta otra subida mientras corre. Como en /upload, si ya
+hay datos la importación es incremental.
+
+Uso:
+    python importar_lote.py banco1.xlsx banco2.xlsx ventas.xlsx [--procesos 4]
+
+Equivale a python -m cli importar (ver cli.py).
+"""
+
+import sys
+
+from cli import main
+
+
+if __name__ == '__main__':
+    sys.exit(main(['importar', *sys.argv[1:]]))
@@ -0,0 +1,266 @@
+"""
+Índice en memoria de operaciones sin match para la búsqueda manual.
+
+Cada proceso mantiene, por tabla, los centavos ordenados en arrays de NumPy
+(búsqueda por rango con searchsorted), los números de día y mapas de
+trigramas de nombre_norm y codigo_norm. Las búsquedas aplican
+los mismos criterios que buscar_posibles_matches_para_venta / _banco sin
+recorrer la tabla en SQLite.
+
+El índice se reconstruye cuando cambia la versión de los datos
+(get_version_datos), es decir, tras cualquier escritura confirmada de
+operaciones o matches.
+"""
+
+import re
+import threading
+from functools import cached_property
+
+import numpy as np
+
+from database import get_db, get_version_datos, patrones_busqueda, rango_centavos, TOLERANCIAS_MONTO
+
+
+# Tabla de cada lado
+TABLAS = {
+    'banco': 'operaciones_banco',
+    'ventas': 'operaciones_ventas',
+}
+
+_SIN_FECHA = -10 ** 9  # fuera del rango de fechas válidas
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def coincide_like(patron):
+    """Devuelve una función que evalúa texto LIKE '%patron%'"""
+    if '%' not in patron and '_' not in patron:
+        return lambda texto: texto is not None and patron in texto
+    regex = re.compile(''.join(
+        '.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in patron
+    ), re.DOTALL)
+    return lambda texto: texto is not None and regex.search(texto) is not None
+
+
+class IndiceCandidatos:
+    """Operaciones sin match de una tabla, indexadas en memoria"""
+
+    def __init__(self, columnas, filas):
+        self.columnas = columnas
+        self.filas = filas
+        n = len(filas)
+        valores = dict(zip(columnas, zip(*filas))) if filas else {c: () for c in columnas}
+        self.ids = np.array(valores['id'], dtype=np.int64)
+
+        # Centavos ordenados: rango de tolerancia con searchsorted (los
+        # enteros son exactos en float64, NaN donde no hay monto)
+        centavos = np.array([np.nan if c is None else c for c in valores['centavos']], dtype=np.float64)
+        self.centavos = centavos
+        validos = np.flatnonzero(~np.isnan(centavos))
+        self.orden_centavos = validos[np.argsort(centavos[validos], kind='stable')]
+        self.centavos_ordenados = centavos[self.orden_centavos]
+
+        # Números de día
+        self.dias = np.array([_SIN_FECHA if d is None else d for d in valores['dia']], dtype=np.int64)
+        self.tiene_dia = self.dias != _SIN_FECHA
+        con_dia = np.flatnonzero(self.tiene_dia)
+        self.orden_dia = con_dia[np.argsort(self.dias[con_dia], kind='stable')]
+        self.dias_ordenados = self.dias[self.orden_dia]
+
+        self.todas = np.arange(n, dtype=np.int64)
+        self.posiciones = {row_id: pos for pos, row_id in enumerate(self.ids.tolist())}
+
+    def fila_en(self, pos):
+        """Fila en la posición pos como dict"""
+        return dict(zip(self.columnas, self.filas[pos]))
+
+    def fila(self, row_id):
+        """Fila indexada con ese id, o None si ya tiene match"""
+        pos = self.posiciones.get(row_id)
+        return None if pos is None else self.fila_en(pos)
+
+    # Columnas normalizadas y sus trigramas: solo se construyen al primer uso
+    @cached_property
+    def nombres(self):
+        i = self.columnas.index('nombre_norm')
+        return [f[i] for f in self.filas]
+
+    @cached_property
+    def codigos(self):
+        i = self.columnas.index('codigo_norm')
+        return [f[i] for f in self.filas]
+
+    @cached_property
+    def trigramas_nombre(self):
+        return self._mapa_trigramas(self.nombres)
+
+    @cached_property
+    def trigramas_codigo(self):
+        return self._mapa_trigramas(self.codigos)
+
+    @staticmethod
+    def _mapa_trigramas(textos):
+        """Trigrama -> posiciones (ordenadas) de los textos que lo contienen"""
+        mapa = {}
+        for pos, texto in enumerate(textos):
+            if texto:
+                for trigrama in _trigramas(texto):
+                    mapa.setdefault(trigrama, []).append(pos)
+        return {t: np.array(p, dtype=np.int64) for t, p in mapa.items()}
+
+    def _por_trigramas(self, mapa, patron, candidatos):
+        """Reduce los candidatos a los que contienen todos los trigramas del patrón"""
+        trozos = [t for t in re.split('[%_]', patron) if len(t) >= 3]
+        listas = [mapa.get(t, np.empty(0, dtype=np.int64)) for trozo in trozos for t in _trigramas(trozo)]
+        for lista in sorted(listas, key=len):
+            candidatos = lista if candidatos is None else np.intersect1d(candidatos, lista, assume_unique=True)
+            if not len(candidatos):
+                break
+        return candidatos
+
+    def buscar(self, origen, criterios, limit):
+        """Candidatos para la operación origen, ordenados como la consulta SQL"""
+        centavos = origen['centavos']
+        dia = origen['dia']
+        candidatos = None
+
+        # Criterio de monto
+        monto_criterio = criterios.get('monto', 'exacto')
+        if monto_criterio in TOLERANCIAS_MONTO:
+            if centavos is None:
+                return []
+            minimo, maximo = rango_centavos(centavos, monto_criterio)
+            inicio = np.searchsorted(self.centavos_ordenados, minimo, side='left')
+            fin = np.searchsorted(self.centavos_ordenados, maximo, side='right')
+            candidatos = np.sort(self.orden_centavos[inicio:fin]) if fin > inicio else np.empty(0, dtype=np.int64)
+
+        # Criterios de nombre y código (LIKE '%x%')
+        patrones = [
+            (self.nombres, self.trigramas_nombre, texto) if columna == 'nombre_norm'
+            else (self.codigos, self.trigramas_codigo, texto)
+            for columna, texto in patrones_busqueda(origen, criterios)
+        ]
+        for _, mapa, patron in patrones:
+            candidatos = self._por_trigramas(mapa, patron, candidatos)
+
+        # Criterio de fecha
+        dias_fecha = criterios.get('fecha')
+        if dias_fecha:
+            if dia is None:
+                return []
+            if candidatos is None:
+                inicio = np.searchsorted(self.dias_ordenados, dia - dias_fecha, side='left')
+                fin = np.searchsorted(self.dias_ordenados, dia + dias_fecha, side='right')
+                candidatos = np.sort(self.orden_dia[inicio:fin])
+            else:
+                candidatos = candidatos[self.tiene_dia[candidatos] & (np.abs(self.dias[candidatos] - dia) <= dias_fecha)]
+
+        if candidatos is None:
+            candidatos = self.todas
+
+        if not len(candidatos):
+            return []
+
+        # ORDER BY diferencia_monto ASC, dias_diferencia ASC (NULL primero)
+        origen_centavos = np.nan if centavos is None else centavos
+        diferencia_monto = np.abs(self.centavos[candidatos] - origen_centavos) / 100
+        if len(candidatos) > limit and not patrones:
+            # Preselección: solo los que empatan o mejoran el límite de diferencia_monto
+            clave = np.nan_to_num(diferencia_monto, nan=-np.inf)
+            umbral = np.partition(clave, limit - 1)[limit - 1]
+            mejores = clave <= umbral
+            candidatos, diferencia_monto = candidatos[mejores], diferencia_monto[mejores]
+        if dia is None:
+            dias_diferencia = np.full(len(candidatos), np.nan)
+        else:
+            dias_diferencia = np.where(self.tiene_dia[candidatos],
+                                       np.abs(self.dias[candidatos] - dia).astype(np.float64), np.nan)
+        orden = np.lexsort((
+            self.ids[candidatos],
+            np.nan_to_num(dias_diferencia, nan=np.inf),
+            ~np.isnan(dias_diferencia),
+            np.nan_to_num(diferencia_monto, nan=np.inf),
+            ~np.isnan(diferencia_monto),
+        ))
+
+        # Los trigramas dan un superconjunto: se verifica el LIKE exacto
+        # recorriendo en orden hasta completar el límite
+        if patrones:
+            verificadores = [(textos, coincide_like(patron)) for textos, _, patron in patrones]
+            aceptados = []
+            for i in orden.tolist():
+                pos = candidatos[i]
+                if all(coincide(textos[pos]) for textos, coincide in verificadores):
+                    aceptados.append(i)
+                    if len(aceptados) == limit:
+                        break
+            orden = aceptados
+        else:
+            orden = orden[:limit].tolist()
+
+        resultados = []
+        for i in orden:
+            fila = self.fila_en(candidatos[i])
+            fila['dias_diferencia'] = None if np.isnan(dias_diferencia[i]) else float(dias_diferencia[i])
+            fila['diferencia_monto'] = None if np.isnan(diferencia_monto[i]) else float(diferencia_monto[i])
+            resultados.append(fila)
+        return resultados
+
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def get_indice(lado):
+    """Índice de la tabla 'banco' o 'ventas', reconstruido si los datos cambiaron"""
+    version = get_version_datos()
+    with _lock:
+        actual = _indices.get(lado)
+        if actual and actual[0] == version:
+            return actual[1]
+        tabla = TABLAS[lado]
+        conn = get_db()
+        conn.row_factory = None
+        cursor = conn.execute(f'SELECT * FROM {tabla} WHERE conciliado = 0 ORDER BY id')
+        filas = cursor.fetchall()
+        columnas = [d[0] for d in cursor.description]
+        conn.close()
+        indice = IndiceCandidatos(columnas, filas)
+        _indices[lado] = (version, indice)
+        return indice
+
+
+def invalidar():
+    """Descarta los índices de este proceso"""
+    with _lock:
+        _indices.clear()
+
+
+def _buscar(lado_origen, lado, origen_id, criterios, limit):
+    if criterios is None:
+        criterios = {'monto': 'exacto', 'fecha': 7, 'nombre': False, 'codigo': False}
+
+    tabla_origen = TABLAS[lado_origen]
+    # La operación origen suele estar sin match: se toma de su propio índice
+    origen = get_indice(lado_origen).fila(origen_id)
+    if origen is None:
+        conn = get_db()
+        origen = conn.execute(f'SELECT * FROM {tabla_origen} WHERE id = ?', (origen_id,)).fetchone()
+        conn.close()
+    if not origen:
+        return []
+
+    indice = get_indice(lado)
+    return indice.buscar(origen, criterios, limit)
+
+
+def buscar_para_venta(venta_id, criterios=None, limit=10):
+    """Equivalente en memoria de buscar_posibles_matches_para_venta"""
+    return _buscar('ventas', 'banco', venta_id, criterios, limit)
+
+
+def buscar_para_banco(banco_id, criterios=None, limit=10):
+    """Equivalente en memoria de buscar_posibles_matches_para_banco"""
+    return _buscar('banco', 'ventas', banco_id, criterios, limit)
@@ -0,0 +1,266 @@
+"""
+Instrumentación opcional de consultas SQLite y peticiones HTTP.
+
+Se activa con la variable de entorno METRICAS_ACTIVAS=1. Con ella:
+- las conexiones de get_db usan CursorMedido, que registra por consulta
+  (huella del SQL: ver huella_sql) cantidad de ejecuciones, tiempo y filas;
+- cada petición registra su latencia por ruta, separando el tiempo pasado
+  en SQLite y en plantillas Jinja (el resto es Python: pandas, etc.);
+- /metrics expone todo en formato de texto de Prometheus;
+- con METRICAS_CONSULTA_LENTA_MS se imprimen las consultas que superan el
+  umbral junto con su EXPLAIN QUERY PLAN.
+
+Las métricas son por proceso: con varios workers de gunicorn cada
+scrape muestra las del worker que lo atendió.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+
+ACTIVAS = os.environ.get('METRICAS_ACTIVAS', '0') == '1'
+CONSULTA_LENTA_MS = float(os.environ.get('METRICAS_CONSULTA_LENTA_MS', '0')) or None
+
+# Límites (en segundos) del histograma de latencia por ruta
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_consultas = defaultdict(lambda: [0, 0.0, 0])  # huella -> [ejecuciones, segundos, filas]
+_rutas = {}  # (método, ruta, estado) -> [buckets..., cantidad, segundos, sqlite, plantillas]
+
+# Tiempo de SQLite y de plantillas acumulado en la petición del hilo actual
+_peticion = threading.local()
+
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTA_MARCADORES = re.compile(r'\?(?:\s*,\s*\?)+')
+_VARIAS_FILAS = re.compile(r'\((\?(?:, \.\.\.)?)\)(?:\s*,\s*\(\1\))+')
+
+
+def normalizar_sql(sql):
+    """SQL en una línea, sin espacios repetidos"""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def huella_sql(sql):
+    """
+    Forma de la consulta con la que se agrupan las métricas: los literales
+    pasan a ? y las listas de marcadores (IN (?, ?, ...), VALUES de varias
+    filas) de cualquier largo quedan como una sola, para que la cantidad de
+    series no crezca con los datos.
+    """
+    sql = _LITERALES.sub('?', normalizar_sql(sql))
+    sql = _LISTA_MARCADORES.sub('?, ...', sql)
+    return _VARIAS_FILAS.sub(r'(\1), ...', sql)
+
+
+def _acumular_en_peticion(atributo, segundos):
+    if getattr(_peticion, 'activa', False):
+        setattr(_peticion, atributo, getattr(_peticion, atributo) + segundos)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """
+    Cursor que mide cada consulta. El tiempo incluye execute y los fetch
+    posteriores; las filas son las leídas (SELECT) o rowcount (escrituras).
+    """
+
+    _sql = None
+    _huella = None
+    _segundos = 0.0
+    _lenta_registrada = False
+    _parametros = None
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            self._empezar(sql, parametros, time.perf_counter() - inicio)
+
+    def executemany(self, sql, secuencia):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, secuencia)
+        finally:
+            self._empezar(sql, None, time.perf_counter() - inicio)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = super().fetchone()
+        self._sumar(time.perf_counter() - inicio, 0 if fila is None else 1)
+        return fila
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        filas = super().fetchmany(self.arraysize if size is None else size)
+        self._sumar(time.perf_counter() - inicio, len(filas))
+        return filas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = super().fetchall()
+        self._sumar(time.perf_counter() - inicio, len(filas))
+        return filas
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        fila = super().__next__()
+        self._sumar(time.perf_counter() - inicio, 1)
+        return fila
+
+    def _empezar(self, sql, parametros, segundos):
+        self._sql = normalizar_sql(sql)
+        self._huella = huella_sql(self._sql)
+        self._parametros = parametros
+        self._segundos = 0.0
+        self._lenta_registrada = False
+        filas = self.rowcount if self.rowcount > 0 else 0
+        with _lock:
+            _consultas[self._huella][0] += 1
+        self._sumar(segundos, filas)
+
+    def _sumar(self, segundos, filas):
+        if self._sql is None:
+            return
+        with _lock:
+            registro = _consultas[self._huella]
+            registro[1] += segundos
+            registro[2] += filas
+        _acumular_en_peticion('sqlite', segundos)
+        self._segundos += segundos
+        if CONSULTA_LENTA_MS and not self._lenta_registrada and self._segundos * 1000 >= CONSULTA_LENTA_MS:
+            self._lenta_registrada = True
+            self._registrar_lenta()
+
+    def _registrar_lenta(self):
+        """Imprime la consulta lenta con su plan (en un cursor sin medir)"""
+        print(f"Consulta lenta ({self._segundos * 1000:.1f} ms): {self._huella}")
+        if self._parametros is None or not self._sql.upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+            return
+        try:
+            plan = sqlite3.Cursor(self.connection).execute(f'EXPLAIN QUERY PLAN {self._sql}', self._parametros)
+            for _, padre, _, detalle in plan.fetchall():
+                print(f"  {'  ' if padre else ''}{detalle}")
+        except sqlite3.Error as e:
+            print(f"  (sin plan: {e})")
+
+
+def iniciar_peticion():
+    _peticion.activa = True
+    _peticion.inicio = time.perf_counter()
+    _peticion.sqlite = 0.0
+    _peticion.plantillas = 0.0
+
+
+def terminar_peticion(metodo, ruta, estado):
+    if not getattr(_peticion, 'activa', False):
+        return
+    _peticion.activa = False
+    segundos = time.perf_counter() - _peticion.inicio
+    with _lock:
+        registro = _rutas.get((metodo, ruta, estado))
+        if registro is None:
+            registro = _rutas[(metodo, ruta, estado)] = [0] * len(BUCKETS_LATENCIA) + [0, 0.0, 0.0, 0.0]
+        for i, limite in enumerate(BUCKETS_LATENCIA):
+            if segundos <= limite:
+                registro[i] += 1
+        n = len(BUCKETS_LATENCIA)
+        registro[n] += 1
+        registro[n + 1] += segundos
+        registro[n + 2] += _peticion.sqlite
+        registro[n + 3] += _peticion.plantillas
+
+
+def _inicio_plantilla(*args, **kwargs):
+    _peticion.inicio_plantilla = time.perf_counter()
+
+
+def _fin_plantilla(*args, **kwargs):
+    inicio = getattr(_peticion, 'inicio_plantilla', None)
+    if inicio is not None:
+        _acumular_en_peticion('plantillas', time.perf_counter() - inicio)
+        _peticion.inicio_plantilla = None
+
+
+def instalar(app):
+    """Registra los hooks de Flask que miden cada petición"""
+    from flask import request, before_render_template, template_rendered
+
+    @app.before_request
+    def _antes():
+        iniciar_peticion()
+
+    @app.after_request
+    def _despues(response):
+        # Al cerrar la respuesta, para incluir el envío de las descargas en streaming
+        metodo = request.method
+        ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        response.call_on_close(lambda: terminar_peticion(metodo, ruta, response.status_code))
+        return response
+
+    before_render_template.connect(_inicio_plantilla, app)
+    template_rendered.connect(_fin_plantilla, app)
+
+
+def _etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def exportar_prometheus():
+    """Métricas en formato de texto de Prometheus"""
+    with _lock:
+        consultas = {huella: list(r) for huella, r in _consultas.items()}
+        rutas = {clave: list(r) for clave, r in _rutas.items()}
+
+    lineas = [
+        '# HELP match_sqlite_consultas_total Ejecuciones por consulta SQL.',
+        '# TYPE match_sqlite_consultas_total counter',
+    ]
+    for sql, (ejecuciones, _, _) in consultas.items():
+        lineas.append(f'match_sqlite_consultas_total{{sql="{_etiqueta(sql)}"}} {ejecuciones}')
+    lineas += [
+        '# HELP match_sqlite_consulta_segundos_total Tiempo en SQLite por consulta (execute + fetch).',
+        '# TYPE match_sqlite_consulta_segundos_total counter',
+    ]
+    for sql, (_, segundos, _) in consultas.items():
+        lineas.append(f'match_sqlite_consulta_segundos_total{{sql="{_etiqueta(sql)}"}} {segundos:.6f}')
+    lineas += [
+        '# HELP match_sqlite_filas_total Filas leídas o modificadas por consulta.',
+        '# TYPE match_sqlite_filas_total counter',
+    ]
+    for sql, (_, _, filas) in consultas.items():
+        lineas.append(f'match_sqlite_filas_total{{sql="{_etiqueta(sql)}"}} {filas}')
+
+    n = len(BUCKETS_LATENCIA)
+    lineas += [
+        '# HELP match_peticion_segundos Latencia de las peticiones por ruta.',
+        '# TYPE match_peticion_segundos histogram',
+    ]
+    for (metodo, ruta, estado), registro in rutas.items():
+        etiquetas = f'metodo="{metodo}",ruta="{_etiqueta(ruta)}",estado="{estado}"'
+        for limite, cantidad in zip(BUCKETS_LATENCIA, registro[:n]):
+            lineas.append(f'match_peticion_segundos_bucket{{{etiquetas},le="{limite}"}} {cantidad}')
+        lineas.append(f'match_peticion_segundos_bucket{{{etiquetas},le="+Inf"}} {registro[n]}')
+        lineas.append(f'match_peticion_segundos_sum{{{etiquetas}}} {registro[n + 1]:.6f}')
+        lineas.append(f'match_peticion_segundos_count{{{etiquetas}}} {registro[n]}')
+    for nombre, indice, ayuda in (
+        ('match_peticion_sqlite_segundos_total', n + 2, 'Tiempo de las peticiones pasado en SQLite.'),
+        ('match_peticion_plantillas_segundos_total', n + 3, 'Tiempo de las peticiones pasado en plantillas Jinja.'),
+    ):
+        lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} counter']
+        for (metodo, ruta, estado), registro in rutas.items():
+            etiquetas = f'metodo="{metodo}",ruta="{_etiqueta(ruta)}",estado="{estado}"'
+            lineas.append(f'{nombre}{{{etiquetas}}} {registro[indice]:.6f}')
+    return '\n'.join(lineas) + '\n'
+
+
+def reiniciar():
+    """Descarta las métricas acumuladas del proceso"""
+    with _lock:
+        _consultas.clear()
+        _rutas.clear()
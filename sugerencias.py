@@ -0,0 +1,230 @@
+"""
+Sugerencias precalculadas para los listados sin match.
+
+Para cada operación sin match se guardan en la tabla sugerencias sus
+SUGERENCIAS_POR_OPERACION mejores candidatas del otro lado con los
+criterios por defecto de la búsqueda manual (monto exacto, ±7 días) y en
+su mismo orden (diferencia de monto, de días, id). Los listados muestran
+la primera sin tener que abrir la búsqueda.
+
+actualizar_sugerencias compara las operaciones sin match actuales con las
+ya calculadas (tabla sugerencias_calculadas) y solo recalcula las
+afectadas por lo que cambió desde la última corrida:
+- las que quedaron sin match (importadas o de un match rechazado);
+- las que tenían como candidata a una operación que tomó match;
+- las que tienen en su ventana a una operación del otro lado que quedó libre.
+Las que tomaron match pierden sus sugerencias. Si no cambió nada, no se
+escribe nada; si cambió, sube la versión de sugerencias, que invalida las
+páginas cacheadas pero no los índices de candidatos.
+
+Corre al terminar cada importación, desde la CLI y, en la web, en un hilo
+de fondo después de cada escritura (programar): las peticiones no esperan
+el cálculo y varias escrituras seguidas se resuelven en una sola corrida.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from database import get_db, get_version_paginas
+from indice_candidatos import TABLAS, get_indice
+from conciliacion_automatica import generar_candidatos
+
+
+# Monto exacto: mejores_candidatos se apoya en que cada día es un solo monto
+CRITERIOS_SUGERENCIAS = {'monto': 'exacto', 'fecha': 7}
+SUGERENCIAS_POR_OPERACION = 3
+
+# Operaciones de origen por bloque de pares candidatos (limita la memoria)
+BLOQUE_ORIGENES = 50000
+
+# Cálculos sin el bloqueo de escritura antes de calcular con él tomado
+INTENTOS = 3
+
+# (lado de la operación, lado de sus candidatas)
+LADOS = (('ventas', 'banco'), ('banco', 'ventas'))
+
+
+def mejores_candidatos(origen, destino, posiciones, cantidad=SUGERENCIAS_POR_OPERACION):
+    """
+    Las mejores candidatas de destino para las posiciones de origen, por
+    bloques. Genera arrays (pos_origen, pos_destino, puesto,
+    diferencia_centavos, diferencia_dias) con hasta cantidad filas por
+    operación de origen.
+
+    Con monto exacto todas las candidatas de un mismo día empatan en
+    diferencia de monto y de días y se desempatan por id: de cada día
+    alcanza con las primeras cantidad.
+    """
+    for inicio in range(0, len(posiciones), BLOQUE_ORIGENES):
+        libres = np.zeros(len(origen.ids), dtype=bool)
+        libres[posiciones[inicio:inicio + BLOQUE_ORIGENES]] = True
+        pares_o, pares_d = generar_candidatos(origen, destino, CRITERIOS_SUGERENCIAS, libres,
+                                              limite_por_dia=cantidad)
+        diferencia_monto = np.abs(origen.centavos[pares_o] - destino.centavos[pares_d])
+        diferencia_dias = np.abs(origen.dias[pares_o] - destino.dias[pares_d])
+
+        orden = np.lexsort((destino.ids[pares_d], diferencia_dias, diferencia_monto, pares_o))
+        pares_o, pares_d = pares_o[orden], pares_d[orden]
+        diferencia_monto, diferencia_dias = diferencia_monto[orden], diferencia_dias[orden]
+
+        # Puesto de cada par dentro de su operación de origen
+        puesto = np.arange(len(pares_o)) - np.searchsorted(pares_o, pares_o, side='left')
+        mejores = puesto < cantidad
+        yield (pares_o[mejores], pares_d[mejores], puesto[mejores],
+               diferencia_monto[mejores], diferencia_dias[mejores])
+
+
+def _cargar_ids(cursor, ids):
+    """Deja los ids en la tabla temporal tmp_sugerencias_ids"""
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS tmp_sugerencias_ids (id INTEGER PRIMARY KEY)')
+    cursor.execute('DELETE FROM tmp_sugerencias_ids')
+    cursor.executemany('INSERT INTO tmp_sugerencias_ids VALUES (?)', ((i,) for i in ids.tolist()))
+
+
+def _ids(cursor, sql, params):
+    return np.array([row[0] for row in cursor.execute(sql, params).fetchall()], dtype=np.int64)
+
+
+def _calcular(cursor):
+    """
+    Calcula qué cambia, sin escribir en la base (solo tablas temporales).
+    Devuelve por lado (lado, ids a borrar, filas de sugerencias, ids
+    calculados, cantidad descartada).
+    """
+    indices = {lado: get_indice(lado) for lado in TABLAS}
+    nuevas, quitadas = {}, {}
+    for lado in TABLAS:
+        calculadas = _ids(cursor, 'SELECT operacion_id FROM sugerencias_calculadas WHERE lado = ?', (lado,))
+        nuevas[lado] = np.setdiff1d(indices[lado].ids, calculadas, assume_unique=True)
+        quitadas[lado] = np.setdiff1d(calculadas, indices[lado].ids, assume_unique=True)
+
+    cambios = []
+    for lado, otro in LADOS:
+        origen, destino = indices[lado], indices[otro]
+        afectadas = [nuevas[lado]]
+
+        # Las que sugerían una operación que ya no está libre
+        _cargar_ids(cursor, quitadas[otro])
+        afectadas.append(_ids(cursor, '''
+            SELECT DISTINCT s.operacion_id FROM sugerencias s
+            JOIN tmp_sugerencias_ids t ON t.id = s.candidato_id
+            WHERE s.lado = ?
+        ''', (lado,)))
+
+        # Las que tienen en su ventana una operación que quedó libre
+        if len(nuevas[otro]):
+            libres = np.isin(destino.ids, nuevas[otro])
+            pares_o, _ = generar_candidatos(origen, destino, CRITERIOS_SUGERENCIAS, None, libres,
+                                            limite_por_dia=1)
+            afectadas.append(origen.ids[np.unique(pares_o)])
+
+        afectadas = np.unique(np.concatenate(afectadas))
+
+        # Solo se recalculan las que siguen sin match
+        posiciones = np.flatnonzero(np.isin(origen.ids, afectadas))
+        filas = []
+        for pos_o, pos_d, puesto, diferencia_monto, diferencia_dias in mejores_candidatos(origen, destino, posiciones):
+            filas.extend(zip(
+                [lado] * len(pos_o), origen.ids[pos_o].tolist(), puesto.tolist(),
+                destino.ids[pos_d].tolist(), (diferencia_monto / 100).tolist(), diferencia_dias.tolist()
+            ))
+        cambios.append((lado, np.union1d(afectadas, quitadas[lado]), filas,
+                        origen.ids[posiciones].tolist(), len(quitadas[lado])))
+    return cambios
+
+
+def _escribir(cursor, cambios):
+    for lado, borrar, filas, calculadas, _ in cambios:
+        _cargar_ids(cursor, borrar)
+        for tabla in ('sugerencias', 'sugerencias_calculadas'):
+            cursor.execute(f'''
+                DELETE FROM {tabla}
+                WHERE lado = ? AND operacion_id IN (SELECT id FROM tmp_sugerencias_ids)
+            ''', (lado,))
+        cursor.executemany('INSERT INTO sugerencias VALUES (?, ?, ?, ?, ?, ?)', filas)
+        cursor.executemany('INSERT INTO sugerencias_calculadas VALUES (?, ?)', ((lado, i) for i in calculadas))
+    # Las páginas muestran sugerencias (ver get_version_paginas)
+    cursor.execute("UPDATE versiones SET valor = valor + 1 WHERE clave = 'sugerencias'")
+
+
+def actualizar_sugerencias():
+    """
+    Recalcula las sugerencias afectadas por los cambios desde la última
+    corrida.
+
+    Índices y candidatas se calculan sin bloquear a los demás escritores;
+    el bloqueo de escritura se toma solo para reemplazar las filas, si los
+    datos y las sugerencias siguen en la versión con la que se calculó. Si
+    cambiaron se vuelve a calcular; el último intento calcula con el
+    bloqueo tomado, para terminar aunque las escrituras no paren.
+    """
+    inicio = time.time()
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        for intento in range(1, INTENTOS + 1):
+            if intento == INTENTOS:
+                cursor.execute('BEGIN IMMEDIATE')
+                cambios = _calcular(cursor)
+            else:
+                version = get_version_paginas()
+                cambios = _calcular(cursor)
+                # Cierra la transacción implícita de las tablas temporales
+                conn.commit()
+                cursor.execute('BEGIN IMMEDIATE')
+                if get_version_paginas() != version:
+                    conn.rollback()
+                    continue
+
+            recalculadas = sum(len(calculadas) for _, _, _, calculadas, _ in cambios)
+            borradas = sum(descartadas for *_, descartadas in cambios)
+            if recalculadas or borradas:
+                _escribir(cursor, cambios)
+                conn.commit()
+            else:
+                conn.rollback()
+            break
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    segundos = time.time() - inicio
+    if recalculadas or borradas:
+        print(f"Sugerencias: {recalculadas} recalculadas, {borradas} descartadas en {segundos:.3f}s")
+    return {
+        'recalculadas': recalculadas,
+        'descartadas': borradas,
+        'intentos': intento,
+        'segundos': round(segundos, 3),
+    }
+
+
+# Hilo de fondo de la web: programar() marca que hay trabajo y el hilo
+# corre actualizar_sugerencias hasta que no quede nada marcado
+_pendiente = threading.Event()
+_hilo = None
+_lock = threading.Lock()
+
+
+def _trabajar():
+    while True:
+        _pendiente.wait()
+        _pendiente.clear()
+        try:
+            actualizar_sugerencias()
+        except Exception as e:
+            print(f"Error al actualizar sugerencias: {e}")
+
+
+def programar():
+    """Pide una actualización en segundo plano (no bloquea)"""
+    global _hilo
+    _pendiente.set()
+    with _lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_trabajar, name='sugerencias', daemon=True)
+            _hilo.start()